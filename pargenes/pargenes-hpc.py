@@ -4,11 +4,16 @@ import os
 scriptdir = os.path.dirname(os.path.realpath(__file__))
 sys.path.insert(0, os.path.join(scriptdir, 'pargenes_src'))
 import pargenescore
+import status
 
 import platform
 
 
 args = sys.argv
+if (len(args) > 1 and args[1] == "status"):
+  # progress of a running (or finished) run: pargenes-hpc.py status <output_dir>
+  status.main(args[2:])
+  sys.exit(0)
 args.append("--scheduler")
 if ("darwin" in platform.system().lower()):
   print("Warning: ParGenes hpc mode is not supported on MacOS. ParGenes will run in hpc-debug mode instead. For more information, read the wiki page about running ParGenes on MacOS")
@@ -4,10 +4,27 @@ import os
 scriptdir = os.path.dirname(os.path.realpath(__file__))
 sys.path.insert(0, os.path.join(scriptdir, 'pargenes_src'))
 import pargenescore
+import status
+
+def get_scheduler(args):
+  """ Value of the last --scheduler option of args, or None """
+  scheduler = None
+  for i, arg in enumerate(args):
+    if (arg == "--scheduler" and i + 1 < len(args)):
+      scheduler = args[i + 1]
+    elif (arg.startswith("--scheduler=")):
+      scheduler = arg[len("--scheduler="):]
+  return scheduler
 
 args = sys.argv
-args.append("--scheduler")
-args.append("fork")
+if (len(args) > 1 and args[1] == "status"):
+  # progress of a running (or finished) run: pargenes.py status <output_dir>
+  status.main(args[2:])
+  sys.exit(0)
+# the fork scheduler, unless the python scheduler is requested
+if (get_scheduler(args) != "python"):
+  args.append("--scheduler")
+  args.append("fork")
 pargenescore.run_pargenes(args)
 
 
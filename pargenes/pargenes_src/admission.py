@@ -0,0 +1,87 @@
+import os
+import math
+import logger
+
+"""
+Memory-aware admission of the jobs (--node-memory). The memory of each
+ML search, bootstrap and modeltest job is estimated from the memory
+computed at the parsing step (msa.memory, for one raxml-ng process,
+rescaled when the model changes), with a safety margin and a fixed
+per-process overhead. modeltest-ng evaluates one model per thread, up to
+MODELTEST_CATEGORIES rate categories, so its estimate grows with its
+threads and with the categories of its models.
+The other jobs (parsing, supports, constraints) are small and not counted.
+- with the python scheduler (and in the pipelined mode), a job only starts
+  when its memory fits in the memory left on the node. A job needing more
+  than the whole node memory runs alone.
+- with mpi-scheduler, which only knows about cores, each job reserves
+  enough cores for its memory: with N cores per node, a core stands for
+  1/N of the node memory. The big jobs get more cores (threads or MPI
+  ranks), so less jobs run next to them, and the other jobs keep their
+  number of cores.
+"""
+
+# safety margin on the memory estimates of raxml-ng
+MEMORY_MARGIN = 1.2
+# memory of a process on top of its data (binary, buffers), in MB
+PROCESS_MEMORY_MB = 50.0
+# rate categories of the +G models evaluated by modeltest-ng
+MODELTEST_CATEGORIES = 4
+
+def is_enabled(op):
+  return op.node_memory > 0
+
+def get_cores_per_node(op):
+  if (op.cores_per_node > 0):
+    return min(op.cores_per_node, op.cores)
+  return op.cores
+
+def get_job_memory(msa, cores, step = "raxml", parse_categories = 1):
+  """ Estimated memory of a job of msa running on cores, in MB (0 if unknown).
+  parse_categories is the number of rate categories of the model msa.memory
+  was computed with, for the modeltest jobs """
+  if (msa.memory <= 0):
+    return 0.0
+  memory = msa.memory
+  if (step == "modeltest"):
+    memory *= cores * float(MODELTEST_CATEGORIES) / max(1, parse_categories)
+  return memory * MEMORY_MARGIN + PROCESS_MEMORY_MB
+
+def reserve_memory_cores(commands, op):
+  """ Increase the number of cores of the commands that need more memory
+  than the memory of their cores (schedulers without memory admission) """
+  cores_per_node = get_cores_per_node(op)
+  memory_per_core = float(op.node_memory) / float(cores_per_node)
+  increased = 0
+  too_big = 0
+  for command in commands:
+    if (command.memory > op.node_memory):
+      too_big += 1
+    needed = min(cores_per_node, int(math.ceil(command.memory / memory_per_core)))
+    if (needed > int(command.cores)):
+      command.cores = needed
+      increased += 1
+  if (increased > 0):
+    logger.info("Increased the number of cores of " + str(increased) + " jobs to reserve their memory (" + str(int(memory_per_core)) + "MB per core)")
+  if (too_big > 0):
+    logger.warning(str(too_big) + " jobs might need more than the memory of a node (" + str(op.node_memory) + "MB)")
+
+def get_jobs_memory_file(run_path):
+  return os.path.join(run_path, "jobs_memory.txt")
+
+def write_jobs_memory(commands, run_path):
+  """ Record the memory of the commands for the python scheduler, which
+  only reads the commands files """
+  with open(get_jobs_memory_file(run_path), "a") as writer:
+    for command in commands:
+      writer.write(command.name + " " + str(round(command.memory, 1)) + "\n")
+
+def read_jobs_memory(run_path):
+  memory = {}
+  path = get_jobs_memory_file(run_path)
+  if (os.path.isfile(path)):
+    for line in open(path).readlines():
+      split = line.split()
+      if (len(split) == 2):
+        memory[split[0]] = float(split[1])
+  return memory
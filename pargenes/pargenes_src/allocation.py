@@ -0,0 +1,86 @@
+import heapq
+import logger
+import costmodel
+
+"""
+Makespan-oriented allocation of the per-family number of cores
+(--core-assignment makespan). The jobs of a family are moldable: they can
+run on any number of threads between the minimum and the maximum
+suggested by raxml-ng. Their runtime on p threads follows Amdahl's law,
+with a sequential fraction such that the parallel efficiency at the
+number of threads recommended by raxml-ng is TARGET_EFFICIENCY.
+All the families start with their minimum number of threads, and the
+families with the longest jobs get more threads as long as it reduces
+the lower bound of the makespan: max(total work / cores, longest job).
+"""
+
+# parallel efficiency at the number of threads recommended by raxml-ng
+TARGET_EFFICIENCY = 0.75
+
+def get_sequential_fraction(recommended_cores):
+  """ Sequential fraction s of Amdahl's law such that the efficiency
+  1 / (p * s + 1 - s) is TARGET_EFFICIENCY with p = recommended_cores """
+  if (recommended_cores <= 1):
+    return 1.0 / TARGET_EFFICIENCY - 1.0
+  return (1.0 / TARGET_EFFICIENCY - 1.0) / float(recommended_cores - 1)
+
+class Family:
+  def __init__(self, msa, work, jobs, max_cores):
+    self.msa = msa
+    # runtime of one job on a single thread
+    self.work = work
+    # number of jobs (in single tree search equivalent)
+    self.jobs = jobs
+    self.sequential = min(1.0, get_sequential_fraction(msa.cores))
+    self.cores = max(1, min(msa.min_cores, max_cores))
+    self.max_cores = max(self.cores, min(msa.max_cores, max_cores))
+
+  def get_runtime(self, cores):
+    return self.work * (self.sequential + (1.0 - self.sequential) / float(cores))
+
+  def get_area(self, cores):
+    return self.jobs * cores * self.get_runtime(cores)
+
+def get_single_thread_work(msa, op):
+  """ Predicted runtime of one tree search of msa on one thread,
+  or its taxa * per_taxon_clv_size size without runtime history """
+  seconds = costmodel.predict_seconds(costmodel.get_features(msa, "mlsearch", 1, 1, op))
+  if (seconds != None):
+    return seconds
+  return float(msa.taxa * msa.per_taxon_clv_size)
+
+def allocate_cores(msas, op):
+  """ Choose the number of cores of each valid MSA to minimize
+  the predicted makespan on op.cores cores """
+  jobs = max(1, op.random_starting_trees + op.parsimony_starting_trees + op.bootstraps)
+  families = []
+  for name, msa in msas.items():
+    if (not msa.valid):
+      continue
+    families.append(Family(msa, get_single_thread_work(msa, op), jobs, op.cores))
+  if (len(families) == 0):
+    return
+  area = sum(f.get_area(f.cores) for f in families)
+  # families sorted by decreasing job runtime
+  heap = [(-f.get_runtime(f.cores), i) for i, f in enumerate(families)]
+  heapq.heapify(heap)
+  while (len(heap) > 0):
+    runtime, i = heapq.heappop(heap)
+    family = families[i]
+    if (family.cores >= family.max_cores):
+      # the longest job cannot be accelerated anymore
+      break
+    lower_bound = max(area / op.cores, -runtime)
+    new_area = area - family.get_area(family.cores) + family.get_area(family.cores + 1)
+    new_runtime = family.get_runtime(family.cores + 1)
+    if (max(new_area / op.cores, new_runtime) >= lower_bound):
+      break
+    family.cores += 1
+    area = new_area
+    heapq.heappush(heap, (-new_runtime, i))
+  longest = max(f.get_runtime(f.cores) for f in families)
+  for family in families:
+    family.msa.cores = family.cores
+    family.msa.allocated_cores = family.cores
+  logger.info("  Makespan core allocation: predicted makespan lower bound " + str(round(max(area / op.cores, longest), 2)) + " (work " + str(round(area / op.cores, 2)) + ", longest job " + str(round(longest, 2)) + ")")
+  logger.info("  Cores per job between " + str(min(f.cores for f in families)) + " and " + str(max(f.cores for f in families)))
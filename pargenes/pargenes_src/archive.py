@@ -0,0 +1,248 @@
+import os
+import gzip
+import bz2
+import lzma
+import shutil
+import tarfile
+import logger
+
+"""
+Alignments packed in a single file (-a pointing to a file instead of a
+directory), to avoid creating one file per MSA on shared filesystems:
+- a tar archive (optionally gzip, bzip2 or xz compressed), with one MSA
+  per member
+- a multi-MSA stream (optionally gzip, bzip2 or xz compressed): the MSAs are
+  concatenated, each one starting with a line "#MSA <file name>"
+The members are indexed once (alignments_index.txt in the output
+directory). The MSAs are extracted into the staging directory
+(--alignments-scratch-dir), which can be on a node-local or fast
+filesystem visible from the nodes running the jobs, just before the
+jobs reading them run: stage_commands extracts the MSAs read by a batch
+of jobs (only the jobs that still have to run), and stage_msas the MSAs
+read by ParGenes itself (content hashes of --cache-dir and --deduplicate,
+native scanner). The staged MSA of a family is removed once its ML searches
+and bootstraps are done (release_msas), as the later steps only read
+trees. Uncompressed members are read directly at their offset, compressed
+archives are streamed once per batch to extract all the requested members.
+results.db records the MSAs as <archive>:<member>.
+"""
+
+MSA_STREAM_MARKER = "#MSA "
+
+def get_compression(path):
+  """ Compression of a file, from its magic number """
+  with open(path, "rb") as reader:
+    magic = reader.read(6)
+  if (magic.startswith(b"\x1f\x8b")):
+    return "gz"
+  if (magic.startswith(b"\xfd7zXZ\x00")):
+    return "xz"
+  if (magic.startswith(b"BZh")):
+    return "bz2"
+  return ""
+
+def open_stream(path, compression):
+  if (compression == "gz"):
+    return gzip.open(path, "rb")
+  if (compression == "xz"):
+    return lzma.open(path, "rb")
+  if (compression == "bz2"):
+    return bz2.open(path, "rb")
+  return open(path, "rb")
+
+def is_archive_input(op):
+  return op.alignments_dir != None and os.path.isfile(op.alignments_dir)
+
+def get_staging_dir(op):
+  if (op.alignments_scratch_dir):
+    return op.alignments_scratch_dir
+  return os.path.join(op.output_dir, "staged_msas")
+
+def get_index_file(op):
+  return os.path.join(op.output_dir, "alignments_index.txt")
+
+def get_archive_signature(path):
+  stat = os.stat(path)
+  return os.path.abspath(path) + " " + str(stat.st_size) + " " + str(int(stat.st_mtime))
+
+def index_tar(path, compression):
+  """ (member file name, offset, size) of the files of a tar archive.
+  The offsets are only usable for uncompressed archives """
+  members = []
+  with tarfile.open(path, "r:*") as tar:
+    for member in tar:
+      if (not member.isfile()):
+        continue
+      offset = -1
+      if (compression == "" and not member.issparse()):
+        offset = member.offset_data
+      members.append((os.path.basename(member.name), offset, member.size))
+  return members
+
+def index_stream(path, compression):
+  """ (MSA file name, offset, size) of the MSAs of a multi-MSA stream.
+  The offsets are positions in the decompressed stream """
+  members = []
+  offset = 0
+  with open_stream(path, compression) as reader:
+    for line in reader:
+      if (line.startswith(MSA_STREAM_MARKER.encode())):
+        if (len(members) > 0):
+          name, start, size = members[-1]
+          members[-1] = (name, start, offset - start)
+        members.append((line[len(MSA_STREAM_MARKER):].decode().strip(), offset + len(line), 0))
+      elif (len(members) == 0 and len(line.strip()) > 0):
+        raise ValueError("The multi-MSA file " + path + " should start with a \"" + MSA_STREAM_MARKER + "<file name>\" line")
+      offset += len(line)
+  if (len(members) > 0):
+    name, start, size = members[-1]
+    members[-1] = (name, start, offset - start)
+  return members
+
+def read_index(op):
+  """ Return the kind of the archive, its compression and its members,
+  indexing the archive if it was not indexed yet """
+  path = op.alignments_dir
+  index_file = get_index_file(op)
+  signature = get_archive_signature(path)
+  if (os.path.isfile(index_file)):
+    lines = open(index_file).readlines()
+    if (len(lines) > 0 and lines[0].strip() == signature):
+      kind, compression = (lines[1].strip().split(" ") + [""])[:2]
+      members = []
+      for line in lines[2:]:
+        name, offset, size = line.rstrip("\n").rsplit(" ", 2)
+        members.append((name, int(offset), int(size)))
+      return kind, compression, members
+  compression = get_compression(path)
+  if (tarfile.is_tarfile(path)):
+    kind = "tar"
+    members = index_tar(path, compression)
+  else:
+    kind = "stream"
+    members = index_stream(path, compression)
+  names = set()
+  for name, offset, size in members:
+    if (name in names):
+      raise ValueError("The MSA file name " + name + " appears twice in " + path)
+    names.add(name)
+  with open(index_file + ".tmp", "w") as writer:
+    writer.write(signature + "\n")
+    writer.write(kind + " " + compression + "\n")
+    for name, offset, size in members:
+      writer.write(name + " " + str(offset) + " " + str(size) + "\n")
+  os.replace(index_file + ".tmp", index_file)
+  logger.info("Indexed " + str(len(members)) + " MSAs in " + path)
+  return kind, compression, members
+
+def get_staged_path(op, name):
+  return os.path.join(get_staging_dir(op), name)
+
+def get_member_name(path, op):
+  """ Name of the archive member staged at path, or None if path is not
+  in the staging directory """
+  if (os.path.dirname(os.path.abspath(path)) != os.path.abspath(get_staging_dir(op))):
+    return None
+  return os.path.basename(path)
+
+def get_source_path(msa, op):
+  """ Path of the input MSA of msa: <archive>:<member> for an archive member """
+  if (is_archive_input(op)):
+    name = get_member_name(msa.path, op)
+    if (name != None):
+      return os.path.abspath(op.alignments_dir) + ":" + name
+  return msa.path
+
+def get_msa_files(op):
+  """ (MSA file name, staged path) of all the MSAs of the archive """
+  kind, compression, members = read_index(op)
+  staging_dir = get_staging_dir(op)
+  return [(name, os.path.join(staging_dir, name)) for name, offset, size in members]
+
+def write_staged(path, reader, size):
+  """ Copy size bytes from reader into path, atomically """
+  with open(path + ".tmp", "wb") as writer:
+    while (size > 0):
+      block = reader.read(min(size, 1 << 20))
+      if (len(block) == 0):
+        break
+      writer.write(block)
+      size -= len(block)
+  os.replace(path + ".tmp", path)
+
+def extract_members(names, op):
+  """ Extract the members of names that are not in the staging directory yet """
+  staging_dir = get_staging_dir(op)
+  names = set(name for name in names if not os.path.isfile(os.path.join(staging_dir, name)))
+  if (len(names) == 0):
+    return
+  kind, compression, members = read_index(op)
+  missing = {}
+  for name, offset, size in members:
+    if (name in names):
+      missing[name] = (offset, size)
+  if (len(missing) == 0):
+    return
+  os.makedirs(staging_dir, exist_ok = True)
+  archive = op.alignments_dir
+  if (kind == "tar" and compression != ""):
+    # no random access: stream the archive once
+    remaining = len(missing)
+    with tarfile.open(archive, "r|*") as tar:
+      for member in tar:
+        name = os.path.basename(member.name)
+        if (member.isfile() and name in missing):
+          write_staged(os.path.join(staging_dir, name), tar.extractfile(member), member.size)
+          remaining -= 1
+          if (remaining == 0):
+            break
+  elif (compression != ""):
+    with open_stream(archive, compression) as reader:
+      position = 0
+      for name, (offset, size) in sorted(missing.items(), key = lambda x: x[1][0]):
+        reader.seek(offset - position, os.SEEK_CUR)
+        write_staged(os.path.join(staging_dir, name), reader, size)
+        position = offset + size
+  else:
+    with open(archive, "rb") as reader:
+      for name, (offset, size) in missing.items():
+        reader.seek(offset)
+        write_staged(os.path.join(staging_dir, name), reader, size)
+  logger.info("Extracted " + str(len(missing)) + " MSAs from " + archive + " into " + staging_dir)
+
+def stage_msas(msas, op):
+  """ Extract the MSA files of msas (a list of MSAs) if they are not staged yet """
+  if (not is_archive_input(op)):
+    return
+  names = [get_member_name(msa.path, op) for msa in msas]
+  extract_members([name for name in names if name != None], op)
+
+def stage_commands(commands, op):
+  """ Extract the MSA files read by commands if they are not staged yet """
+  if (not is_archive_input(op)):
+    return
+  names = []
+  for command in commands:
+    for arg in command.args.split():
+      name = get_member_name(arg, op)
+      if (name != None):
+        names.append(name)
+  extract_members(names, op)
+
+def release_msas(msas, op):
+  """ Remove the staged MSA files of msas (a list of MSAs), once no job
+  reads them anymore. They are extracted again if needed """
+  if (not is_archive_input(op)):
+    return
+  for msa in msas:
+    name = get_member_name(msa.path, op)
+    if (name != None):
+      try:
+        os.remove(get_staged_path(op, name))
+      except OSError:
+        pass
+
+def remove_staged_msas(op):
+  staging_dir = get_staging_dir(op)
+  if (os.path.isdir(staging_dir)):
+    shutil.rmtree(staging_dir, ignore_errors = True)
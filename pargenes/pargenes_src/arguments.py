@@ -53,9 +53,44 @@ def parse_arguments(args):
     action="store_true",
     default=False,
     help="")
+  parser.add_argument("--plan",
+    dest="plan",
+    nargs="?",
+    const="auto",
+    default="",
+    help="Stop after the parsing step and simulate the run on several numbers of cores (comma-separated list, e.g. --plan 16,64,256; by default powers of two), reporting the predicted wall time, per-step makespan, core utilization and peak memory")
   parser.add_argument('-a', "--alignments-dir",
     dest="alignments_dir",
-    help="Directory containing the fasta files")
+    help="Directory containing the fasta files, or a tar archive of the MSAs, or a multi-MSA file in which each MSA starts with a line \"#MSA <file name>\" (archives and multi-MSA files can be gzip or xz compressed)")
+  parser.add_argument("--output-layout",
+    dest="output_layout",
+    choices=["flat", "sharded"],
+    default="",
+    help="Layout of the per-family result directories: flat (one directory per family in each results directory, default) or sharded (the family directories are grouped into subdirectories named after a hash prefix of the family name, to keep the directories small). Ignored with --continue, which keeps the layout of the output directory")
+  parser.add_argument("--msa-scanner",
+    dest="msa_scanner",
+    choices=["raxml", "native"],
+    default="raxml",
+    help="How the MSAs are validated and sized: raxml (one raxml-ng --parse job per MSA, default) or native (in-process scan of the FASTA and PHYLIP files, without binary MSA files; the other MSAs are parsed by raxml-ng)")
+  parser.add_argument("--retention",
+    dest="retention",
+    choices=["all", "lean"],
+    default="all",
+    help="Retention of the intermediate files: all (keep everything, default) or lean (delete the searches from each starting tree, the bootstrap chunks, the binary MSAs and old_parse_run as soon as they are not needed anymore; the deleted files are listed in retention_manifest.txt)")
+  parser.add_argument("--pack-intermediates",
+    dest="pack_intermediates",
+    action="store_true",
+    default=False,
+    help="Pack the finished intermediate files (the searches from each starting tree, the bootstrap chunks and the per-job logs) into one tar archive per kind and step, to reduce the number of files of the output directory")
+  parser.add_argument("--deduplicate",
+    dest="deduplicate",
+    action="store_true",
+    default=False,
+    help="Only analyse once the MSAs with the same content (the same sequences, in any order) and the same per-MSA options. The results of the other MSAs (listed in duplicates.txt) are linked from the results of the analysed one at the end of the run")
+  parser.add_argument("--alignments-scratch-dir",
+    dest="alignments_scratch_dir",
+    default="",
+    help="When the alignments are read from an archive or a multi-MSA file, directory where the MSAs are extracted when the jobs need them (it must be readable from all the nodes). Default: staged_msas in the output directory")
   parser.add_argument('-o', "--output-dir",
     dest="output_dir",
     help="Output directory")
@@ -83,14 +118,14 @@ def parse_arguments(args):
     help="Alignments datatype")
   parser.add_argument("--scheduler",
     dest="scheduler",
-    choices=["split", "onecore", "fork"],
+    choices=["split", "onecore", "fork", "python"],
     default="split",
-    help="Expert-user only.")
+    help="Expert-user only. python runs the jobs on the local node with a scheduler written in python, which does not need MPI nor the mpi-scheduler binary")
   parser.add_argument("--core-assignment",
     dest="core_assignment",
-    choices=["high", "medium", "low"],
+    choices=["high", "medium", "low", "makespan"],
     default="medium",
-    help="Policy to decide the per-job number of cores (low favors a low per-job number of cores)")
+    help="Policy to decide the per-job number of cores (low favors a low per-job number of cores). makespan chooses the number of cores of each job between the minimum and maximum suggested by raxml-ng, to minimize the predicted total runtime on the available cores")
   parser.add_argument("--valgrind",
     dest="valgrind",
     action="store_true",
@@ -101,6 +136,17 @@ def parse_arguments(args):
     action="store_true",
     default=False,
     help="Constrain the raxml searches")
+  parser.add_argument("--pipeline",
+    dest="pipeline",
+    action="store_true",
+    default=False,
+    help="Pipelined execution: each MSA starts its next step (modeltest, ML search, bootstraps, supports) as soon as its own jobs are done, without waiting for the other MSAs. Only available with the fork and python schedulers (pargenes.py)")
+  parser.add_argument("--cache-dir",
+    dest="cache_dir",
+    help="Directory of a persistent cache shared between runs. The MSAs that were already processed with the same options are not processed again, and their results are copied from the cache. The cache also stores the parsing step results (binary MSAs), that are used in place")
+  parser.add_argument("--runtime-history",
+    dest="runtime_history",
+    help="File recording the runtimes of the jobs, shared between runs. The recorded runtimes are used to predict the cost of the jobs and to schedule the longest jobs first. Defaults to runtimes.txt in the --cache-dir directory, if any")
   parser.add_argument("--job-failure-fatal",
     dest="job_failure_fatal",
     action="store_true",
@@ -131,11 +177,21 @@ def parse_arguments(args):
     type=int,
     default=0,
     help="The number of bootstrap trees to compute")
+  parser.add_argument("--adaptive-starting-trees",
+    dest="adaptive_starting_trees",
+    action="store_true",
+    default=False,
+    help="Run the ML searches of each family in waves of 3 starting trees, and stop starting new searches once the 2 best trees have the same topology and log-likelihoods within 0.1. -s and -p then give the maximum number of starting trees")
   parser.add_argument("--autoMRE",
     dest="autoMRE",
     action="store_true",
     default=False,
     help="Stop computing bootstrap trees after autoMRE bootstrap convergence test. You have to specify the maximum number of bootstrap trees with -b or --bs-tree")
+  parser.add_argument("--parallel-autoMRE",
+    dest="parallel_autoMRE",
+    action="store_true",
+    default=False,
+    help="With --autoMRE, compute the bootstrap trees of each family with parallel jobs, and let ParGenes test the autoMRE convergence every 50 trees, instead of running one raxml-ng autoMRE job per family")
   parser.add_argument("--raxml-binary",
     dest="raxml_binary",
     default="",
@@ -167,6 +223,11 @@ def parse_arguments(args):
     type=int,
     default=16,
     help="Number of cores to assign to each modeltest core (at least 4)")
+  parser.add_argument("--model-reparse",
+    dest="model_reparse",
+    choices=["all", "changed"],
+    default="all",
+    help="After modeltest, parse again all the MSAs with their new model (all), or derive the new MSA sizes from the models and only parse again the MSAs for which this is not possible (changed)")
   parser.add_argument("--modeltest-binary",
     dest="modeltest_binary",
     default="",
@@ -206,10 +267,36 @@ def parse_arguments(args):
     type=int,
     default=0,
     help="Number of time the scheduler should try to restart after an error")
+  parser.add_argument("--status-interval",
+    dest="status_interval",
+    type=int,
+    default=0,
+    help="Rewrite the progress of the run (jobs done, running and failed per step, throughput and ETA) into status.txt in the output directory every STATUS_INTERVAL seconds. The same report is printed by \"pargenes.py status <output_dir>\"")
+  parser.add_argument("--disable-job-accounting",
+    dest="disable_job_accounting",
+    action="store_true",
+    default=False,
+    help="Do not record the resources used by each job (wall time, CPU time, peak memory, I/O) in job_resources.txt in the step directories. The jobs are only accounted with the fork and python schedulers")
+  parser.add_argument("--retry-failed-jobs",
+    dest="retry_failed_jobs",
+    type=int,
+    default=0,
+    help="Number of times the failed jobs are run again. The failures are classified from the job logs (oom, timeout, segfault, bad_input, unknown): the oom and timeout jobs get twice more cores, the bad_input jobs are not retried (see job_failures.txt in the step directories)")
+  parser.add_argument("--node-memory",
+    dest="node_memory",
+    type=float,
+    default=0.0,
+    help="Memory available for the jobs on each node, in MB. The memory of the ML search, bootstrap and modeltest jobs is estimated at the parsing step: with the python scheduler (and with --pipeline), a job only starts if it fits in the free memory, and with the other schedulers, the jobs needing more memory than the memory of their cores get more cores. Disabled by default")
+  parser.add_argument("--cores-per-node",
+    dest="cores_per_node",
+    type=int,
+    default=0,
+    help="Number of cores of each node, used with --node-memory to compute the memory of a core. By default, the total number of cores (-c)")
   op = parser.parse_args()
   # after parse
   print("after parse:")
-  check_argument_dir(op.alignments_dir, "alignment")
+  if (op.alignments_dir != None and not os.path.isfile(op.alignments_dir)):
+    check_argument_dir(op.alignments_dir, "alignment")
   check_argument_file(op.msa_filter, "msa filter")
   check_argument_file(op.per_msa_raxml_parameters, "per_msa_raxml_parameters")
   check_argument_file(op.raxml_global_parameters, "raxml_global_parameters")
@@ -225,7 +312,15 @@ def parse_arguments(args):
   check_mandatory_field(op.output_dir, "output directory (\"-o\")")
   if (op.autoMRE and op.bootstraps < 1):
     exit_msg("When using autoMRE option, you need to specify the maximum number of boostraps with --bs-trees")
-  if (not len(os.listdir(op.alignments_dir))):
+  if (op.parallel_autoMRE and not op.autoMRE):
+    exit_msg("The --parallel-autoMRE option requires --autoMRE")
+  if (op.plan != "" and op.plan != "auto"):
+    for cores in op.plan.split(","):
+      if (cores.strip() != "" and (not cores.strip().isdigit() or int(cores) < 1)):
+        exit_msg("Invalid number of cores \"" + cores + "\" in --plan " + op.plan + ": expected a comma-separated list of positive integers (e.g. --plan 16,64,256)")
+  if (op.pipeline and op.scheduler != "fork" and op.scheduler != "python"):
+    exit_msg("The --pipeline option is only available with the fork and python schedulers (pargenes.py)")
+  if (os.path.isdir(op.alignments_dir) and not len(os.listdir(op.alignments_dir))):
     exit_msg("Please provide a non empty alignments directory.")
   if (op.cores < 2):
     exit_msg("Please set the number of cores (--cores or -c) to at least 2")
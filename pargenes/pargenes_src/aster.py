@@ -5,6 +5,8 @@ import arguments
 import logger
 import time
 import report
+import resultsdb
+import layout
 
 def treat_newick(newick):
   return newick.replace("@", "at")
@@ -12,9 +14,26 @@ def treat_newick(newick):
 def get_gene_trees_file(pargenes_dir):
   return os.path.join(pargenes_dir, "aster_run", "gene_trees.newick")
 
+def extract_gene_trees_indexed(pargenes_dir, gene_trees_filename, kind):
+  """ Write the gene trees of kind listed in the results index """
+  count = 0
+  with open(gene_trees_filename, "w") as writer:
+    for family, tree_file in resultsdb.get_files(pargenes_dir, kind):
+      try:
+        with open(tree_file) as reader:
+          writer.write(treat_newick(reader.read()))
+        count += 1
+      except OSError:
+        continue
+  return count
+
 def extract_gene_trees_support(pargenes_dir, gene_trees_filename):
   results = os.path.join(pargenes_dir, "supports_run", "results")
   count = 0
+  if (resultsdb.has_outputs(pargenes_dir)):
+    count = extract_gene_trees_indexed(pargenes_dir, gene_trees_filename, "support")
+    logger.info("ParGenes/Aster: " + str(count) + " gene trees (with support values) were found in ParGenes results index")
+    return
   with open(gene_trees_filename, "w") as writer:
     for f in os.listdir(results):
       if (f.endswith(".raxml.support") and not "tbe" in f):
@@ -26,9 +45,13 @@ def extract_gene_trees_support(pargenes_dir, gene_trees_filename):
 def extract_gene_trees_ml(pargenes_dir, gene_trees_filename):
   results = os.path.join(pargenes_dir, "mlsearch_run", "results")
   count = 0
+  if (resultsdb.has_outputs(pargenes_dir)):
+    count = extract_gene_trees_indexed(pargenes_dir, gene_trees_filename, "best_tree")
+    logger.info("ParGenes/Aster: " + str(count) + " trees were found in ParGenes results index")
+    return
   with open(gene_trees_filename, "w") as writer:
-    for msa in os.listdir(results):
-      tree_file = os.path.join(results, msa, msa + ".raxml.bestTree")
+    for msa in layout.list_families(results):
+      tree_file = os.path.join(layout.get_family_dir(results, msa), msa + ".raxml.bestTree")
       try:
         with open(tree_file) as reader:
           writer.write(treat_newick(reader.read()))
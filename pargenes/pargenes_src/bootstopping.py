@@ -0,0 +1,168 @@
+import os
+import random
+import logger
+import layout
+
+"""
+MRE-based bootstopping (autoMRE) evaluated by ParGenes, so that the
+bootstrap trees of a family can be computed by parallel jobs.
+The bootstrap trees are computed in waves of BOOTSTOPPING_INTERVAL
+trees. After each wave, the trees are randomly split in two halves
+BOOTSTOPPING_PERMUTATIONS times, and the weighted Robinson-Foulds distance
+between the extended majority-rule consensus trees of the two halves is
+computed. The family has converged when the distance is below
+BOOTSTOPPING_CUTOFF for at least 99% of the permutations, like the
+autoMRE criterion of raxml-ng.
+"""
+
+# number of bootstrap trees between two convergence tests
+BOOTSTOPPING_INTERVAL = 50
+BOOTSTOPPING_PERMUTATIONS = 100
+BOOTSTOPPING_CUTOFF = 0.03
+
+def read_leaves(newick):
+  """ Names of the leaves of a newick tree """
+  leaves = []
+  token = ""
+  after_clade = False
+  in_length = False
+  for c in newick:
+    if (c in "(),;"):
+      if (len(token) > 0 and not after_clade):
+        leaves.append(token.strip("'\""))
+      token = ""
+      in_length = False
+      after_clade = (c == ")")
+    elif (c == ":"):
+      if (len(token) > 0 and not after_clade):
+        leaves.append(token.strip("'\""))
+      token = ""
+      in_length = True
+      after_clade = True
+    elif (not in_length and not c.isspace()):
+      token += c
+  return leaves
+
+def get_splits(newick, taxa_index):
+  """ Non-trivial bipartitions of an unrooted newick tree, as bitmasks of
+  the taxa of the side that does not contain the first taxon """
+  full_mask = (1 << len(taxa_index)) - 1
+  splits = []
+  # taxa bitmask of the clades being read
+  stack = [0]
+  token = ""
+  after_clade = False
+  in_length = False
+  for c in newick:
+    if (c in "(),;:"):
+      if (len(token) > 0 and not after_clade):
+        stack[-1] |= 1 << taxa_index[token.strip("'\"")]
+      token = ""
+      in_length = (c == ":")
+      if (c == ":"):
+        after_clade = True
+        continue
+      after_clade = False
+      if (c == "("):
+        stack.append(0)
+      elif (c == ")"):
+        mask = stack.pop()
+        stack[-1] |= mask
+        splits.append(mask)
+        after_clade = True
+    elif (not in_length and not c.isspace()):
+      token += c
+  result = set()
+  for mask in splits:
+    if (mask & 1):
+      mask = full_mask ^ mask
+    size = bin(mask).count("1")
+    if (size > 1 and size < len(taxa_index) - 1):
+      result.add(mask)
+  return list(result)
+
+def read_bootstrap_trees(bootstraps_dir, msa_name):
+  """ All the bootstrap trees computed so far for a family """
+  trees = []
+  family_dir = layout.get_family_dir(bootstraps_dir, msa_name)
+  for bs_file in sorted(layout.listdir(family_dir)):
+    if (bs_file.endswith("bootstraps")):
+      with layout.open_file(os.path.join(family_dir, bs_file)) as reader:
+        for line in reader.readlines():
+          if (line.strip().endswith(";")):
+            trees.append(line.strip())
+  return trees
+
+def is_compatible(split, splits):
+  for other in splits:
+    common = split & other
+    if (common != 0 and common != split and common != other):
+      return False
+  return True
+
+def get_mre_consensus(frequencies):
+  """ Extended majority-rule consensus: the splits are added by decreasing
+  frequency when they are compatible with the splits already added """
+  consensus = {}
+  for split, frequency in sorted(frequencies.items(), key = lambda x: (-x[1], x[0])):
+    if (frequency > 0.5 or is_compatible(split, consensus.keys())):
+      consensus[split] = frequency
+  return consensus
+
+def get_frequencies(trees_splits, indices):
+  counts = {}
+  for i in indices:
+    for split in trees_splits[i]:
+      counts[split] = counts.get(split, 0) + 1
+  total = float(len(indices))
+  return dict((split, count / total) for split, count in counts.items())
+
+def get_weighted_rf(consensus1, consensus2):
+  """ Weighted RF distance between two consensus trees, normalized by the
+  sum of the supports """
+  distance = 0.0
+  total = 0.0
+  for split in set(consensus1.keys()) | set(consensus2.keys()):
+    w1 = consensus1.get(split, 0.0)
+    w2 = consensus2.get(split, 0.0)
+    distance += abs(w1 - w2)
+    total += w1 + w2
+  if (total == 0.0):
+    return 0.0
+  return distance / total
+
+def has_converged(trees, seed):
+  """ MRE-based bootstopping test on a set of newick trees """
+  if (len(trees) < 2):
+    return False
+  taxa = sorted(read_leaves(trees[0]))
+  taxa_index = dict((taxon, i) for i, taxon in enumerate(taxa))
+  try:
+    trees_splits = [get_splits(tree, taxa_index) for tree in trees]
+  except KeyError:
+    logger.warning("The bootstrap trees do not have the same taxa, cannot test their convergence")
+    return False
+  rng = random.Random(seed)
+  indices = list(range(0, len(trees)))
+  half = len(indices) // 2
+  below_cutoff = 0
+  for permutation in range(0, BOOTSTOPPING_PERMUTATIONS):
+    rng.shuffle(indices)
+    consensus1 = get_mre_consensus(get_frequencies(trees_splits, indices[:half]))
+    consensus2 = get_mre_consensus(get_frequencies(trees_splits, indices[half:]))
+    if (get_weighted_rf(consensus1, consensus2) <= BOOTSTOPPING_CUTOFF):
+      below_cutoff += 1
+  return below_cutoff >= 0.99 * BOOTSTOPPING_PERMUTATIONS
+
+def get_wave_chunks(chunk_size):
+  """ Number of bootstrap jobs of each wave of a family """
+  return max(1, (BOOTSTOPPING_INTERVAL + chunk_size - 1) // chunk_size)
+
+def check_family(bootstraps_dir, msa_name, run_path, op):
+  """ Test the convergence of the bootstrap trees of a family and log
+  the result in bootstopping.txt. Return True if it converged """
+  trees = read_bootstrap_trees(bootstraps_dir, msa_name)
+  converged = has_converged(trees, op.seed)
+  with open(os.path.join(run_path, "bootstopping.txt"), "a") as writer:
+    writer.write(msa_name + " " + str(len(trees)) + " " + str(int(converged)) + "\n")
+  return converged
@@ -4,7 +4,42 @@ import shutil
 import time
 import scheduler
 import logger
+import raxml
+import resultsdb
 import multiprocessing 
+import layout
+import retention
+
+def get_support_commands(msa, ml_trees_dir, concatenated_dir, support_results, scheduler_mode):
+  """ Build the raxml-ng --support commands of one MSA (one per
+  bootstrap metric). Return no command if there is no bootstrap tree """
+  fasta = msa.name
+  raxml_arguments = msa.get_raxml_arguments_str()
+  bs_metrics = ["", "tbe"]
+  commands = []
+  for bs_metric in bs_metrics:
+    ml_tree = os.path.join(layout.get_family_dir(ml_trees_dir, fasta), fasta + ".raxml.bestTree")
+    bs_trees = os.path.join(concatenated_dir, fasta + ".bs")
+    if (not os.path.exists(bs_trees) or os.stat(bs_trees).st_size == 0):
+      continue
+    name = "support_" + fasta
+    if (len(bs_metric) > 0):
+      name += "_" + bs_metric
+    args = " --support"
+    args += " --tree " + ml_tree
+    args += " --bs-trees " + bs_trees
+    if (len(bs_metric) > 0):
+      args += " --bs-metric " + bs_metric
+    if (not scheduler.sets_threads(scheduler_mode)):
+      args += " --threads 1"
+    prefix = os.path.join(support_results, fasta + ".support")
+    if (len(bs_metric) > 0):
+      prefix += "." + bs_metric
+    args += " --prefix " + prefix
+    args += " "
+    args += raxml_arguments
+    commands.append(scheduler.Command(name, 1, 1, args, prefix + ".raxml.log", raxml.RAXML_DONE_MARKER, fasta, "support"))
+  return commands
 
 def run(msas, output_dir, library, scheduler_mode, run_path, cores, op):
   """ Use the MPI scheduler to run raxml --support on all the MSAs. 
@@ -16,45 +51,28 @@ def run(msas, output_dir, library, scheduler_mode, run_path, cores, op):
   support_results = os.path.join(run_path, "results")
   commons.makedirs(support_results)
   logger.info("Writing supports commands in " + commands_file)
-  bs_metrics = ["", "tbe"]
-  with open(commands_file, "w") as writer:
-    for fasta in os.listdir(ml_trees_dir):
-      raxml_arguments = msas[fasta].get_raxml_arguments_str()
-      for bs_metric in bs_metrics:
-        ml_tree = os.path.join(ml_trees_dir, fasta, fasta + ".raxml.bestTree")
-        bs_trees = os.path.join(concatenated_dir, fasta + ".bs")
-        if (not os.path.exists(bs_trees) or os.stat(bs_trees).st_size == 0):
-          continue
-        writer.write("support_" + fasta)
-        if (len(bs_metric) > 0):
-          writer.write("_" + bs_metric)
-        writer.write(" 1 1")
-        writer.write(" --support")
-        writer.write(" --tree " + ml_tree)
-        writer.write(" --bs-trees " + bs_trees)
-        if (len(bs_metric) > 0):
-          writer.write(" --bs-metric " + bs_metric)
-        if (scheduler_mode != "fork"):
-          writer.write(" --threads 1")
-        writer.write(" --prefix " + os.path.join(support_results, fasta + ".support"))
-        if (len(bs_metric) > 0):
-          writer.write("." + bs_metric)
-        writer.write(" ")
-        writer.write(raxml_arguments)
-        writer.write("\n") 
-  scheduler.run_scheduler(library, scheduler_mode, "--threads", commands_file, run_path, cores, op)  
+  commands = []
+  for name, msa in msas.items():
+    if (not msa.valid):
+      continue
+    commands.extend(get_support_commands(msa, ml_trees_dir, concatenated_dir, support_results, scheduler_mode))
+  scheduler.run_commands(library, scheduler_mode, "--threads", commands, commands_file, run_path, cores, op)
 
 
-def concatenate_bootstrap_msa(bootstraps_dir, concatenated_dir, msa_name):
+def concatenate_bootstrap_msa(bootstraps_dir, concatenated_dir, msa_name, lean = False):
   """ For a given MSA, concatenates the bootstraps trees
-  from the independent raxml runs"""
+  from the independent raxml runs. With lean, the bootstrap chunks
+  are deleted once concatenated """
   concatenated_file = os.path.join(concatenated_dir, msa_name + ".bs")
+  fasta_bs_dir = layout.get_family_dir(bootstraps_dir, msa_name)
+  if (lean and not layout.exists(fasta_bs_dir) and os.path.isfile(concatenated_file)):
+    # already concatenated (and deleted) by an interrupted run
+    return
   no_bs = True
   with open(concatenated_file,'wb') as writer:
-    fasta_bs_dir = os.path.join(bootstraps_dir, msa_name)
-    for bs_file in os.listdir(fasta_bs_dir):
+    for bs_file in layout.listdir(fasta_bs_dir):
       if (bs_file.endswith("bootstraps")):
-        with open(os.path.join(fasta_bs_dir, bs_file),'rb') as reader:
+        with layout.open_file(os.path.join(fasta_bs_dir, bs_file),'rb') as reader:
           try:
             no_bs = False
             shutil.copyfileobj(reader, writer)
@@ -63,15 +81,20 @@ def concatenate_bootstrap_msa(bootstraps_dir, concatenated_dir, msa_name):
             raise e
   if (no_bs or os.stat(concatenated_file).st_size == 0):
     os.remove(concatenated_file)
+  elif (lean):
+    retention.remove(os.path.dirname(os.path.abspath(concatenated_dir)), "bootstrap_chunks", msa_name, fasta_bs_dir)
 
-def concatenate_bootstraps(output_dir, cores):
+def concatenate_bootstraps(output_dir, cores, lean = False):
   """ Concurrently run concatenate_bootstrap_msa on all the MSA (on one single node)"""
   concatenated_dir = os.path.join(output_dir, "concatenated_bootstraps")
   commons.makedirs(concatenated_dir)
   bootstraps_dir = os.path.join(output_dir, "mlsearch_run", "bootstraps")
+  # results.db misses the families of the jobs that finished before an interruption
+  # in older runs, so the bootstrap directories are listed as well
+  msa_names = sorted(set(resultsdb.get_step_families(output_dir, "bootstrap")) | set(layout.list_families(bootstraps_dir)))
   pool = multiprocessing.Pool(processes=min(multiprocessing.cpu_count(), int(cores)))
-  for msa_name in os.listdir(bootstraps_dir):
-    pool.apply_async(concatenate_bootstrap_msa, (bootstraps_dir, concatenated_dir, msa_name,))
+  for msa_name in msa_names:
+    pool.apply_async(concatenate_bootstrap_msa, (bootstraps_dir, concatenated_dir, msa_name, lean,))
   pool.close()
   pool.join()
 
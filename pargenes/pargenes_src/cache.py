@@ -0,0 +1,271 @@
+import os
+import shutil
+import hashlib
+import commons
+import logger
+import version
+import resultsdb
+import layout
+import archive
+import raxml
+
+"""
+Persistent cache of per-family results, shared between ParGenes runs.
+Each entry is addressed by a hash of the MSA content and of all the
+options that influence its results (raxml and modeltest arguments, model,
+seed, number of trees, tool binaries). The families found in the cache are
+not scheduled: their results are copied into the output directory.
+The cache also stores the results of the parsing step (binary MSA and
+raxml-ng logs), that are used in place without being copied.
+"""
+
+# hashes of the tool binaries, computed once per run
+binaries_hashes = {}
+# hashes of the MSA files, computed once per run
+msas_hashes = {}
+
+def get_results_cache_dir(op):
+  return os.path.join(op.cache_dir, "results")
+
+def get_parse_cache_dir(op):
+  return os.path.join(op.cache_dir, "parse")
+
+def hash_file(path, hasher):
+  with open(path, "rb") as reader:
+    while (True):
+      block = reader.read(1 << 20)
+      if (len(block) == 0):
+        break
+      hasher.update(block)
+
+def get_binary_hash(path):
+  """ Hash of a tool binary, used as its version """
+  if (not path in binaries_hashes):
+    hasher = hashlib.sha256()
+    try:
+      hash_file(path, hasher)
+    except OSError:
+      hasher.update(path.encode())
+    binaries_hashes[path] = hasher.hexdigest()
+  return binaries_hashes[path]
+
+def get_msa_hash(msa):
+  if (not msa.path in msas_hashes):
+    hasher = hashlib.sha256()
+    hash_file(msa.path, hasher)
+    msas_hashes[msa.path] = hasher.hexdigest()
+  return msas_hashes[msa.path]
+
+def stage_unhashed_msas(msas, op):
+  """ Extract the MSAs of an archive that still have to be hashed """
+  archive.stage_msas([msa for msa in msas if not msa.path in msas_hashes], op)
+
+def get_results_key(msa, raxml_library, modeltest_library, op):
+  """ Hash of the MSA content and of the effective options of its analysis """
+  hasher = hashlib.sha256()
+  hasher.update(get_msa_hash(msa).encode())
+  options = []
+  options.append("pargenes " + version.get_pargenes_version_string())
+  options.append("raxml " + get_binary_hash(raxml_library))
+  options.append("raxml_arguments " + " ".join(msa.raxml_args))
+  options.append("model " + msa.get_model())
+  if (op.use_modeltest):
+    options.append("modeltest " + get_binary_hash(modeltest_library))
+    options.append("modeltest_arguments " + msa.modeltest_arguments)
+    options.append("modeltest_criteria " + op.modeltest_criteria)
+  options.append("seed " + str(op.seed))
+  options.append("starting_trees " + str(op.random_starting_trees) + " " + str(op.parsimony_starting_trees) + " " + str(op.adaptive_starting_trees))
+  options.append("bootstraps " + str(op.bootstraps) + " " + str(op.autoMRE) + " " + str(op.parallel_autoMRE))
+  options.append("constrain " + str(op.constrain_search))
+  hasher.update("\n".join(options).encode())
+  return hasher.hexdigest()
+
+def get_parse_key(msa, raxml_library):
+  """ Hash of the MSA content and of the arguments of its parsing step """
+  hasher = hashlib.sha256()
+  hasher.update(get_msa_hash(msa).encode())
+  hasher.update(("raxml " + get_binary_hash(raxml_library) + "\n").encode())
+  hasher.update(msa.get_raxml_arguments_str().encode())
+  return hasher.hexdigest()
+
+def get_entry_dir(op, key):
+  return os.path.join(get_results_cache_dir(op), key[:2], key)
+
+def get_parse_entry_dir(op, key):
+  return os.path.join(get_parse_cache_dir(op), key[:2], key)
+
+def copy_family_files(src_dir, dest_dir, src_name, dest_name):
+  """ Copy the files of src_dir into dest_dir, replacing the family name
+  prefix src_name of the file names by dest_name (the cache stores
+  the files without their family name prefix) """
+  if (not os.path.isdir(src_dir)):
+    return
+  commons.makedirs(dest_dir)
+  for f in os.listdir(src_dir):
+    src = os.path.join(src_dir, f)
+    if (not os.path.isfile(src)):
+      continue
+    if (f.startswith(src_name + ".")):
+      f = dest_name + f[len(src_name):]
+    shutil.copy(src, os.path.join(dest_dir, f))
+
+def copy_family_file(src, dest):
+  if (os.path.isfile(src)):
+    commons.makedirs(os.path.dirname(dest))
+    shutil.copy(src, dest)
+
+def write_msa_info(msa, path):
+  with open(path, "w") as writer:
+    writer.write("valid " + str(int(msa.valid)) + "\n")
+    writer.write("taxa " + str(msa.taxa) + "\n")
+    writer.write("patterns " + str(msa.patterns) + "\n")
+    writer.write("per_taxon_clv_size " + str(msa.per_taxon_clv_size) + "\n")
+    writer.write("cores " + str(msa.cores) + "\n")
+    writer.write("model " + msa.get_model() + "\n")
+
+def read_msa_info(msa, path):
+  with open(path) as reader:
+    for line in reader.readlines():
+      split = line[:-1].split(" ", 1)
+      if (split[0] == "model"):
+        msa.set_model(split[1])
+      elif (split[0] in ["taxa", "patterns", "per_taxon_clv_size", "cores"]):
+        setattr(msa, split[0], int(split[1]))
+      elif (split[0] == "valid"):
+        msa.valid = (split[1] == "1")
+
+def materialize_results(msa, entry_dir, op):
+  """ Copy the cached results of msa into the output directory """
+  output_dir = op.output_dir
+  name = msa.name
+  read_msa_info(msa, os.path.join(entry_dir, "msa_info.txt"))
+  copy_family_files(os.path.join(entry_dir, "modeltest"), layout.get_family_dir(os.path.join(output_dir, "modeltest_run", "results"), name), "", name)
+  copy_family_files(os.path.join(entry_dir, "mlsearch"), layout.get_family_dir(os.path.join(output_dir, "mlsearch_run", "results"), name), "", name)
+  copy_family_file(os.path.join(entry_dir, "bootstraps.bs"), os.path.join(output_dir, "concatenated_bootstraps", name + ".bs"))
+  copy_family_files(os.path.join(entry_dir, "supports"), os.path.join(output_dir, "supports_run", "results"), "", name)
+  resultsdb.record_family_outputs([name], op)
+
+def use_cached_results(msas, raxml_library, modeltest_library, op):
+  """ Look for the results of each MSA in the cache. The MSAs found in
+  the cache are removed from msas, and their results are copied
+  into the output directory. The MSAs known to be invalid stay in msas,
+  flagged as invalid """
+  cached = []
+  for name, msa in msas.items():
+    try:
+      msa.cache_key = get_results_key(msa, raxml_library, modeltest_library, op)
+    except OSError:
+      continue
+    entry_dir = get_entry_dir(op, msa.cache_key)
+    if (os.path.isdir(entry_dir)):
+      materialize_results(msa, entry_dir, op)
+      if (msa.valid):
+        cached.append(name)
+  for name in cached:
+    del msas[name]
+  with open(os.path.join(op.output_dir, "cached_msas.txt"), "a") as writer:
+    for name in cached:
+      writer.write(name + "\n")
+  logger.info("Found the results of " + str(len(cached)) + " MSAs in the cache " + op.cache_dir + ", " + str(len(msas)) + " MSAs remain to process")
+
+def store_family_results(msa, op):
+  """ Copy the results of msa into a new cache entry. The entry is
+  written in a temporary directory and then renamed, so that a partial
+  entry is never visible """
+  output_dir = op.output_dir
+  name = msa.name
+  entry_dir = get_entry_dir(op, msa.cache_key)
+  ml_results = layout.get_family_dir(os.path.join(output_dir, "mlsearch_run", "results"), name)
+  if (os.path.isdir(entry_dir) or not os.path.isfile(os.path.join(ml_results, name + ".raxml.bestTree"))):
+    return False
+  tmp_dir = entry_dir + ".tmp" + str(os.getpid())
+  shutil.rmtree(tmp_dir, ignore_errors = True)
+  commons.makedirs(tmp_dir)
+  write_msa_info(msa, os.path.join(tmp_dir, "msa_info.txt"))
+  copy_family_files(layout.get_family_dir(os.path.join(output_dir, "modeltest_run", "results"), name), os.path.join(tmp_dir, "modeltest"), name, "")
+  copy_family_files(ml_results, os.path.join(tmp_dir, "mlsearch"), name, "")
+  copy_family_file(os.path.join(output_dir, "concatenated_bootstraps", name + ".bs"), os.path.join(tmp_dir, "bootstraps.bs"))
+  supports_dir = os.path.join(tmp_dir, "supports")
+  supports_results = os.path.join(output_dir, "supports_run", "results")
+  for suffix in [".support.raxml.support", ".support.raxml.log", ".support.tbe.raxml.support", ".support.tbe.raxml.log"]:
+    copy_family_file(os.path.join(supports_results, name + suffix), os.path.join(supports_dir, suffix))
+  try:
+    os.rename(tmp_dir, entry_dir)
+  except OSError:
+    # another run stored the same entry in the meantime
+    shutil.rmtree(tmp_dir, ignore_errors = True)
+    return False
+  return True
+
+def store_invalid_msas(msas, op):
+  """ Store the MSAs rejected by the parsing step because of their content
+  in the cache, so that they are not parsed again. The MSAs whose parsing
+  job failed for another reason (killed job, full disk...) are not stored """
+  parse_run_results = os.path.join(op.output_dir, "parse_run", "results")
+  for name, msa in msas.items():
+    if (msa.valid or msa.cache_key == ""):
+      continue
+    if (not raxml.has_input_error(msa, parse_run_results)):
+      continue
+    entry_dir = get_entry_dir(op, msa.cache_key)
+    if (os.path.isdir(entry_dir)):
+      continue
+    tmp_dir = entry_dir + ".tmp" + str(os.getpid())
+    commons.makedirs(tmp_dir)
+    write_msa_info(msa, os.path.join(tmp_dir, "msa_info.txt"))
+    try:
+      os.rename(tmp_dir, entry_dir)
+    except OSError:
+      shutil.rmtree(tmp_dir, ignore_errors = True)
+
+def count_cached_results(op):
+  """ Number of MSAs of this run whose results come from the cache """
+  try:
+    with open(os.path.join(op.output_dir, "cached_msas.txt")) as reader:
+      return len(reader.readlines())
+  except OSError:
+    return 0
+
+def store_results(msas, op):
+  """ Store the results of all the valid MSAs processed by this run in the cache """
+  stored = 0
+  for name, msa in msas.items():
+    if (not msa.valid or msa.cache_key == ""):
+      continue
+    if (store_family_results(msa, op)):
+      stored += 1
+  logger.info("Stored the results of " + str(stored) + " MSAs in the cache " + op.cache_dir)
+
+def use_cached_parse(msa, raxml_library, op):
+  """ If the parsing step of msa (with its current arguments) is in the cache,
+  point msa to the cached binary MSA and logs and return True """
+  stage_unhashed_msas([msa], op)
+  try:
+    entry_dir = get_parse_entry_dir(op, get_parse_key(msa, raxml_library))
+  except OSError:
+    return False
+  if (not os.path.isdir(entry_dir)):
+    return False
+  msa.parse_prefix = os.path.join(entry_dir, "msa")
+  return True
+
+def store_parse(msa, raxml_library, op):
+  """ Store the binary MSA and the logs of the parsing step of msa in the cache """
+  log = msa.parse_prefix + ".raxml.log"
+  rba = msa.parse_prefix + ".raxml.rba"
+  if (not os.path.isfile(rba) or not os.path.isfile(log)):
+    return False
+  entry_dir = get_parse_entry_dir(op, get_parse_key(msa, raxml_library))
+  if (os.path.isdir(entry_dir)):
+    return False
+  tmp_dir = entry_dir + ".tmp" + str(os.getpid())
+  shutil.rmtree(tmp_dir, ignore_errors = True)
+  commons.makedirs(tmp_dir)
+  shutil.copy(rba, os.path.join(tmp_dir, "msa.raxml.rba"))
+  shutil.copy(log, os.path.join(tmp_dir, "msa.raxml.log"))
+  try:
+    os.rename(tmp_dir, entry_dir)
+  except OSError:
+    shutil.rmtree(tmp_dir, ignore_errors = True)
+    return False
+  return True
@@ -0,0 +1,103 @@
+import os
+import sys
+import json
+import pickle
+import commons
+
+"""
+Catalog of the MSAs of a run (parse_run/msas_catalog.txt), written
+after each parsing step and read when ParGenes restarts from a checkpoint.
+The first line holds the format version, the second one the field names
+and the third one the table of the argument lists shared by the MSAs.
+Each following line describes one MSA: its name, a tab, and the JSON list
+of its field values (the argument fields are indices in the shared table).
+The catalog is replaced atomically, and can be partially loaded: the lines
+of the MSAs that are not requested are skipped without being decoded.
+"""
+
+CATALOG_VERSION = 1
+# fields stored as an index in the table of shared values
+SHARED_FIELDS = ["raxml_args", "modeltest_arguments"]
+
+def get_catalog_path(output_dir, run_dir = "parse_run"):
+  return os.path.join(output_dir, run_dir, "msas_catalog.txt")
+
+def save_msas(msas, op):
+  """ Write the catalog of msas (replacing the previous one) """
+  catalog = get_catalog_path(op.output_dir)
+  fields = [field for field in commons.MSA.__slots__ if field != "name"]
+  shared = []
+  shared_indices = {}
+  with open(catalog + ".tmp", "w") as writer:
+    writer.write("pargenes_msa_catalog\t" + str(CATALOG_VERSION) + "\n")
+    writer.write(json.dumps(fields) + "\n")
+    lines = []
+    for name, msa in msas.items():
+      values = []
+      for field in fields:
+        value = getattr(msa, field)
+        if (field in SHARED_FIELDS):
+          key = (field, value)
+          if (not key in shared_indices):
+            shared_indices[key] = len(shared)
+            shared.append(value)
+          value = shared_indices[key]
+        values.append(value)
+      lines.append(name + "\t" + json.dumps(values, separators = (",", ":")) + "\n")
+    writer.write(json.dumps(shared) + "\n")
+    writer.writelines(lines)
+  os.replace(catalog + ".tmp", catalog)
+  # the catalog replaces the pickled checkpoint of the previous versions
+  legacy = os.path.join(op.output_dir, "parse_run", "msas_checkpoint.bin")
+  if (os.path.isfile(legacy)):
+    os.remove(legacy)
+
+def read_catalog(catalog, names):
+  with open(catalog) as reader:
+    header = reader.readline().rstrip("\n").split("\t")
+    if (header[0] != "pargenes_msa_catalog" or int(header[1]) > CATALOG_VERSION):
+      raise ValueError("Unsupported MSA catalog " + catalog)
+    fields = json.loads(reader.readline())
+    shared = json.loads(reader.readline())
+    for index, value in enumerate(shared):
+      if (isinstance(value, list)):
+        shared[index] = commons.get_shared_arguments(value)
+      else:
+        shared[index] = sys.intern(value)
+    # the fields missing from older catalogs keep their default value
+    defaults = commons.get_default_fields()
+    msas = {}
+    for line in reader:
+      name, values = line.rstrip("\n").split("\t", 1)
+      if (names != None and not name in names):
+        continue
+      msa = commons.MSA.__new__(commons.MSA)
+      for field, value in defaults:
+        setattr(msa, field, value)
+      msa.name = name
+      for field, value in zip(fields, json.loads(values)):
+        if (field in SHARED_FIELDS):
+          value = shared[value]
+        elif (field == "model"):
+          value = sys.intern(value)
+        setattr(msa, field, value)
+      msas[name] = msa
+  return msas
+
+def load_msas(op, names = None):
+  """ Load the MSAs saved by save_msas, or only the MSAs in names if not None """
+  for run_dir in ["parse_run", "old_parse_run"]:
+    # old_parse_run: interrupted during the second parsing step
+    catalog = get_catalog_path(op.output_dir, run_dir)
+    if (os.path.isfile(catalog)):
+      return read_catalog(catalog, names)
+    legacy = os.path.join(op.output_dir, run_dir, "msas_checkpoint.bin")
+    if (os.path.isfile(legacy)):
+      with open(legacy, "rb") as f:
+        msas = pickle.load(f)
+      for msa in msas.values():
+        msa.raxml_args = commons.get_shared_arguments(msa.raxml_args)
+      if (names != None):
+        msas = dict((name, msa) for name, msa in msas.items() if name in names)
+      return msas
+  raise FileNotFoundError("No MSA catalog in " + op.output_dir)
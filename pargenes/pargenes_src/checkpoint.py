@@ -1,4 +1,5 @@
 import os
+import logger
 
 def read_checkpoint(output_dir):
   """ Read and return the checkpoint value from the checkpoint file """
@@ -13,5 +14,76 @@ def write_checkpoint(output_dir, checkpoint):
   with open(os.path.join(output_dir, "checkpoint"), "w") as f:
     f.write(str(checkpoint))
 
+def get_ledger_file(run_path):
+  return os.path.join(run_path, "completed_jobs.txt")
 
+def read_completed_jobs(run_path):
+  """ Return the names of the jobs recorded as completed in the ledger
+  of run_path. An incomplete last line (interrupted write) is ignored """
+  completed = set()
+  try:
+    with open(get_ledger_file(run_path)) as reader:
+      for line in reader:
+        if (line.endswith("\n")):
+          completed.add(line[:-1])
+  except OSError:
+    pass
+  return completed
+
+def mark_jobs_completed(run_path, job_names):
+  """ Append job_names to the ledger of run_path. All the names are
+  written with one single append, so that concurrent writers and
+  interruptions never produce interleaved lines """
+  if (len(job_names) == 0):
+    return
+  data = "".join([name + "\n" for name in job_names]).encode()
+  fd = os.open(get_ledger_file(run_path), os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+  try:
+    os.write(fd, data)
+  finally:
+    os.close(fd)
+
+def file_ends_with_marker(path, marker):
+  """ Check that the end of the file path contains marker """
+  try:
+    with open(path, "rb") as reader:
+      reader.seek(0, os.SEEK_END)
+      size = reader.tell()
+      reader.seek(max(0, size - 4096))
+      return marker.encode() in reader.read()
+  except OSError:
+    return False
+
+def is_command_done(command):
+  """ Check from its output files if a command already completed """
+  if (len(command.done_file) == 0):
+    return False
+  return file_ends_with_marker(command.done_file, command.done_marker)
+
+def get_commands_to_run(commands, run_path, op):
+  """ When continuing a run, remove the commands that already completed
+  (according to the ledger or to their output files) from commands """
+  if (not op.do_continue):
+    return commands
+  completed = read_completed_jobs(run_path)
+  newly_completed = []
+  to_run = []
+  for command in commands:
+    if (command.name in completed):
+      continue
+    if (is_command_done(command)):
+      newly_completed.append(command.name)
+      continue
+    to_run.append(command)
+  mark_jobs_completed(run_path, newly_completed)
+  skipped = len(commands) - len(to_run)
+  if (skipped > 0):
+    logger.info("Skipping " + str(skipped) + "/" + str(len(commands)) + " jobs that already completed in " + run_path)
+  return to_run
 
+def record_completed_commands(commands, run_path):
+  """ Record the successful commands in the ledger of run_path, and
+  return the success status of each command """
+  statuses = [is_command_done(command) for command in commands]
+  mark_jobs_completed(run_path, [command.name for i, command in enumerate(commands) if statuses[i]])
+  return statuses
@@ -2,6 +2,7 @@ import os
 import logger
 import sys
 import report
+import archive
 
 def makedirs(path):
   """ Create a directory if it does not exists yet """
@@ -10,8 +11,22 @@ def makedirs(path):
   except:
     pass
 
+# argument lists shared by the MSAs
+shared_arguments = {}
+
+def get_shared_arguments(arguments):
+  """ Return the shared instance of an argument tuple: the MSAs with the
+  same raxml-ng arguments (usually all of them) share one tuple """
+  arguments = tuple(arguments)
+  return shared_arguments.setdefault(arguments, arguments)
+
 class MSA:
   """ group all the information related to one MSA """
+  __slots__ = ["name", "path", "valid", "binary_path", "taxa", "per_taxon_clv_size",
+      "patterns", "memory", "cores", "min_cores", "max_cores", "allocated_cores",
+      "model", "raxml_args", "modeltest_arguments", "flag_disable_sorting",
+      "cache_key", "parse_prefix", "parse_model"]
+
   def __init__(self, name, path, raxml_arguments, modeltest_arguments):
     self.name = name
     self.path = path
@@ -20,16 +35,36 @@ class MSA:
     self.taxa = 0
     self.per_taxon_clv_size = 0
     self.patterns = 0
+    # memory estimated by raxml-ng, in MB
+    self.memory = 0.0
     self.cores = 0
+    # threads suggested by raxml-ng, and threads chosen by the makespan allocator
+    self.min_cores = 0
+    self.max_cores = 0
+    self.allocated_cores = 0
     self.model = ""
-    self.raxml_args = []
+    self.raxml_args = ()
     self.modeltest_arguments = ""
     self.flag_disable_sorting = False 
+    self.cache_key = ""
+    # prefix of the outputs of the raxml-ng parsing step, and model used for parsing
+    self.parse_prefix = ""
+    self.parse_model = ""
     self.add_raxml_arguments_str(raxml_arguments)
-    self.modeltest_arguments = modeltest_arguments
+    self.modeltest_arguments = sys.intern(modeltest_arguments)
+
+  def __setstate__(self, state):
+    """ Also restores the MSAs pickled before the use of __slots__: the
+    fields they do not have keep their default value """
+    if (isinstance(state, tuple)):
+      state = state[1]
+    for key, value in get_default_fields():
+      setattr(self, key, value)
+    for key, value in state.items():
+      setattr(self, key, value)
 
   def set_model(self, model):
-    self.model = model
+    self.model = sys.intern(model)
 
   def get_model(self):
     return self.model
@@ -42,6 +77,7 @@ class MSA:
   
   def add_raxml_arguments(self, arguments_list):
     last_was_model = False
+    raxml_args = list(self.raxml_args)
     for arg in arguments_list:    
       if (last_was_model):
         self.set_model(arg)
@@ -49,12 +85,23 @@ class MSA:
       elif (arg == "--model"):
         last_was_model = True
       else:
-        self.raxml_args.append(arg)
+        raxml_args.append(arg)
+    self.raxml_args = get_shared_arguments(raxml_args)
   
   def get_raxml_arguments_str(self):
     return " ".join(self.raxml_args) + " --model " + self.get_model()
     
 
+# (field, default value) of each field of MSA, see get_default_fields
+default_fields = []
+
+def get_default_fields():
+  """ Fields of MSA and their values after __init__ """
+  if (len(default_fields) == 0):
+    template = MSA("", "", "", "")
+    default_fields.extend((field, getattr(template, field)) for field in MSA.__slots__)
+  return default_fields
+
 def get_msa_name(msa_file):
   return msa_file.replace(".", "_")
 
@@ -87,7 +134,7 @@ def add_per_msa_modeltest_options(msas, options_file):
       if (not msa in msas):
         logger.warning("Found msa " + msa + " in options file " + options_file + " but not in the msas directory")
         continue
-      msas[msa].modeltest_arguments += " " + " ".join(split[1:])
+      msas[msa].modeltest_arguments = sys.intern(msas[msa].modeltest_arguments + " " + " ".join(split[1:]))
 
 def get_filter_content(msa_filter):
   """ Parse the (optional) file containing the list of MSAs to process"""
@@ -124,12 +171,15 @@ def init_msas(op):
   if (op.modeltest_global_parameters != None):
     modeltest_options = open(op.modeltest_global_parameters, "r").readlines()[0][:-1]
   msa_filter = get_filter_content(op.msa_filter)
-  for f in os.listdir(op.alignments_dir):
+  if (archive.is_archive_input(op)):
+    msa_files = archive.get_msa_files(op)
+  else:
+    msa_files = [(f, os.path.join(op.alignments_dir, f)) for f in os.listdir(op.alignments_dir)]
+  for f, path in msa_files:
     if (msa_filter != None):
       if (not (f in msa_filter)):
         continue
       del msa_filter[f]
-    path = os.path.join(op.alignments_dir, f)
     if (os.path.isdir(path)):
       print("[ERROR] The input alignment directory contains at least one subdirectory. Please make sure that this directory contains only MSA files.")
       sys.exit(1)
@@ -138,7 +188,7 @@ def init_msas(op):
     if (op.disable_job_sorting):
       msas[name].flag_disable_sorting = True
     if (op.datatype == "aa"):
-      msas[name].modeltest_arguments += " -d aa"
+      msas[name].modeltest_arguments = sys.intern(msas[name].modeltest_arguments + " -d aa")
   if (msa_filter != None): # check that all files in the filter are present in the directory
     for msa in msa_filter.values():
       logger.warning("File " + msa + " was found in the filter file, but not in the MSAs directory")
@@ -0,0 +1,232 @@
+import os
+import math
+import logger
+import raxml
+
+"""
+Runtime cost model of the jobs. The measured runtimes of the jobs are
+recorded in a history file shared between runs, together with the features
+of their MSA (taxa, patterns, datatype, rate categories, partitions) and
+of the job (threads, number of trees). A log-linear model is fitted on this
+history for each job type, and its predictions (in seconds) replace the
+taxa * per_taxon_clv_size job costs used to sort the jobs.
+"""
+
+# the job types with a cost model
+JOB_TYPES = ["modeltest", "mlsearch", "bootstrap"]
+# minimum number of recorded runtimes to fit the model of a job type
+MIN_SAMPLES = 16
+# only the most recent runtimes of each job type are used
+MAX_SAMPLES = 10000
+
+# path of the history file of this run ("" if disabled)
+history_file = ""
+# fitted coefficients, per job type
+models = {}
+# seconds per unit of taxa * per_taxon_clv_size * trees / threads, for the
+# job types without model
+default_rate = None
+# features of the jobs submitted in this run, per job name
+jobs_features = {}
+
+def get_history_file(op):
+  if (op.runtime_history):
+    return op.runtime_history
+  if (op.cache_dir):
+    return os.path.join(op.cache_dir, "runtimes.txt")
+  return ""
+
+def get_partitions_number(msa):
+  """ Number of partitions of the model of msa (partition files have
+  one partition per line) """
+  model = msa.get_model()
+  if (os.path.isfile(model)):
+    with open(model) as reader:
+      return max(1, len([line for line in reader.readlines() if len(line.strip()) > 0]))
+  return 1
+
+def get_features(msa, job_type, threads, trees, op):
+  categories = raxml.get_rate_categories(msa.get_model())
+  return [job_type, op.datatype, msa.taxa, msa.patterns, msa.per_taxon_clv_size,
+      max(1, categories), get_partitions_number(msa), threads, trees]
+
+def get_regressors(features):
+  """ Variables of the log-linear model: log(seconds) is a linear
+  combination of these values """
+  job_type, datatype, taxa, patterns, clv_size, categories, partitions, threads, trees = features
+  return [1.0,
+      math.log(max(1, taxa)),
+      math.log(max(1, patterns)),
+      math.log(max(1, categories)),
+      math.log(max(1, partitions)),
+      float(datatype == "aa"),
+      math.log(max(1, threads)),
+      math.log(max(1, trees))]
+
+def get_default_units(features):
+  job_type, datatype, taxa, patterns, clv_size, categories, partitions, threads, trees = features
+  return float(taxa * clv_size * max(1, trees)) / float(max(1, threads))
+
+def solve(matrix, vector):
+  """ Solve the linear system matrix * x = vector with Gaussian elimination """
+  n = len(vector)
+  a = [list(matrix[i]) + [vector[i]] for i in range(0, n)]
+  for col in range(0, n):
+    pivot = max(range(col, n), key = lambda row: abs(a[row][col]))
+    if (abs(a[pivot][col]) < 1e-12):
+      return None
+    a[col], a[pivot] = a[pivot], a[col]
+    for row in range(col + 1, n):
+      factor = a[row][col] / a[col][col]
+      for k in range(col, n + 1):
+        a[row][k] -= factor * a[col][k]
+  x = [0.0] * n
+  for row in range(n - 1, -1, -1):
+    s = a[row][n] - sum(a[row][k] * x[k] for k in range(row + 1, n))
+    x[row] = s / a[row][row]
+  return x
+
+def fit(samples):
+  """ Least squares fit (with a small ridge term to cope with
+  correlated features) of log(seconds) on the regressors of the samples """
+  n = len(get_regressors(samples[0][0]))
+  xtx = [[0.0] * n for i in range(0, n)]
+  xty = [0.0] * n
+  for features, seconds in samples:
+    x = get_regressors(features)
+    y = math.log(max(seconds, 0.001))
+    for i in range(0, n):
+      xty[i] += x[i] * y
+      for j in range(0, n):
+        xtx[i][j] += x[i] * x[j]
+  for i in range(1, n):
+    xtx[i][i] += 0.001 * len(samples)
+  return solve(xtx, xty)
+
+def read_history(path):
+  """ Return the recorded runtimes of each job type """
+  samples = {}
+  try:
+    lines = open(path).readlines()
+  except OSError:
+    return samples
+  for line in lines:
+    split = line.split()
+    if (len(split) != 10 or not line.endswith("\n")):
+      continue
+    try:
+      features = [split[0], split[1]] + [int(v) for v in split[2:9]]
+      seconds = float(split[9])
+    except ValueError:
+      continue
+    if (not split[0] in samples):
+      samples[split[0]] = []
+    samples[split[0]].append((features, seconds))
+  return samples
+
+def load_history(op):
+  """ Read the runtime history and fit the model of each job type """
+  global history_file
+  global default_rate
+  history_file = get_history_file(op)
+  models.clear()
+  default_rate = None
+  if (history_file == ""):
+    return
+  samples = read_history(history_file)
+  rates = []
+  for job_type, job_samples in samples.items():
+    job_samples = job_samples[-MAX_SAMPLES:]
+    for features, seconds in job_samples:
+      units = get_default_units(features)
+      if (units > 0):
+        rates.append(seconds / units)
+    if (len(job_samples) >= MIN_SAMPLES):
+      coefficients = fit(job_samples)
+      if (coefficients != None):
+        models[job_type] = coefficients
+  if (len(rates) > 0):
+    default_rate = sorted(rates)[len(rates) // 2]
+  logger.info("Runtime history " + history_file + ": " + str(sum(len(s) for s in samples.values())) + " recorded jobs, cost models for " + str(sorted(models.keys())))
+
+def predict_seconds(features):
+  """ Predicted runtime of a job, or None if there is no history """
+  job_type = features[0]
+  if (job_type in models):
+    coefficients = models[job_type]
+    x = get_regressors(features)
+    return math.exp(min(50.0, sum(c * v for c, v in zip(coefficients, x))))
+  if (default_rate != None):
+    return default_rate * get_default_units(features)
+  return None
+
+def get_job_cost(msa, job_type, name, threads, trees, default_cost, op):
+  """ Cost of a job, used to sort the jobs: its predicted runtime in
+  milliseconds, or default_cost if it cannot be predicted. The job features
+  are kept to record its runtime once it is done """
+  if (history_file == ""):
+    return default_cost
+  features = get_features(msa, job_type, threads, trees, op)
+  jobs_features[name] = features
+  if (msa.flag_disable_sorting):
+    return default_cost
+  seconds = predict_seconds(features)
+  if (seconds == None):
+    return default_cost
+  return int(seconds * 1000.0) + 1
+
+def get_elapsed_time(log_file):
+  """ Read the runtime of a job from its raxml-ng or modeltest-ng logs """
+  try:
+    lines = open(log_file).readlines()
+  except OSError:
+    return None
+  for line in reversed(lines):
+    if (line.startswith("Elapsed time:")):
+      # raxml-ng: "Elapsed time: 12.345 seconds"
+      try:
+        return float(line.split()[2])
+      except (IndexError, ValueError):
+        return None
+    if ("It took" in line):
+      # modeltest-ng: "... It took 0h00:01:02"
+      try:
+        h, m, s = line.split("It took")[1].strip().replace("h", ":").split(":")[:3]
+        return int(h) * 3600.0 + int(m) * 60.0 + float(s)
+      except ValueError:
+        return None
+  return None
+
+def format_record(features, seconds):
+  return " ".join([str(v) for v in features]) + " " + str(round(seconds, 3)) + "\n"
+
+def append_records(records):
+  """ Append the records to the history file in one write, so that
+  concurrent runs sharing the history do not interleave their lines """
+  if (history_file == "" or len(records) == 0):
+    return
+  directory = os.path.dirname(history_file)
+  if (directory != "" and not os.path.isdir(directory)):
+    os.makedirs(directory, exist_ok = True)
+  fd = os.open(history_file, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+  try:
+    os.write(fd, "".join(records).encode())
+  finally:
+    os.close(fd)
+
+def record_runtime(name, seconds):
+  """ Record the measured runtime of the job name """
+  if (not name in jobs_features):
+    return
+  append_records([format_record(jobs_features.pop(name), seconds)])
+
+def record_runtimes(commands):
+  """ Record the runtimes of the finished commands, read from their logs """
+  records = []
+  for command in commands:
+    if (not command.name in jobs_features):
+      continue
+    seconds = get_elapsed_time(command.done_file)
+    if (seconds != None):
+      records.append(format_record(jobs_features.pop(command.name), seconds))
+  append_records(records)
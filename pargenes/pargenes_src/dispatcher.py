@@ -0,0 +1,229 @@
+import os
+import time
+import math
+import heapq
+import asyncio
+import commons
+import logger
+import scheduler
+import retry
+import admission
+
+"""
+Python scheduler (--scheduler python): runs the jobs of a commands file
+(one "name cores cost args" line per job, the format of mpi-scheduler) on
+the cores of the local node, with asyncio subprocesses. It does not need
+MPI. Among the jobs that fit in the free cores, the job with the highest
+cost is started first. Each job gets its number of cores through its
+threads argument, as with the fork mode of mpi-scheduler, and writes its
+output into per_job_logs. The failed jobs are listed in failed_commands.txt
+and a summary of each batch is written in logs.txt.
+With a memory budget (--node-memory), a job also has to fit in the free
+memory of the node (see admission.py).
+The on_done callback of a job is called as soon as the job finishes, and
+can submit new jobs to the same dispatcher (see pipeline.py).
+"""
+
+class Job:
+  """ A command to run with library, with its logs written in run_path.
+  on_done is called with the success status when the job finishes """
+  def __init__(self, command, library, threads_arg, run_path, on_done = None):
+    self.command = command
+    self.library = library
+    self.threads_arg = threads_arg
+    self.run_path = run_path
+    self.on_done = on_done
+    self.cores = 1
+    self.memory = 0.0
+    self.attempt = 0
+    self.start_time = 0.0
+
+  def get_args(self):
+    args = [self.library] + self.command.args.split()
+    if (len(self.threads_arg) != 0):
+      args.append(self.threads_arg)
+      args.append(str(self.cores))
+    return args
+
+class Dispatcher:
+  """ Run jobs on the cores of the local node. Among the jobs that fit
+  in the free cores, the job with the highest cost is started first. The job
+  callbacks are called as soon as each job finishes, and can submit new jobs.
+  With failure_fatal, no job is started after the first failure. The failed
+  jobs are resubmitted up to retries times (see retry.py) before their
+  callbacks are called. With a memory budget (in MB), the jobs also have to
+  fit in the free memory, except a job needing more than the whole budget,
+  which runs alone """
+  def __init__(self, cores, failure_fatal = False, retries = 0, memory = 0.0):
+    self.cores = cores
+    self.retries = retries
+    self.free_cores = cores
+    self.memory = memory
+    self.free_memory = memory
+    self.failure_fatal = failure_fatal
+    # ready jobs, grouped per number of cores and order of magnitude of
+    # their memory, sorted by decreasing cost
+    self.ready = {}
+    self.running = 0
+    self.submitted = 0
+    self.failures = 0
+    self.wakeup = None
+    # exception raised by a job callback, re-raised by run
+    self.error = None
+
+  def get_job_memory(self, job):
+    """ Memory reserved for a job, 0 without memory budget """
+    if (self.memory <= 0.0):
+      return 0.0
+    return min(float(job.command.memory), self.memory)
+
+  def submit(self, job):
+    job.cores = max(1, min(int(job.command.cores), self.cores))
+    job.memory = self.get_job_memory(job)
+    # the heaps are sorted by cost, so a job of a heap can only start if the
+    # biggest job of the heap fits: jobs with similar memory share a heap
+    key = (job.cores, int(math.log2(job.memory)) if job.memory >= 1.0 else 0)
+    if (not key in self.ready):
+      self.ready[key] = []
+    self.submitted += 1
+    heapq.heappush(self.ready[key], (-float(job.command.cost), self.submitted, job))
+
+  def fits(self, job):
+    if (job.cores > self.free_cores):
+      return False
+    if (job.memory > self.free_memory and self.running > 0):
+      return False
+    return True
+
+  def pop_next_job(self):
+    best_key = None
+    best_cost = None
+    for key, jobs in self.ready.items():
+      if (len(jobs) == 0 or not self.fits(jobs[0][2])):
+        continue
+      if (best_cost == None or jobs[0][0] < best_cost):
+        best_cost = jobs[0][0]
+        best_key = key
+    if (best_cost == None):
+      return None
+    return heapq.heappop(self.ready[best_key])[2]
+
+  async def run_job(self, job):
+    commons.makedirs(os.path.join(job.run_path, "per_job_logs"))
+    commons.makedirs(os.path.join(job.run_path, "running_jobs"))
+    name = job.command.name
+    open(os.path.join(job.run_path, "running_jobs", name), "w").close()
+    job.start_time = time.time()
+    with open(os.path.join(job.run_path, "per_job_logs", name + "_out.txt"), "w") as out:
+      try:
+        process = await asyncio.create_subprocess_exec(*job.get_args(), stdout = out, stderr = out)
+        returncode = await process.wait()
+      except OSError as e:
+        out.write(str(e) + "\n")
+        returncode = 1
+      if (returncode != 0):
+        out.write("\n" + retry.EXIT_CODE_PREFIX + str(returncode) + "\n")
+    self.free_cores += job.cores
+    self.free_memory += job.memory
+    self.running -= 1
+    try:
+      self.job_finished(job, returncode, time.time() - job.start_time)
+    except BaseException as e:
+      self.error = e
+    self.wakeup.set()
+
+  def job_finished(self, job, returncode, runtime):
+    name = job.command.name
+    try:
+      os.remove(os.path.join(job.run_path, "running_jobs", name))
+    except OSError:
+      pass
+    if (returncode != 0 and job.attempt < self.retries and self.resubmit(job)):
+      return
+    if (returncode != 0):
+      self.failures += 1
+      with open(os.path.join(job.run_path, "failed_commands.txt"), "a") as writer:
+        writer.write(name + "\n")
+    self.record_job(job, returncode, runtime)
+    if (job.on_done != None):
+      job.on_done(returncode == 0)
+
+  def resubmit(self, job):
+    """ Submit a failed job again, unless its failure cannot be fixed by a retry """
+    name = job.command.name
+    failure = retry.classify_failure(retry.get_job_log(job.run_path, name))
+    job.attempt += 1
+    if (failure == "bad_input"):
+      retry.log_failure(job.run_path, name, job.attempt, failure, 0)
+      return False
+    job.command.cores = retry.get_retry_cores(job.cores, failure, self.cores)
+    if (failure == "oom"):
+      # the memory estimate was too low
+      job.command.memory = 2.0 * max(float(job.command.memory), job.memory)
+    retry.log_failure(job.run_path, name, job.attempt, failure, job.command.cores)
+    retry.keep_attempt_log(job.run_path, name, job.attempt)
+    logger.warning("Job " + name + " failed (" + failure + "), retry " + str(job.attempt) + "/" + str(self.retries) + " with " + str(job.command.cores) + " cores")
+    self.submit(job)
+    return True
+
+  def record_job(self, job, returncode, runtime):
+    """ Called when a job finishes, before its callback """
+    pass
+
+  async def main(self):
+    self.wakeup = asyncio.Event()
+    tasks = set()
+    while (self.error == None):
+      if (not (self.failure_fatal and self.failures > 0)):
+        job = self.pop_next_job()
+        while (job != None):
+          self.free_cores -= job.cores
+          self.free_memory -= job.memory
+          self.running += 1
+          # keep a reference to the task until it is done
+          task = asyncio.ensure_future(self.run_job(job))
+          tasks.add(task)
+          task.add_done_callback(tasks.discard)
+          job = self.pop_next_job()
+      if (self.running == 0):
+        break
+      await self.wakeup.wait()
+      self.wakeup.clear()
+    if (self.error != None):
+      raise self.error
+
+  def run(self):
+    """ Run all the jobs, including the jobs submitted by the callbacks """
+    asyncio.run(self.main())
+
+def read_commands(commands_filename):
+  """ Commands of a scheduler commands file """
+  commands = []
+  for line in open(commands_filename).readlines():
+    split = line.split(None, 3)
+    if (len(split) < 3):
+      continue
+    commands.append(scheduler.Command(split[0], int(split[1]), float(split[2]), split[3].strip() if len(split) > 3 else ""))
+  return commands
+
+def run_commands_file(library, threads_arg, commands_filename, output_dir, cores, failure_fatal, memory = 0.0):
+  """ Run the jobs of a commands file, with their logs in output_dir, within
+  memory MB if memory is set. Return the error code mpi-scheduler would return """
+  failed_commands = os.path.join(output_dir, "failed_commands.txt")
+  if (os.path.isfile(failed_commands)):
+    os.remove(failed_commands)
+  dispatcher = Dispatcher(cores, failure_fatal, memory = memory)
+  jobs_memory = admission.read_jobs_memory(output_dir)
+  for command in read_commands(commands_filename):
+    command.memory = jobs_memory.get(command.name, 0.0)
+    dispatcher.submit(Job(command, library, threads_arg, output_dir))
+  jobs = dispatcher.submitted
+  start = time.time()
+  dispatcher.run()
+  summary = "Python scheduler: ran " + str(jobs) + " jobs in " + str(int(time.time() - start)) + "s, " + str(dispatcher.failures) + " failed"
+  logger.info(summary)
+  with open(commons.get_log_file(output_dir, "logs"), "w") as writer:
+    writer.write(summary + "\n")
+  if (failure_fatal and dispatcher.failures > 0):
+    return 242
+  return 0
@@ -0,0 +1,142 @@
+import os
+import copy
+import shutil
+import hashlib
+import multiprocessing
+import commons
+import logger
+import layout
+import scanner
+import resultsdb
+
+"""
+Detection of duplicated MSAs (--deduplicate). The MSAs are hashed at
+init time from their canonical content (the sorted list of the taxon
+names and upper-case sequences, so that the order of the taxa does not
+matter) and from their per-MSA options (raxml-ng and modeltest-ng
+arguments, model). Only the first MSA of each group of duplicates is
+analysed. The other ones (aliases) are listed in duplicates.txt, and
+their results are linked from the results of the analysed MSA at the
+end of the run, under their own name.
+"""
+
+def get_content_hash(path):
+  """ Hash of the canonical content of an MSA file, or of its bytes if
+  its format cannot be read """
+  hasher = hashlib.sha256()
+  try:
+    msa = scanner.read_msa(path)
+  except (scanner.ScanError, UnicodeDecodeError):
+    msa = None
+  if (msa == None):
+    with open(path, "rb") as reader:
+      hasher.update(reader.read())
+    return "raw " + hasher.hexdigest()
+  for name, sequence in sorted(zip(msa[0], [s.upper() for s in msa[1]])):
+    hasher.update((name + "\n" + sequence + "\n").encode())
+  return "msa " + hasher.hexdigest()
+
+def content_hash_worker(args):
+  name, path = args
+  try:
+    return name, get_content_hash(path)
+  except OSError:
+    return name, None
+
+def get_duplicate_key(msa, content_hash):
+  hasher = hashlib.sha256()
+  hasher.update(content_hash.encode())
+  hasher.update(("\nraxml_arguments " + " ".join(msa.raxml_args)).encode())
+  hasher.update(("\nmodel " + msa.get_model()).encode())
+  hasher.update(("\nmodeltest_arguments " + msa.modeltest_arguments).encode())
+  return hasher.hexdigest()
+
+def get_duplicates_file(output_dir):
+  return os.path.join(output_dir, "duplicates.txt")
+
+def remove_duplicates(msas, op):
+  """ Remove the aliases from msas and write them in duplicates.txt """
+  tasks = [(name, msa.path) for name, msa in sorted(msas.items())]
+  pool = multiprocessing.Pool(processes = max(1, min(multiprocessing.cpu_count(), int(op.cores))))
+  hashes = dict(pool.imap(content_hash_worker, tasks, chunksize = 16))
+  pool.close()
+  pool.join()
+  representatives = {}
+  aliases = []
+  for name, path in tasks:
+    if (hashes[name] == None):
+      continue
+    key = get_duplicate_key(msas[name], hashes[name])
+    if (key in representatives):
+      aliases.append((name, representatives[key], msas[name].path))
+    else:
+      representatives[key] = name
+  with open(get_duplicates_file(op.output_dir), "w") as writer:
+    for alias, representative, path in aliases:
+      writer.write(alias + "\t" + representative + "\t" + path + "\n")
+      del msas[alias]
+  logger.info("Found " + str(len(aliases)) + " duplicated MSAs, " + str(len(msas)) + " MSAs remain to process (see " + get_duplicates_file(op.output_dir) + ")")
+
+def read_duplicates(output_dir):
+  """ (alias, representative, alias MSA path) of the duplicated MSAs of the run """
+  duplicates_file = get_duplicates_file(output_dir)
+  if (not os.path.isfile(duplicates_file)):
+    return []
+  return [tuple(line.rstrip("\n").split("\t")) for line in open(duplicates_file).readlines()]
+
+def link_file(src, dest):
+  """ Hard link src to dest, or copy it if it cannot be linked """
+  if (os.path.lexists(dest)):
+    os.remove(dest)
+  try:
+    os.link(src, dest)
+  except OSError:
+    shutil.copy(src, dest)
+
+def link_family_files(src_dir, dest_dir, src_name, dest_name):
+  """ Link the files of src_dir prefixed by src_name into dest_dir,
+  prefixed by dest_name """
+  if (not os.path.isdir(src_dir)):
+    return
+  commons.makedirs(dest_dir)
+  for f in os.listdir(src_dir):
+    src = os.path.join(src_dir, f)
+    if (os.path.isfile(src) and f.startswith(src_name + ".")):
+      link_file(src, os.path.join(dest_dir, dest_name + f[len(src_name):]))
+
+def materialize_alias(alias, representative, op):
+  """ Make the results of representative available under the name alias """
+  output_dir = op.output_dir
+  for run_dir in ["modeltest_run", "mlsearch_run"]:
+    results = os.path.join(output_dir, run_dir, "results")
+    link_family_files(layout.get_family_dir(results, representative), layout.get_family_dir(results, alias), representative, alias)
+  for results in [os.path.join(output_dir, "concatenated_bootstraps"), os.path.join(output_dir, "supports_run", "results")]:
+    if (os.path.isdir(results)):
+      for f in os.listdir(results):
+        if (f.startswith(representative + ".")):
+          link_file(os.path.join(results, f), os.path.join(results, alias + f[len(representative):]))
+
+def materialize_aliases(msas, op):
+  """ Link the results of the analysed MSAs to their aliases, and
+  record the aliases in the results index """
+  invalid = []
+  materialized = []
+  alias_msas = {}
+  for alias, representative, path in read_duplicates(op.output_dir):
+    # the representatives found in the cache are not in msas anymore
+    if (representative in msas):
+      alias_msas[alias] = copy.copy(msas[representative])
+      alias_msas[alias].name = alias
+      alias_msas[alias].path = path
+      if (not msas[representative].valid):
+        invalid.append(alias)
+        continue
+    materialize_alias(alias, representative, op)
+    materialized.append(alias)
+  if (len(invalid) > 0):
+    with open(os.path.join(op.output_dir, "invalid_msas.txt"), "a") as writer:
+      for alias in invalid:
+        writer.write(alias + "\n")
+  resultsdb.record_msas(alias_msas, op)
+  resultsdb.record_family_outputs(materialized, op)
+  logger.info("Linked the results of " + str(len(materialized)) + " duplicated MSAs")
@@ -2,6 +2,8 @@ import os
 import sys
 import argparse
 import shutil
+import resultsdb
+import layout
 
 """
 Export relevant files from a run with ParGenes
@@ -80,14 +82,16 @@ def check_parameters(parms):
     sys.exit(1)
 
 def get_families(input_dir):
+  if (resultsdb.has_outputs(input_dir)):
+    return resultsdb.get_families(input_dir)
   parse_results_dir = os.path.join(input_dir, "mlsearch_run", "results")
-  return os.listdir(parse_results_dir)
+  return layout.list_families(parse_results_dir)
 
 def export_best_ml_tree(input_dir, output_dir, fams):
   print("--> For each family, exporting best ML tree...")
   results_dir = os.path.join(input_dir, "mlsearch_run", "results")
   for fam in fams:
-    tocopy = os.path.join(results_dir, fam, fam + ".raxml.bestTree")
+    tocopy = os.path.join(layout.get_family_dir(results_dir, fam), fam + ".raxml.bestTree")
     try:
       shutil.copy(tocopy, output_dir)
     except:
@@ -97,7 +101,7 @@ def export_best_ml_model(input_dir, output_dir, fams):
   print("--> For each family, exporting substitution model for the best ML run...")
   results_dir = os.path.join(input_dir, "mlsearch_run", "results")
   for fam in fams:
-    tocopy = os.path.join(results_dir, fam, fam + ".raxml.bestModel")
+    tocopy = os.path.join(layout.get_family_dir(results_dir, fam), fam + ".raxml.bestModel")
     try:
       shutil.copy(tocopy, output_dir)
     except:
@@ -191,6 +195,7 @@ def export_all_output(input_dir, output_dir, fams):
 if __name__== "__main__":
   p = get_input_parameters()
   check_parameters(p)
+  layout.init_layout(p.input_dir)
   print("")
   print("Start exporting files from pargenes run located in: " + p.input_dir)
   print("into the output directory: " + p.output_dir)
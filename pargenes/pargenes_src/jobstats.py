@@ -0,0 +1,189 @@
+import os
+import sys
+import copy
+import time
+import signal
+import subprocess
+
+"""
+Per-job resource accounting. With the schedulers running executables
+(fork and python schedulers, pipelined mode), each job is wrapped by this
+script, which runs the job, waits for it with wait4 and appends its
+resources to job_resources.txt in its step directory (one line per job,
+see COLUMNS): wall time, user and system CPU time, peak RSS, bytes read and
+written (from /proc/<pid>/io, or the block I/O counters of getrusage when
+/proc is not available) and exit code. With the split and onecore
+schedulers, the jobs run inside the MPI ranks of mpi-scheduler and are
+not accounted.
+write_summary gathers the tables of all the steps into
+job_resources_summary.txt: per-step totals, slowest families, worst
+parallel efficiencies (CPU time / (wall time * cores)) and memory outliers.
+"""
+
+TABLE = "job_resources.txt"
+SUMMARY = "job_resources_summary.txt"
+COLUMNS = ["name", "family", "cores", "wall_s", "user_s", "sys_s", "max_rss_kb", "read_bytes", "write_bytes", "exit_code"]
+STEPS = ["parse_run", "modeltest_run", "old_parse_run", "reparse_run",
+  os.path.join("constrain_run", "parsimony"), os.path.join("constrain_run", "consensus"),
+  "mlsearch_run", "supports_run"]
+# number of jobs or families listed in each section of the summary
+TOP = 10
+# jobs using more than MEMORY_OUTLIER_FACTOR times the median peak RSS of their step
+MEMORY_OUTLIER_FACTOR = 3.0
+
+def is_enabled(scheduler_mode, op):
+  """ True if the jobs run with scheduler_mode can be accounted """
+  return not op.disable_job_accounting and (scheduler_mode == "fork" or scheduler_mode == "python")
+
+def get_wrapper_library():
+  """ The program to run instead of the job libraries """
+  return sys.executable
+
+def init_table(run_path):
+  """ Write the header of the table of run_path if it does not exist yet """
+  table = os.path.join(run_path, TABLE)
+  if (not os.path.isfile(table)):
+    os.makedirs(run_path, exist_ok = True)
+    with open(table, "w") as writer:
+      writer.write(" ".join(COLUMNS) + "\n")
+
+def wrap_command(command, library, threads_arg, run_path):
+  """ Copy of command running library through this script """
+  wrapped = copy.copy(command)
+  prefix = [os.path.realpath(__file__), os.path.join(os.path.abspath(run_path), TABLE), command.name,
+      command.family or "-", threads_arg or "-", library]
+  wrapped.args = " ".join(prefix) + " " + command.args
+  return wrapped
+
+def read_proc_io(pid):
+  """ (bytes read, bytes written) of a process from /proc, or None """
+  try:
+    values = {}
+    with open("/proc/" + str(pid) + "/io") as reader:
+      for line in reader:
+        key, value = line.split(":")
+        values[key] = int(value)
+    return values["rchar"], values["wchar"]
+  except (OSError, KeyError, ValueError):
+    return None
+
+def get_cores(args, threads_arg):
+  """ Number of cores given to the job (value of its last threads argument) """
+  if (threads_arg != "-" and threads_arg in args):
+    index = len(args) - 1 - args[::-1].index(threads_arg)
+    if (index + 1 < len(args) and args[index + 1].isdigit()):
+      return int(args[index + 1])
+  return 1
+
+def run_wrapped(argv):
+  """ Run a wrapped job and record its resources. Return its exit status """
+  table, name, family, threads_arg, library = argv[:5]
+  args = argv[5:]
+  start = time.time()
+  try:
+    process = subprocess.Popen([library] + args)
+  except OSError as e:
+    print("Cannot run " + library + ": " + str(e))
+    return 127
+  io = None
+  try:
+    # wait for the job without reaping it, to read its I/O counters
+    os.waitid(os.P_PID, process.pid, os.WEXITED | os.WNOWAIT)
+    io = read_proc_io(process.pid)
+  except (AttributeError, OSError):
+    pass
+  pid, status, rusage = os.wait4(process.pid, 0)
+  wall = time.time() - start
+  returncode = os.waitstatus_to_exitcode(status)
+  if (io == None):
+    io = (rusage.ru_inblock * 512, rusage.ru_oublock * 512)
+  values = [name, family, get_cores(args, threads_arg), round(wall, 3), round(rusage.ru_utime, 3), round(rusage.ru_stime, 3),
+      rusage.ru_maxrss, io[0], io[1], returncode]
+  data = (" ".join(str(v) for v in values) + "\n").encode()
+  # one single append, as for the completed jobs ledger
+  fd = os.open(table, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+  try:
+    os.write(fd, data)
+  finally:
+    os.close(fd)
+  return returncode
+
+def read_table(table):
+  """ Rows of a table, as dicts """
+  rows = []
+  with open(table) as reader:
+    for line in reader.readlines()[1:]:
+      split = line.split()
+      if (len(split) != len(COLUMNS)):
+        continue
+      row = dict(zip(COLUMNS, split))
+      for column in COLUMNS[2:]:
+        row[column] = float(row[column])
+      rows.append(row)
+  return rows
+
+def get_efficiency(row):
+  if (row["wall_s"] <= 0.0):
+    return 1.0
+  return (row["user_s"] + row["sys_s"]) / (row["wall_s"] * row["cores"])
+
+def write_summary(output_dir):
+  """ Summarize the tables of all the steps into job_resources_summary.txt.
+  Return the path of the summary, or None if no job was accounted """
+  tables = {}
+  for step in STEPS:
+    table = os.path.join(output_dir, step, TABLE)
+    if (os.path.isfile(table)):
+      tables[step] = read_table(table)
+  if (len(tables) == 0):
+    return None
+  lines = []
+  lines.append("Resources per step")
+  lines.append("step".ljust(28) + "jobs".rjust(8) + "wall_s".rjust(12) + "cpu_s".rjust(12) + "efficiency".rjust(12) + "max_rss_mb".rjust(12) + "read_mb".rjust(10) + "write_mb".rjust(10))
+  families = {}
+  all_rows = []
+  outliers = []
+  for step, rows in tables.items():
+    if (len(rows) == 0):
+      continue
+    wall = sum(r["wall_s"] for r in rows)
+    cpu = sum(r["user_s"] + r["sys_s"] for r in rows)
+    core_seconds = sum(r["wall_s"] * r["cores"] for r in rows)
+    efficiency = cpu / core_seconds if core_seconds > 0.0 else 1.0
+    lines.append(step.ljust(28) + str(len(rows)).rjust(8) + str(round(wall, 1)).rjust(12) + str(round(cpu, 1)).rjust(12)
+        + str(round(efficiency, 2)).rjust(12) + str(round(max(r["max_rss_kb"] for r in rows) / 1024.0, 1)).rjust(12)
+        + str(round(sum(r["read_bytes"] for r in rows) / 1048576.0, 1)).rjust(10) + str(round(sum(r["write_bytes"] for r in rows) / 1048576.0, 1)).rjust(10))
+    for row in rows:
+      row["step"] = step
+      all_rows.append(row)
+      if (row["family"] != "-"):
+        families[row["family"]] = families.get(row["family"], 0.0) + row["wall_s"]
+    rss = sorted(r["max_rss_kb"] for r in rows)
+    median = rss[len(rss) // 2]
+    outliers.extend([(r, r["max_rss_kb"] / median) for r in rows if median > 0 and r["max_rss_kb"] > MEMORY_OUTLIER_FACTOR * median])
+  lines.append("")
+  lines.append("Slowest families (total wall time of their jobs)")
+  for family, wall in sorted(families.items(), key = lambda x: -x[1])[:TOP]:
+    lines.append("  " + family + " " + str(round(wall, 1)) + "s")
+  lines.append("")
+  lines.append("Worst parallel efficiencies (CPU time / (wall time * cores)), jobs with more than one core")
+  parallel_rows = [r for r in all_rows if r["cores"] > 1]
+  for row in sorted(parallel_rows, key = get_efficiency)[:TOP]:
+    lines.append("  " + row["name"] + " (" + row["step"] + ") " + str(int(row["cores"])) + " cores, efficiency " + str(round(get_efficiency(row), 2)))
+  lines.append("")
+  lines.append("Memory outliers (peak RSS above " + str(MEMORY_OUTLIER_FACTOR) + " times the median of their step)")
+  for row, ratio in sorted(outliers, key = lambda x: -x[0]["max_rss_kb"])[:TOP]:
+    lines.append("  " + row["name"] + " (" + row["step"] + ") " + str(round(row["max_rss_kb"] / 1024.0, 1)) + "MB, " + str(round(ratio, 1)) + " times the median")
+  summary = os.path.join(output_dir, SUMMARY)
+  with open(summary, "w") as writer:
+    writer.write("\n".join(lines) + "\n")
+  return summary
+
+if __name__ == "__main__":
+  returncode = run_wrapped(sys.argv[1:])
+  if (returncode < 0):
+    # die from the same signal as the job
+    signal.signal(-returncode, signal.SIG_DFL)
+    os.kill(os.getpid(), -returncode)
+    returncode = 128 - returncode
+  sys.exit(returncode)
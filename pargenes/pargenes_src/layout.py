@@ -0,0 +1,169 @@
+import os
+import io
+import glob
+import shutil
+import hashlib
+import tarfile
+import logger
+
+"""
+Layout of the per-family directories of the output directory.
+With the flat layout (default), the directory of a family is directly
+in the results directory of its step. With the sharded layout
+(--output-layout sharded), it is in a subdirectory named after the first
+SHARD_DIGITS hexadecimal digits of the hash of the family name, so that
+no directory holds more than a few hundred entries. The layout is chosen
+when the output directory is created (layout.txt) and kept by --continue.
+The finished intermediate files (searches of all the starting trees,
+bootstrap chunks, per-job logs) can be packed into one uncompressed tar
+archive per kind and step directory (packed_<kind>.tar, --pack-intermediates).
+open_file and listdir read the packed files in place.
+"""
+
+LAYOUTS = ["flat", "sharded"]
+SHARD_DIGITS = 2
+
+sharded = False
+# opened archives and their members, per process and archive path
+archives = {}
+# archives found in each directory
+directory_archives = {}
+
+def get_layout_file(output_dir):
+  return os.path.join(output_dir, "layout.txt")
+
+def init_layout(output_dir, requested = ""):
+  """ Use the layout of output_dir if it has one, or the requested layout """
+  global sharded
+  layout_file = get_layout_file(output_dir)
+  layout = requested
+  if (os.path.isfile(layout_file)):
+    layout = open(layout_file).read().strip()
+    if (requested != "" and requested != layout):
+      logger.warning("The output directory " + output_dir + " uses the " + layout + " layout, ignoring --output-layout " + requested)
+  elif (requested != ""):
+    with open(layout_file, "w") as writer:
+      writer.write(requested + "\n")
+  sharded = (layout == "sharded")
+  return layout
+
+def get_shard(name):
+  return hashlib.md5(name.encode()).hexdigest()[:SHARD_DIGITS]
+
+def get_family_dir(parent, name):
+  """ Directory of the family name in the results directory parent """
+  if (sharded):
+    return os.path.join(parent, get_shard(name), name)
+  return os.path.join(parent, name)
+
+def list_families(parent):
+  """ Names of the families with a directory in parent """
+  if (not sharded):
+    return listdir(parent)
+  families = []
+  for shard in listdir(parent):
+    if (len(shard) == SHARD_DIGITS):
+      families.extend(listdir(os.path.join(parent, shard)))
+  return families
+
+def get_archive_path(stage_dir, kind):
+  return os.path.join(stage_dir, "packed_" + kind + ".tar")
+
+def pack_directories(stage_dir, kind, directories):
+  """ Pack the directories (inside stage_dir) into the kind archive of
+  the step, and remove them. The archive is written under a temporary
+  name, so an interrupted packing leaves the directories untouched """
+  directories = [d for d in directories if os.path.isdir(d)]
+  if (len(directories) == 0):
+    return
+  archive = get_archive_path(stage_dir, kind)
+  with tarfile.open(archive + ".tmp", "w") as tar:
+    if (os.path.isfile(archive)):
+      # a previous run already packed some directories
+      with tarfile.open(archive) as previous:
+        for member in previous:
+          tar.addfile(member, previous.extractfile(member))
+    for directory in directories:
+      tar.add(directory, arcname = os.path.relpath(directory, stage_dir))
+  os.replace(archive + ".tmp", archive)
+  archives.pop((os.getpid(), archive), None)
+  directory_archives.clear()
+  for directory in directories:
+    shutil.rmtree(directory, ignore_errors = True)
+  logger.info("Packed " + str(len(directories)) + " " + kind + " directories into " + archive)
+
+def get_archive(archive):
+  """ Opened archive and its members, per path and per directory """
+  key = (os.getpid(), archive)
+  if (not key in archives):
+    tar = tarfile.open(archive)
+    members = {}
+    children = {}
+    for member in tar.getmembers():
+      members[member.name] = member
+      parent, child = os.path.split(member.name)
+      children.setdefault(parent, []).append(child)
+    archives[key] = (tar, members, children)
+  return archives[key]
+
+def get_directory_archives(directory):
+  if (not directory in directory_archives):
+    directory_archives[directory] = glob.glob(os.path.join(glob.escape(directory), "packed_*.tar"))
+  return directory_archives[directory]
+
+def find_packed(path):
+  """ (archive, member name) of a packed path, or (None, None) """
+  path = os.path.abspath(path)
+  stage_dir = os.path.dirname(path)
+  while (True):
+    for archive in get_directory_archives(stage_dir):
+      name = os.path.relpath(path, stage_dir)
+      tar, members, children = get_archive(archive)
+      if (name in members or name in children):
+        return archive, name
+    parent = os.path.dirname(stage_dir)
+    if (parent == stage_dir):
+      return None, None
+    stage_dir = parent
+
+def exists(path):
+  return os.path.exists(path) or find_packed(path)[0] != None
+
+def open_file(path, mode = "r"):
+  """ Open a file for reading, even if it was packed """
+  if (os.path.isfile(path)):
+    return open(path, mode)
+  archive, name = find_packed(path)
+  if (archive == None or not name in get_archive(archive)[1]):
+    raise FileNotFoundError("No such file: " + path)
+  tar, members, children = get_archive(archive)
+  reader = tar.extractfile(members[name])
+  if (mode == "rb"):
+    return reader
+  return io.TextIOWrapper(reader)
+
+def listdir(path):
+  """ os.listdir, including the packed files """
+  entries = []
+  if (os.path.isdir(path)):
+    entries = os.listdir(path)
+  archive, name = find_packed(path)
+  if (archive != None):
+    children = get_archive(archive)[2]
+    entries = sorted(set(entries) | set(children.get(name, [])))
+  return entries
+
+def pack_intermediates(output_dir, kinds):
+  """ Pack the finished intermediate directories of the given kinds:
+  multiple_runs (the searches of each starting tree), bootstraps (the
+  bootstrap chunks) and per_job_logs """
+  mlsearch_run = os.path.join(output_dir, "mlsearch_run")
+  if ("multiple_runs" in kinds):
+    results = os.path.join(mlsearch_run, "results")
+    directories = [os.path.join(get_family_dir(results, name), "multiple_runs") for name in list_families(results)]
+    pack_directories(mlsearch_run, "multiple_runs", directories)
+  if ("bootstraps" in kinds):
+    pack_directories(mlsearch_run, "bootstraps", [os.path.join(mlsearch_run, "bootstraps")])
+  if ("per_job_logs" in kinds):
+    for logs_dir in glob.glob(os.path.join(glob.escape(output_dir), "*", "per_job_logs")) + glob.glob(os.path.join(glob.escape(output_dir), "*", "*", "per_job_logs")):
+      pack_directories(os.path.dirname(logs_dir), "per_job_logs", [logs_dir])
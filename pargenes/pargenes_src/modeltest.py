@@ -3,6 +3,33 @@ import commons
 import scheduler
 import logger
 import report
+import costmodel
+import layout
+import admission
+import raxml
+
+# modeltest-ng writes the best models in its output file once it is done
+MODELTEST_DONE_MARKER = "Best model according to"
+
+def get_modeltest_command(msa, modeltest_results, op):
+  """ Build the modeltest-ng command of one MSA """
+  name = msa.name
+  modeltest_fasta_output_dir = layout.get_family_dir(modeltest_results, name)
+  commons.makedirs(modeltest_fasta_output_dir)
+  args = " -i "
+  args += msa.path
+  args += " -t mp "
+  prefix = os.path.join(modeltest_fasta_output_dir, name)
+  args += " -o " +  prefix
+  args += " " + msa.modeltest_arguments + " "
+  cost = costmodel.get_job_cost(msa, "modeltest", "modeltest_" + name, op.modeltest_cores, 1, msa.taxa * msa.per_taxon_clv_size, op)
+  memory = admission.get_job_memory(msa, op.modeltest_cores, "modeltest", raxml.get_rate_categories(msa.parse_model or msa.get_model()))
+  return scheduler.Command("modeltest_" + name, op.modeltest_cores, cost, args, prefix + ".out", MODELTEST_DONE_MARKER, name, "modeltest", memory)
+
+def check_modeltest_cores(op):
+  if (op.modeltest_cores < 4):
+    logger.error("The number of cores per modeltest job should at least be 4")
+    report.report_and_exit(op.output_dir, 1)
 
 def run(msas, output_dir, library, run_path, op): 
   """ Use the MPI scheduler to run modeltest on all the MSAs"""
@@ -11,24 +38,13 @@ def run(msas, output_dir, library, run_path, op):
   commands_file = os.path.join(run_path, "modeltest_command.txt")
   modeltest_results = os.path.join(run_path, "results")
   commons.makedirs(modeltest_results)
-  if (op.modeltest_cores < 4):
-    logger.error("The number of cores per modeltest job should at least be 4")
-    report.report_and_exit(op.output_dir, 1)
-  with open(commands_file, "w") as writer:
-    for name, msa in msas.items():
-      if (not msa.valid):
-        continue
-      modeltest_fasta_output_dir = os.path.join(modeltest_results, name)
-      commons.makedirs(modeltest_fasta_output_dir)
-      writer.write("modeltest_" + name + " ") 
-      writer.write(str(op.modeltest_cores) + " " + str(msa.taxa * msa.per_taxon_clv_size))
-      writer.write(" -i ")
-      writer.write(msa.path)
-      writer.write(" -t mp ")
-      writer.write(" -o " +  os.path.join(modeltest_results, name, name))
-      writer.write(" " + msa.modeltest_arguments + " ")
-      writer.write("\n")
-  scheduler.run_scheduler(library, op.scheduler, "-p", commands_file, run_path, cores, op)  
+  check_modeltest_cores(op)
+  commands = []
+  for name, msa in msas.items():
+    if (not msa.valid):
+      continue
+    commands.append(get_modeltest_command(msa, modeltest_results, op))
+  scheduler.run_commands(library, op.scheduler, "-p", commands, commands_file, run_path, cores, op)
 
 def get_model_from_log(log_file, modeltest_criteria):
   with open(log_file) as reader:
@@ -41,6 +57,27 @@ def get_model_from_log(log_file, modeltest_criteria):
         return model
   return None
 
+def parse_modeltest_result(modeltest_criteria, msa, modeltest_results):
+  """ Read the best-fit model of one MSA and store it into msa.
+  Flag the MSA as invalid if the model cannot be found """
+  name = msa.name
+  try:
+    modeltest_outfile = os.path.join(layout.get_family_dir(modeltest_results, name), name + ".out")
+    model = get_model_from_log(modeltest_outfile, modeltest_criteria)
+    if (model == None):
+      msa.valid = False
+      return None
+    msa.set_model(model)
+    return model
+  except:
+    msa.valid = False
+    return None
+
+def write_models_summary(models, run_path):
+  with open(os.path.join(run_path, "summary.txt"), "w") as writer:
+    for model, count in sorted(models.items(), key=lambda x: x[1], reverse=True):
+      writer.write(model + " " + str(count) + "\n")
+
 def parse_modeltest_results(modeltest_criteria, msas, output_dir):
   """ Parse the results from the MPI scheduler run to get the best-fit model
   for each MSA """
@@ -50,22 +87,11 @@ def parse_modeltest_results(modeltest_criteria, msas, output_dir):
   for name, msa in msas.items():
     if (not msa.valid):
       continue
-    try:
-      modeltest_outfile = os.path.join(modeltest_results, name, name + ".out")  
-      model = get_model_from_log(modeltest_outfile, modeltest_criteria)
-      if (model == None):
-        msa.valid = False
-        continue
-      msa.set_model(model)
-      if (not model in models):
-         models[model] = 0
-         models[model] += 1
-    except:
-      msa.valid = False
+    model = parse_modeltest_result(modeltest_criteria, msa, modeltest_results)
+    if (model == None):
       continue
+    if (not model in models):
+       models[model] = 0
+       models[model] += 1
     # write a summary of the models
-  with open(os.path.join(run_path, "summary.txt"), "w") as writer:
-    for model, count in sorted(models.items(), key=lambda x: x[1], reverse=True):
-      writer.write(model + " " + str(count) + "\n")
-
-
+  write_models_summary(models, run_path)
@@ -17,6 +17,18 @@ import report
 import datetime
 import version
 import constraint
+import pipeline
+import cache
+import costmodel
+import plan
+import resultsdb
+import catalog
+import archive
+import layout
+import retention
+import duplicates
+import status
+import jobstats
 
 def print_header(args):
   logger.info("########################")
@@ -45,9 +57,13 @@ def main_raxml_runner(args, op):
     sys.exit(1)
   commons.makedirs(output_dir)
   logger.init_logger(op.output_dir)
+  layout.init_layout(output_dir, op.output_layout)
   print_header(args)
+  if (op.status_interval > 0):
+    status.start_status_file(output_dir, op.status_interval)
   msas = None
   logger.timed_log("end of MSAs initializations")
+  costmodel.load_history(op)
   scriptdir = os.path.dirname(os.path.realpath(__file__))
   modeltest_run_path = os.path.join(output_dir, "modeltest_run")
   constrain_run_path = os.path.join(output_dir, "constrain_run")
@@ -79,54 +95,102 @@ def main_raxml_runner(args, op):
       aster_bin = os.path.join(binaries_dir, "astral")
   if (checkpoint_index < 1):
     msas = commons.init_msas(op)
+    if (op.deduplicate or op.cache_dir):
+      # the content of all the MSAs is hashed
+      archive.stage_msas(list(msas.values()), op)
+    if (op.deduplicate):
+      duplicates.remove_duplicates(msas, op)
+    if (op.cache_dir):
+      cache.use_cached_results(msas, raxml_library, modeltest_library, op)
     raxml.run_parsing_step(msas, raxml_library, op.scheduler, os.path.join(output_dir, "parse_run"), op.cores, op)
     raxml.analyse_parsed_msas(msas, op)
+    archive.release_msas([msa for msa in msas.values() if not msa.valid], op)
+    if (op.cache_dir):
+      cache.store_invalid_msas(msas, op)
+    resultsdb.record_msas(msas, op)
     checkpoint.write_checkpoint(output_dir, 1)
     logger.timed_log("end of parsing mpi-scheduler run")
   else:
-    msas = raxml.load_msas(op)
+    msas = catalog.load_msas(op)
+    if (archive.is_archive_input(op)):
+      # the MSAs are extracted again when the jobs need them, maybe into another staging directory
+      for msa in msas.values():
+        msa.path = archive.get_staged_path(op, os.path.basename(msa.path))
   if (op.dry_run):
     logger.info("End of the dry run. Exiting")
     return 0
+  if (op.plan):
+    plan.run_plan(msas, op)
+    return 0
   logger.timed_log("end of anlysing parsing results")
+  if (op.pipeline and checkpoint_index < 6):
+    pipeline.run_pipeline(msas, raxml_library, modeltest_library, op)
+    logger.timed_log("end of the pipelined run")
+    if (op.pack_intermediates):
+      layout.pack_intermediates(output_dir, ["multiple_runs", "bootstraps"])
+    checkpoint.write_checkpoint(output_dir, 6)
+    # all the per-family steps are done
+    checkpoint_index = 6
   if (op.use_modeltest):
     if (checkpoint_index < 2):
       modeltest.run(msas, output_dir, modeltest_library, modeltest_run_path, op)
       logger.timed_log("end of modeltest mpi-scheduler run")
       modeltest.parse_modeltest_results(op.modeltest_criteria, msas, output_dir)
       logger.timed_log("end of parsing  modeltest results")
-      # then recompute the binary MSA files to put the correct model, and reevaluate the MSA sizes with the new models
-      shutil.move(os.path.join(output_dir, "parse_run"), os.path.join(output_dir, "old_parse_run"))
-      raxml.run_parsing_step(msas, raxml_library, op.scheduler, os.path.join(output_dir, "parse_run"), op.cores, op)
-      raxml.analyse_parsed_msas(msas, op)
+      if (op.model_reparse == "changed"):
+        # only recompute the binary MSA files when the MSA sizes cannot be derived from the new models
+        raxml.reparse_changed_msas(msas, raxml_library, op.scheduler, op.cores, op)
+      else:
+        # then recompute the binary MSA files to put the correct model, and reevaluate the MSA sizes with the new models
+        # (unless a previous interrupted run already did it)
+        if (not os.path.isdir(os.path.join(output_dir, "old_parse_run"))):
+          shutil.move(os.path.join(output_dir, "parse_run"), os.path.join(output_dir, "old_parse_run"))
+        raxml.run_parsing_step(msas, raxml_library, op.scheduler, os.path.join(output_dir, "parse_run"), op.cores, op)
+        raxml.analyse_parsed_msas(msas, op)
       logger.timed_log("end of the second parsing step")
       checkpoint.write_checkpoint(output_dir, 2)
+      if (op.retention == "lean"):
+        retention.remove_old_parse_run(op)
   if (checkpoint_index < 3):
     print("TODO UPDATE CHECKPOINT")
     if (op.constrain_search):
       print("Computing consensus trees ")
-      samples = 100
+      samples = constraint.CONSTRAINT_SAMPLES
       constraint.compute_constrain(msas, samples, raxml_library, op.scheduler, constrain_run_path, op.cores, op)
       logger.timed_log("end of consensus tree building")
   if (checkpoint_index < 3):
     raxml.run(msas, op.random_starting_trees, op.parsimony_starting_trees, op.bootstraps, raxml_library, op.scheduler, raxml_run_path, op.cores, op)
     logger.timed_log("end of mlsearch mpi-scheduler run")
     checkpoint.write_checkpoint(output_dir, 3)
+    archive.release_msas(list(msas.values()), op)
+    if (op.retention == "lean"):
+      retention.remove_binary_msas(msas, op)
   if (op.random_starting_trees + op.parsimony_starting_trees > 1):
     if (checkpoint_index < 4):
       raxml.select_best_ml_tree(msas, op)
       logger.timed_log("end of selecting the best ML tree")
       checkpoint.write_checkpoint(output_dir, 4)
+      if (op.pack_intermediates):
+        layout.pack_intermediates(output_dir, ["multiple_runs"])
   if (op.bootstraps != 0):
     if (checkpoint_index < 5):
-      bootstraps.concatenate_bootstraps(output_dir, min(16, op.cores))
+      bootstraps.concatenate_bootstraps(output_dir, min(16, op.cores), op.retention == "lean")
       logger.timed_log("end of bootstraps concatenation")
       checkpoint.write_checkpoint(output_dir, 5)
+      if (op.pack_intermediates):
+        layout.pack_intermediates(output_dir, ["bootstraps"])
     starting_trees = op.random_starting_trees + op.parsimony_starting_trees
     if (checkpoint_index < 6 and starting_trees > 0):
       bootstraps.run(msas, output_dir, raxml_library, op.scheduler, os.path.join(output_dir, "supports_run"), op.cores, op)
       logger.timed_log("end of supports mpi-scheduler run")
       checkpoint.write_checkpoint(output_dir, 6)
+  if (op.deduplicate and checkpoint_index < 7):
+    duplicates.materialize_aliases(msas, op)
+  if (checkpoint_index < 7):
+    resultsdb.record_msas(msas, op)
+    resultsdb.record_outputs(msas, op)
+  if (op.cache_dir and checkpoint_index < 7):
+    cache.store_results(msas, op)
   if (op.use_astral):
     if (checkpoint_index < 7):
       astral.run_astral_pargenes(astral_jar,  op)
@@ -136,12 +200,25 @@ def main_raxml_runner(args, op):
       aster.run_aster_pargenes(aster_bin,  op)
       checkpoint.write_checkpoint(output_dir, 7)
   all_invalid = True
+  if (op.cache_dir and cache.count_cached_results(op) > 0):
+    all_invalid = False
   for name, msa in msas.items():
     if (msa.valid):
       all_invalid = False
   if (all_invalid):
     print("[Error] ParGenes failed to analyze all MSAs.")
     report.report_and_exit(op.output_dir, 1)
+  if (archive.is_archive_input(op)):
+    archive.remove_staged_msas(op)
+  if (op.pack_intermediates):
+    # also packs what an interrupted run did not pack
+    layout.pack_intermediates(output_dir, ["multiple_runs", "bootstraps", "per_job_logs"])
+  retention.log_summary(output_dir)
+  resources_summary = jobstats.write_summary(output_dir)
+  if (resources_summary != None):
+    logger.info("Resources used by the jobs: see " + resources_summary)
+  if (op.status_interval > 0):
+    status.write_status_file(output_dir)
   print_stats(op)
   return 0
 
@@ -0,0 +1,338 @@
+import os
+import shutil
+import commons
+import logger
+import raxml
+import modeltest
+import bootstraps
+import constraint
+import report
+import checkpoint
+import cache
+import costmodel
+import bootstopping
+import resultsdb
+import catalog
+import retention
+import scanner
+import dispatcher
+import jobstats
+import archive
+
+"""
+Pipelined execution of the per-family steps (modeltest, second parsing,
+constraint, ML searches, bootstraps, supports). Instead of waiting for all
+the jobs of a step before starting the next step, each family moves to
+its next step as soon as its own jobs are done, so that the end of a step
+overlaps with the beginning of the next one.
+The jobs are run on the local node only, by the python scheduler
+(dispatcher.py), whatever the --scheduler option.
+"""
+
+class PipelineDispatcher(dispatcher.Dispatcher):
+  """ Dispatcher recording each job as soon as it finishes, so that an
+  interrupted pipelined run can continue from its completed jobs """
+  def __init__(self, cores, op):
+    dispatcher.Dispatcher.__init__(self, cores, False, op.retry_failed_jobs, op.node_memory)
+    self.op = op
+
+  def record_job(self, job, returncode, runtime):
+    name = job.command.name
+    if (returncode != 0):
+      add_failed_command(name, self.op)
+    else:
+      checkpoint.mark_jobs_completed(job.run_path, [name])
+      costmodel.record_runtime(name, runtime)
+    resultsdb.record_jobs([job.command], [returncode == 0], self.op, [runtime])
+
+def add_failed_command(name, op):
+  """ Record a failed job in the failed commands of the run (the dispatcher
+  records it in the failed commands of its step) """
+  with open(os.path.join(op.output_dir, "failed_commands.txt"), "a") as writer:
+    writer.write(name + "\n")
+  if (op.job_failure_fatal):
+    logger.error("Job " + name + " failed")
+    logger.error("Job failures are fatal. To continue when a job fails, do not set --job-failure-fatal")
+    logger.error("Aborting")
+    report.report_and_exit(op.output_dir, 242)
+
+class Pipeline:
+  """ Per-family state machine: each callback moves one family to its next step """
+  def __init__(self, msas, raxml_library, modeltest_library, op):
+    self.msas = msas
+    self.raxml_library = raxml_library
+    self.modeltest_library = modeltest_library
+    self.op = op
+    self.scheduler_mode = op.scheduler
+    self.dispatcher = PipelineDispatcher(op.cores, op)
+    output_dir = op.output_dir
+    self.modeltest_run_path = os.path.join(output_dir, "modeltest_run")
+    self.parse_run_path = os.path.join(output_dir, "parse_run")
+    if (op.model_reparse == "changed"):
+      self.parse_run_path = os.path.join(output_dir, "reparse_run")
+    self.parsi_run_path = os.path.join(output_dir, "constrain_run", "parsimony")
+    self.consensus_run_path = os.path.join(output_dir, "constrain_run", "consensus")
+    self.mlsearch_run_path = os.path.join(output_dir, "mlsearch_run")
+    self.supports_run_path = os.path.join(output_dir, "supports_run")
+    self.concatenated_dir = os.path.join(output_dir, "concatenated_bootstraps")
+    self.starting_trees = op.random_starting_trees + op.parsimony_starting_trees
+    self.taxa_limit = None
+    # remaining ML search and bootstrap jobs per family
+    self.remaining_mlsearch = {}
+    self.remaining_bootstraps = {}
+    # parallel autoMRE: first bootstrap job of the next wave of each family
+    self.next_bootstrap_chunk = {}
+    # adaptive starting trees: current wave of ML searches of each family
+    self.mlsearch_wave = {}
+    self.models = {}
+    # completed jobs per run directory, when continuing a previous run
+    self.completed_jobs = {}
+
+  def is_completed(self, command, run_path):
+    if (not run_path in self.completed_jobs):
+      self.completed_jobs[run_path] = checkpoint.read_completed_jobs(run_path)
+    if (command.name in self.completed_jobs[run_path]):
+      return True
+    if (checkpoint.is_command_done(command)):
+      checkpoint.mark_jobs_completed(run_path, [command.name])
+      return True
+    return False
+
+  def submit(self, command, library, threads_arg, run_path, commands_file, on_done):
+    """ Record the command in the commands file of its step and schedule it.
+    When continuing a run, the commands that already completed are not
+    scheduled again and the family directly moves to its next step """
+    if (self.op.do_continue and self.is_completed(command, run_path)):
+      resultsdb.record_jobs([command], [True], self.op)
+      on_done(True)
+      return
+    archive.stage_commands([command], self.op)
+    commons.makedirs(run_path)
+    if (jobstats.is_enabled("python", self.op)):
+      jobstats.init_table(run_path)
+      command = jobstats.wrap_command(command, library, threads_arg, run_path)
+      library = jobstats.get_wrapper_library()
+    with open(os.path.join(run_path, commands_file), "a") as writer:
+      writer.write(command.get_line() + "\n")
+    self.dispatcher.submit(dispatcher.Job(command, library, threads_arg, run_path, on_done))
+
+  def start_family(self, msa):
+    if (not msa.valid):
+      return
+    if (self.op.use_modeltest):
+      results = os.path.join(self.modeltest_run_path, "results")
+      command = modeltest.get_modeltest_command(msa, results, self.op)
+      self.submit(command, self.modeltest_library, "-p", self.modeltest_run_path, "modeltest_command.txt",
+          lambda ok: self.on_modeltest_done(msa))
+    else:
+      self.start_constraint(msa)
+
+  def on_modeltest_done(self, msa):
+    results = os.path.join(self.modeltest_run_path, "results")
+    model = modeltest.parse_modeltest_result(self.op.modeltest_criteria, msa, results)
+    if (model == None):
+      archive.release_msas([msa], self.op)
+      return
+    if (not model in self.models):
+      self.models[model] = 0
+    self.models[model] += 1
+    if (self.op.model_reparse == "changed" and raxml.derive_model_dimensions(msa)):
+      raxml.apply_cores_assignment_limit(msa, self.taxa_limit)
+      self.start_constraint(msa)
+      return
+    # recompute the binary MSA file with the correct model, and reevaluate the MSA size
+    if (self.op.cache_dir and cache.use_cached_parse(msa, self.raxml_library, self.op)):
+      self.on_parse_done(msa)
+      return
+    if (self.op.msa_scanner == "native" and scanner.scan_family(msa, os.path.join(self.parse_run_path, "results"), self.op)):
+      self.on_parse_done(msa)
+      return
+    command = raxml.get_parse_command(msa, os.path.join(self.parse_run_path, "results"), self.scheduler_mode, self.op)
+    self.submit(command, self.raxml_library, "--threads", self.parse_run_path, "parse_command.txt",
+        lambda ok: self.on_parse_done(msa, ok))
+
+  def on_parse_done(self, msa, store_in_cache = False):
+    if (store_in_cache and self.op.cache_dir):
+      cache.store_parse(msa, self.raxml_library, self.op)
+    results = os.path.join(self.parse_run_path, "results")
+    raxml.analyse_parsed_msa(msa, results, self.op.core_assignment)
+    if (not msa.valid):
+      archive.release_msas([msa], self.op)
+      return
+    raxml.apply_cores_assignment_limit(msa, self.taxa_limit)
+    self.start_constraint(msa)
+
+  def start_constraint(self, msa):
+    if (not self.op.constrain_search):
+      self.start_trees(msa)
+      return
+    results = os.path.join(self.parsi_run_path, "results")
+    commons.makedirs(results)
+    command = constraint.get_parsimony_command(msa, constraint.CONSTRAINT_SAMPLES, results, self.scheduler_mode)
+    self.submit(command, self.raxml_library, "--threads", self.parsi_run_path, "command.txt",
+        lambda ok: self.on_parsimony_done(msa))
+
+  def on_parsimony_done(self, msa):
+    parsi_results = os.path.join(self.parsi_run_path, "results")
+    results = os.path.join(self.consensus_run_path, "results")
+    commons.makedirs(results)
+    command = constraint.get_consensus_command(msa, parsi_results, results, self.scheduler_mode)
+    self.submit(command, self.raxml_library, "--threads", self.consensus_run_path, "command.txt",
+        lambda ok: self.start_trees(msa))
+
+  def start_trees(self, msa):
+    """ Submit the ML searches and the bootstraps of one family """
+    op = self.op
+    name = msa.name
+    results = os.path.join(self.mlsearch_run_path, "results")
+    bs_dir = os.path.join(self.mlsearch_run_path, "bootstraps")
+    starting_trees_list = None
+    if (op.adaptive_starting_trees):
+      # first wave of ML searches, see on_mlsearch_done
+      starting_trees_list = raxml.get_starting_trees_wave(op.random_starting_trees, op.parsimony_starting_trees, 0)
+      self.mlsearch_wave[name] = 0
+    mlsearch_commands = raxml.get_mlsearch_commands(msa, op.random_starting_trees, op.parsimony_starting_trees, results, self.scheduler_mode, op, starting_trees_list)
+    bootstrap_commands = []
+    if (op.bootstraps != 0 and op.parallel_autoMRE):
+      # first wave of bootstrap jobs, see on_bootstrap_done
+      chunks = bootstopping.get_wave_chunks(self.chunk_sizes[name])
+      bootstrap_commands = raxml.get_bootstrap_commands(msa, op.bootstraps, self.chunk_sizes[name], bs_dir, self.scheduler_mode, op, 0, chunks)
+      self.next_bootstrap_chunk[name] = chunks
+    elif (op.bootstraps != 0):
+      bootstrap_commands = raxml.get_bootstrap_commands(msa, op.bootstraps, self.chunk_sizes[name], bs_dir, self.scheduler_mode, op)
+    self.remaining_mlsearch[name] = len(mlsearch_commands)
+    self.remaining_bootstraps[name] = len(bootstrap_commands)
+    if (len(mlsearch_commands) + len(bootstrap_commands) == 0):
+      return
+    self.submit_mlsearches(msa, mlsearch_commands)
+    self.submit_bootstraps(msa, bootstrap_commands)
+
+  def submit_mlsearches(self, msa, mlsearch_commands):
+    for command in mlsearch_commands:
+      self.submit(command, self.raxml_library, "--threads", self.mlsearch_run_path, "mlsearch_command.txt",
+          lambda ok: self.on_mlsearch_done(msa))
+
+  def submit_bootstraps(self, msa, bootstrap_commands):
+    for command in bootstrap_commands:
+      self.submit(command, self.raxml_library, "--threads", self.mlsearch_run_path, "mlsearch_command.txt",
+          lambda ok: self.on_bootstrap_done(msa))
+
+  def on_mlsearch_done(self, msa):
+    name = msa.name
+    self.remaining_mlsearch[name] -= 1
+    if (self.remaining_mlsearch[name] > 0):
+      return
+    if (self.op.adaptive_starting_trees and self.start_mlsearch_wave(msa)):
+      return
+    if (self.starting_trees > 1):
+      try:
+        lls = resultsdb.get_family_log_likelihoods(self.op.output_dir, name)
+        raxml.select_best_ml_tree_msa(msa, os.path.join(self.mlsearch_run_path, "results"), self.op, lls)
+      except Exception as e:
+        logger.warning("Could not select the best ML tree of " + name + ": " + str(e))
+        return
+    self.check_supports(msa)
+
+  def on_bootstrap_done(self, msa):
+    name = msa.name
+    self.remaining_bootstraps[name] -= 1
+    if (self.remaining_bootstraps[name] > 0):
+      return
+    bootstraps_dir = os.path.join(self.mlsearch_run_path, "bootstraps")
+    if (self.op.parallel_autoMRE and self.start_bootstopping_wave(msa)):
+      return
+    bootstraps.concatenate_bootstrap_msa(bootstraps_dir, self.concatenated_dir, name, self.op.retention == "lean")
+    self.check_supports(msa)
+
+  def start_mlsearch_wave(self, msa):
+    """ Adaptive starting trees: submit the next wave of ML searches of a
+    family if its best trees did not converge yet. Return False if the
+    searches of the family are done """
+    op = self.op
+    name = msa.name
+    wave = self.mlsearch_wave[name] + 1
+    starting_trees_list = raxml.get_starting_trees_wave(op.random_starting_trees, op.parsimony_starting_trees, wave)
+    if (len(starting_trees_list) == 0):
+      return False
+    results = os.path.join(self.mlsearch_run_path, "results")
+    if (raxml.has_search_converged(msa, results, self.starting_trees)):
+      return False
+    commands = raxml.get_mlsearch_commands(msa, op.random_starting_trees, op.parsimony_starting_trees, results, self.scheduler_mode, op, starting_trees_list)
+    self.mlsearch_wave[name] = wave
+    self.remaining_mlsearch[name] = len(commands)
+    self.submit_mlsearches(msa, commands)
+    return True
+
+  def start_bootstopping_wave(self, msa):
+    """ Parallel autoMRE: submit the next wave of bootstrap jobs of a family
+    if it did not converge yet. Return False if the family is done """
+    name = msa.name
+    chunk_size = self.chunk_sizes[name]
+    first_chunk = self.next_bootstrap_chunk[name]
+    if (first_chunk >= raxml.get_bootstrap_chunks_number(self.op.bootstraps, chunk_size, self.op)):
+      return False
+    bootstraps_dir = os.path.join(self.mlsearch_run_path, "bootstraps")
+    if (bootstopping.check_family(bootstraps_dir, name, self.mlsearch_run_path, self.op)):
+      return False
+    chunks = bootstopping.get_wave_chunks(chunk_size)
+    commands = raxml.get_bootstrap_commands(msa, self.op.bootstraps, chunk_size, bootstraps_dir, self.scheduler_mode, self.op, first_chunk, chunks)
+    self.next_bootstrap_chunk[name] = first_chunk + chunks
+    self.remaining_bootstraps[name] = len(commands)
+    self.submit_bootstraps(msa, commands)
+    return True
+
+  def check_supports(self, msa):
+    """ Submit the support jobs of a family once both its ML searches
+    and its bootstraps are done """
+    name = msa.name
+    if (self.remaining_mlsearch[name] > 0 or self.remaining_bootstraps[name] > 0):
+      return
+    archive.release_msas([msa], self.op)
+    if (self.op.retention == "lean"):
+      retention.remove_binary_msa(msa, self.op)
+    if (self.op.bootstraps == 0 or self.starting_trees == 0):
+      return
+    ml_trees_dir = os.path.join(self.mlsearch_run_path, "results")
+    results = os.path.join(self.supports_run_path, "results")
+    commons.makedirs(results)
+    for command in bootstraps.get_support_commands(msa, ml_trees_dir, self.concatenated_dir, results, self.scheduler_mode):
+      self.submit(command, self.raxml_library, "--threads", self.supports_run_path, "supports_commands.txt",
+          lambda ok: None)
+
+  def run(self):
+    op = self.op
+    if (op.use_modeltest):
+      modeltest.check_modeltest_cores(op)
+      if (op.model_reparse == "all"):
+        # the second parsing step (with the models found by modeltest) goes to a new parse_run
+        old_parse_run_path = os.path.join(op.output_dir, "old_parse_run")
+        if (not os.path.isdir(old_parse_run_path)):
+          shutil.move(self.parse_run_path, old_parse_run_path)
+      commons.makedirs(os.path.join(self.parse_run_path, "results"))
+      catalog.save_msas(self.msas, op)
+    if (op.bootstraps != 0):
+      commons.makedirs(self.concatenated_dir)
+    self.taxa_limit = raxml.get_cores_assignment_limit(self.msas, op)
+    self.chunk_sizes = raxml.get_bootstrap_chunk_sizes(self.msas, op.bootstraps, op.cores, self.mlsearch_run_path, op)
+    # extract the MSAs read by the first jobs of the families at once,
+    # rather than streaming a compressed archive for each job
+    if (op.use_modeltest):
+      archive.stage_msas([msa for msa in self.msas.values() if msa.valid], op)
+    else:
+      archive.stage_msas([msa for msa in self.msas.values() if msa.valid and raxml.get_msa_input_path(msa) == msa.path], op)
+    for name, msa in self.msas.items():
+      self.start_family(msa)
+    self.dispatcher.run()
+    if (op.use_modeltest):
+      modeltest.write_models_summary(self.models, self.modeltest_run_path)
+      raxml.write_invalid_msas(self.msas, op.output_dir)
+      catalog.save_msas(self.msas, op)
+      if (op.retention == "lean"):
+        retention.remove_old_parse_run(op)
+
+def run_pipeline(msas, raxml_library, modeltest_library, op):
+  """ Run all the per-family steps following the pipelined execution mode """
+  if (not os.path.isfile(raxml_library) or (op.use_modeltest and not os.path.isfile(modeltest_library))):
+    logger.error("Cannot find the binaries " + raxml_library + " and " + modeltest_library + ". Please check your installation")
+    report.report_and_exit(op.output_dir, 238)
+  Pipeline(msas, raxml_library, modeltest_library, op).run()
@@ -0,0 +1,229 @@
+import os
+import copy
+import heapq
+import logger
+import costmodel
+import raxml
+import allocation
+import admission
+import bootstopping
+import constraint
+
+"""
+Planning mode (--plan): simulate the scheduling of the jobs of each step
+on several core counts, from the dimensions found by the parsing step,
+and report the predicted wall time, the per-step makespan, the core
+utilization and the peak memory. The job runtimes come from the runtime
+history (see costmodel). Without history, the durations are given in
+taxa * per_taxon_clv_size units, which only allows to compare core counts.
+The jobs are generated again for each core count, with the same rules as
+the run (makespan core assignment, bootstrap chunks). A step is a list of
+batches run one after the other: the waves of --parallel-autoMRE and of
+--adaptive-starting-trees are separate batches, and the plan assumes that
+no family converges before the last wave (upper bound).
+"""
+
+# cost of the cheap jobs (parsimony tree, consensus, supports) relative
+# to an ML search
+CHEAP_JOB_RATIO = 0.01
+
+class PlannedJob:
+  def __init__(self, cores, duration, memory):
+    self.cores = cores
+    self.duration = duration
+    self.memory = memory
+
+def get_job_duration(msa, job_type, threads, trees, op):
+  features = costmodel.get_features(msa, job_type, threads, trees, op)
+  seconds = costmodel.predict_seconds(features)
+  if (seconds != None):
+    return seconds
+  return costmodel.get_default_units(features)
+
+def get_planned_msas(msas, cores, op):
+  """ Copies of the valid MSAs, with the cores a run on cores cores
+  would give them """
+  planned = dict((name, copy.copy(msa)) for name, msa in msas.items() if msa.valid)
+  if (op.core_assignment == "makespan"):
+    planned_op = copy.copy(op)
+    planned_op.cores = cores
+    allocation.allocate_cores(planned, planned_op)
+  return planned
+
+def add_wave_jobs(batches, wave, jobs):
+  """ Add jobs to the batch of their wave """
+  while (len(batches) <= wave):
+    batches.append([])
+  batches[wave].extend(jobs)
+
+def get_steps(msas, cores, op):
+  """ Batches of jobs of each step of a run on cores cores, as the real
+  run would generate them """
+  steps = []
+  msas = get_planned_msas(msas, cores, op)
+  valid_msas = list(msas.values())
+  if (op.use_modeltest):
+    jobs = []
+    for msa in valid_msas:
+      parse_categories = raxml.get_rate_categories(msa.parse_model or msa.get_model())
+      memory = admission.get_job_memory(msa, op.modeltest_cores, "modeltest", parse_categories)
+      jobs.append(PlannedJob(op.modeltest_cores, get_job_duration(msa, "modeltest", op.modeltest_cores, 1, op), memory))
+    steps.append(("modeltest", [jobs]))
+  if (op.constrain_search):
+    parsimony_jobs = []
+    consensus_jobs = []
+    for msa in valid_msas:
+      duration = get_job_duration(msa, "mlsearch", 1, 1, op) * CHEAP_JOB_RATIO
+      parsimony_jobs.append(PlannedJob(1, duration * constraint.CONSTRAINT_SAMPLES, msa.memory))
+      consensus_jobs.append(PlannedJob(1, duration, 0.0))
+    steps.append(("constraint", [parsimony_jobs, consensus_jobs]))
+  # first batch, with the first wave of the bootstraps and of the ML searches
+  # (see raxml.run), then the bootstopping waves and the adaptive waves
+  mlsearch_batches = [[]]
+  bootstopping_batches = []
+  adaptive_batches = []
+  starting_trees = op.random_starting_trees + op.parsimony_starting_trees
+  chunk_sizes = raxml.get_bootstrap_chunk_sizes(msas, op.bootstraps, cores, None, op)
+  for msa in valid_msas:
+    duration = get_job_duration(msa, "mlsearch", msa.cores, 1, op)
+    memory = admission.get_job_memory(msa, msa.cores)
+    if (op.adaptive_starting_trees):
+      wave = 0
+      trees = len(raxml.get_starting_trees_wave(op.random_starting_trees, op.parsimony_starting_trees, wave))
+      while (trees > 0):
+        jobs = [PlannedJob(msa.cores, duration, memory) for i in range(0, trees)]
+        if (wave == 0):
+          mlsearch_batches[0].extend(jobs)
+        else:
+          add_wave_jobs(adaptive_batches, wave - 1, jobs)
+        wave += 1
+        trees = len(raxml.get_starting_trees_wave(op.random_starting_trees, op.parsimony_starting_trees, wave))
+    else:
+      mlsearch_batches[0].extend([PlannedJob(msa.cores, duration, memory) for i in range(0, starting_trees)])
+    if (op.bootstraps > 0):
+      bs_cores = max(1, msa.cores // 2)
+      chunk_size = chunk_sizes[msa.name]
+      chunks = raxml.get_bootstrap_chunks_number(op.bootstraps, chunk_size, op)
+      if (op.autoMRE and not op.parallel_autoMRE):
+        chunk_size = op.bootstraps
+      duration = get_job_duration(msa, "bootstrap", bs_cores, chunk_size, op)
+      memory = admission.get_job_memory(msa, bs_cores)
+      wave_chunks = chunks
+      if (op.parallel_autoMRE):
+        wave_chunks = bootstopping.get_wave_chunks(chunk_size)
+      for wave, first_chunk in enumerate(range(0, chunks, wave_chunks)):
+        jobs = [PlannedJob(bs_cores, duration, memory) for i in range(first_chunk, min(chunks, first_chunk + wave_chunks))]
+        if (wave == 0):
+          mlsearch_batches[0].extend(jobs)
+        else:
+          add_wave_jobs(bootstopping_batches, wave - 1, jobs)
+  steps.append(("mlsearch", mlsearch_batches + bootstopping_batches + adaptive_batches))
+  if (op.bootstraps > 0 and starting_trees > 0):
+    jobs = []
+    for msa in valid_msas:
+      duration = get_job_duration(msa, "mlsearch", 1, 1, op) * CHEAP_JOB_RATIO
+      jobs.append(PlannedJob(1, duration, msa.memory))
+      jobs.append(PlannedJob(1, duration, msa.memory))
+    steps.append(("supports", [jobs]))
+  return steps
+
+def simulate(jobs, cores):
+  """ Simulate the scheduler on cores cores: the longest job that fits
+  in the free cores is started first. Return the makespan, the used
+  core time and the peak memory """
+  # ready jobs, grouped per number of cores, sorted by decreasing duration
+  ready = {}
+  for job in jobs:
+    job_cores = max(1, min(job.cores, cores))
+    if (not job_cores in ready):
+      ready[job_cores] = []
+    ready[job_cores].append(job)
+  for job_cores in ready:
+    ready[job_cores].sort(key = lambda job: job.duration)
+  running = []
+  free_cores = cores
+  memory = 0.0
+  peak_memory = 0.0
+  current_time = 0.0
+  core_time = 0.0
+  while (True):
+    while (True):
+      best = None
+      for job_cores, group in ready.items():
+        if (job_cores <= free_cores and len(group) > 0):
+          if (best == None or group[-1].duration > ready[best][-1].duration):
+            best = job_cores
+      if (best == None):
+        break
+      job = ready[best].pop()
+      free_cores -= best
+      memory += job.memory
+      core_time += best * job.duration
+      heapq.heappush(running, (current_time + job.duration, id(job), best, job.memory))
+    peak_memory = max(peak_memory, memory)
+    if (len(running) == 0):
+      break
+    end, ignore, job_cores, job_memory = heapq.heappop(running)
+    current_time = end
+    free_cores += job_cores
+    memory -= job_memory
+  return current_time, core_time, peak_memory
+
+def get_default_cores_list(steps, op):
+  """ Powers of two up to the number of cores that runs all the jobs of a
+  step at once, and the requested number of cores """
+  max_cores = 1
+  for name, batches in steps:
+    for jobs in batches:
+      max_cores = max(max_cores, sum(job.cores for job in jobs))
+  cores_list = [op.cores]
+  cores = 1
+  while (cores < min(max_cores, 1 << 16)):
+    cores *= 2
+    cores_list.append(cores)
+  return sorted(set(cores_list))
+
+def get_cores_list(steps, op):
+  if (op.plan == "auto"):
+    return get_default_cores_list(steps, op)
+  return sorted(set([int(c) for c in op.plan.split(",") if c.strip() != ""]))
+
+def format_duration(duration, seconds):
+  if (not seconds):
+    return str(int(duration))
+  return str(int(duration) // 3600) + "h" + str((int(duration) // 60) % 60).zfill(2) + "m" + str(int(duration) % 60).zfill(2) + "s"
+
+def run_plan(msas, op):
+  """ Simulate the run for several core counts and report the predictions
+  in the logs and in plan.txt """
+  steps = get_steps(msas, op.cores, op)
+  seconds = len(costmodel.models) > 0 or costmodel.default_rate != None
+  lines = []
+  header = ["cores", "wall_time"] + [name for name, batches in steps] + ["utilization", "peak_memory_MB"]
+  lines.append("\t".join(header))
+  for cores in get_cores_list(steps, op):
+    total_time = 0.0
+    total_core_time = 0.0
+    peak_memory = 0.0
+    columns = []
+    for name, batches in get_steps(msas, cores, op):
+      step_time = 0.0
+      for jobs in batches:
+        makespan, core_time, memory = simulate(jobs, cores)
+        step_time += makespan
+        total_core_time += core_time
+        peak_memory = max(peak_memory, memory)
+      total_time += step_time
+      columns.append(format_duration(step_time, seconds))
+    utilization = 0.0
+    if (total_time > 0.0):
+      utilization = total_core_time / (total_time * cores)
+    lines.append("\t".join([str(cores), format_duration(total_time, seconds)] + columns + [str(round(utilization * 100.0, 1)) + "%", str(int(peak_memory))]))
+  if (not seconds):
+    logger.warning("No runtime history (see --runtime-history): the durations are given in taxa * per_taxon_clv_size units")
+  logger.info("Predicted run for each number of cores:")
+  for line in lines:
+    logger.info("  " + line)
+  with open(os.path.join(op.output_dir, "plan.txt"), "w") as writer:
+    writer.write("\n".join(lines) + "\n")
+  logger.info("The plan was written in " + os.path.join(op.output_dir, "plan.txt"))
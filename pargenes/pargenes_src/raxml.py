@@ -3,9 +3,39 @@ import commons
 import shutil
 import scheduler
 import multiprocessing
-import pickle
 import logger
 import constraint
+import cache
+import costmodel
+import allocation
+import bootstopping
+import resultsdb
+import catalog
+import layout
+import retention
+import scanner
+import admission
+
+# raxml-ng writes this line at the end of its log when a run succeeded
+RAXML_DONE_MARKER = "Elapsed time:"
+# raxml-ng starts the lines reporting an error in its input with this prefix
+RAXML_ERROR_PREFIX = "ERROR"
+# number of bootstrap jobs per core targeted when chunking the bootstrap trees
+BOOTSTRAP_JOBS_PER_CORE = 4
+# adaptive number of starting trees: number of searches per wave, and
+# number of best trees that must agree to stop the searches of a family
+ADAPTIVE_WAVE_SIZE = 3
+ADAPTIVE_TOP_TREES = 2
+ADAPTIVE_LL_EPSILON = 0.1
+
+def parse_memory(memory):
+  """ Convert a raxml-ng memory estimate (e.g. "12 MB") into MB """
+  units = {"B": 1.0 / (1024 * 1024), "KB": 1.0 / 1024, "MB": 1.0, "GB": 1024.0, "TB": 1024.0 * 1024.0}
+  split = memory.split()
+  try:
+    return float(split[0]) * units.get(split[1], 1.0)
+  except (IndexError, ValueError):
+    return 0.0
 
 def parse_msa_info(log_file, msa, core_assignment):
   """ Parse the raxml log_file and store the number of 
@@ -25,11 +55,18 @@ def parse_msa_info(log_file, msa, core_assignment):
       msa.patterns = int(line.split(" ")[6])
     elif "Per-taxon CLV size" in line:
       msa.per_taxon_clv_size = int(line.split(" : ")[1])
+    elif "Estimated memory requirements" in line:
+      msa.memory = parse_memory(line.split(" : ")[1])
+    if "Minimum     number of threads / MPI processes" in line:
+      msa.min_cores = int(line.split(": ")[1])
+    elif "Maximum     number of threads / MPI processes" in line:
+      msa.max_cores = int(line.split(": ")[1])
     # find the number of cores depending on the selected policy 
     if (core_assignment == "high"):
       if "Maximum     number of threads / MPI processes" in line:
         msa.cores = int(line.split(": ")[1])
-    elif (core_assignment == "medium"):
+    elif (core_assignment == "medium" or core_assignment == "makespan"):
+      # makespan: the recommended number of threads is refined by the allocator
       if "Recommended number of threads / MPI processes" in line:
         msa.cores = int(line.split(": ")[1])
     elif (core_assignment == "low"):
@@ -45,14 +82,11 @@ def improve_cores_assignment(msas, op):
   max_taxa = 0
   average_sites = 0
   max_sites = 0
-  taxa_numbers = []
   for name, msa in msas.items():
-    taxa_numbers.append(msa.taxa)
     average_taxa += msa.taxa
     average_sites += msa.patterns
     max_taxa = max(max_taxa, msa.taxa)
     max_sites = max(max_sites, msa.patterns)
-  taxa_numbers.sort()
   if (len(msas) > 0):
     average_taxa /= len(msas)
     average_sites /= len(msas)
@@ -61,13 +95,30 @@ def improve_cores_assignment(msas, op):
   logger.info("  Max number of taxa: " + str(max_taxa))
   logger.info("  Average number of sites: " + str(int(average_sites)))
   logger.info("  Max number of sites: " + str(max_sites))
-  if (op.percentage_jobs_double_cores > 0.0):
-    ratio = 1.0 - op.percentage_jobs_double_cores
-    limit_taxa = taxa_numbers[int(float(len(msas)) * ratio)]
-    for name, msa in msas.items():
-      if (msa.taxa < limit_taxa):
-        if (msa.cores > 1):
-          msa.cores = msa.cores // 2
+  if (op.core_assignment == "makespan"):
+    allocation.allocate_cores(msas, op)
+    return
+  limit_taxa = get_cores_assignment_limit(msas, op)
+  for name, msa in msas.items():
+    apply_cores_assignment_limit(msa, limit_taxa)
+
+def get_cores_assignment_limit(msas, op):
+  """ Return the number of taxa under which MSAs get half of their
+  cores, or None if all MSAs keep their cores """
+  if (op.percentage_jobs_double_cores <= 0.0 or op.core_assignment == "makespan" or len(msas) == 0):
+    return None
+  taxa_numbers = sorted([msa.taxa for msa in msas.values()])
+  ratio = 1.0 - op.percentage_jobs_double_cores
+  return taxa_numbers[int(float(len(msas)) * ratio)]
+
+def apply_cores_assignment_limit(msa, limit_taxa):
+  if (msa.allocated_cores > 0):
+    # keep the cores chosen by the makespan allocator when the MSA is parsed again
+    msa.cores = msa.allocated_cores
+    return
+  if (limit_taxa != None and msa.taxa < limit_taxa):
+    if (msa.cores > 1):
+      msa.cores = msa.cores // 2
 
 def  predict_number_cores(msas, op):
   msa_count = len(msas)
@@ -77,78 +128,390 @@ def  predict_number_cores(msas, op):
   for name, msa in msas.items():
     if (not msa.valid):
       continue
-    total_cost += msa.taxa * msa.per_taxon_clv_size
-    worst_percpu_cost = max(worst_percpu_cost, (msa.taxa * msa.per_taxon_clv_size) // msa.cores)
+    cost = msa.taxa * msa.per_taxon_clv_size
+    # use the predicted runtimes (in ms of a single core) when available
+    seconds = costmodel.predict_seconds(costmodel.get_features(msa, "mlsearch", msa.cores, 1, op))
+    if (seconds != None):
+      cost = int(seconds * 1000.0 * msa.cores) + 1
+    total_cost += cost
+    worst_percpu_cost = max(worst_percpu_cost, cost // msa.cores)
   cores = total_cost // worst_percpu_cost
   cores *= runs_number
   logger.info("  Recommended MAXIMUM number of cores: " + str(max(1, cores // 4)))
 
+def set_parsing_model(msa, op):
+  if (op.use_modeltest):
+    if (not msa.has_model()):
+      # set a fake model to make raxml parsing happy
+      # if will be replaced after modeltest run
+      if (op.datatype == "aa"):
+        msa.set_model("WAG")
+      else:
+        msa.set_model("GTR")
+
+def get_parse_command(msa, parse_run_results, scheduler_mode, op):
+  """ Build the raxml-ng --parse command of one MSA """
+  name = msa.name
+  fasta_output_dir = layout.get_family_dir(parse_run_results, name)
+  commons.makedirs(fasta_output_dir)
+  set_parsing_model(msa, op)
+  args = " --parse "
+  args += " --log DEBUG "
+  args += " --msa " + msa.path + " " + msa.get_raxml_arguments_str()
+  prefix = os.path.join(fasta_output_dir, name)
+  msa.parse_prefix = prefix
+  args += " --prefix " + prefix
+  if (not scheduler.sets_threads(scheduler_mode)):
+    args += " --threads 1 "
+  return scheduler.Command("parse_" + name, 1, 1, args, prefix + ".raxml.log", RAXML_DONE_MARKER, name, "parse")
+
 def run_parsing_step(msas, library, scheduler_mode, parse_run_output_dir, cores, op):
   """ Run raxml-ng --parse on each MSA to check it is valid and
   to get its MSA dimensiosn """
   parse_commands_file = os.path.join(parse_run_output_dir, "parse_command.txt")
   parse_run_results = os.path.join(parse_run_output_dir, "results")
   commons.makedirs(parse_run_results)
-  fasta_chuncks = []
-  fasta_chuncks.append([])
-  with open(parse_commands_file, "w") as writer:
-    for name, msa in msas.items():
-      fasta_output_dir = os.path.join(parse_run_results, name)
-      commons.makedirs(fasta_output_dir)
-      if (op.use_modeltest):
-        if (not msa.has_model()):
-          # set a fake model to make raxml parsing happy
-          # if will be replaced after modeltest run
-          if (op.datatype == "aa"):
-            msa.set_model("WAG")
-          else:
-            msa.set_model("GTR")
-      writer.write("parse_" + name + " 1 1 ")
-      writer.write(" --parse ")
-      writer.write(" --log DEBUG ")
-      writer.write( " --msa " + msa.path + " " + msa.get_raxml_arguments_str())
-      writer.write(" --prefix " + os.path.join(fasta_output_dir, name))
-      if (scheduler_mode != "fork"):
-        writer.write(" --threads 1 ")
-        
-
-      writer.write("\n")
-  scheduler.run_scheduler(library, scheduler_mode, "--threads", parse_commands_file, parse_run_output_dir, cores, op)  
+  commands = []
+  parsed_msas = []
+  cached = 0
+  if (op.cache_dir):
+    cache.stage_unhashed_msas([msa for msa in msas.values() if msa.valid], op)
+  for name, msa in msas.items():
+    if (not msa.valid):
+      continue
+    if (op.cache_dir):
+      set_parsing_model(msa, op)
+      if (cache.use_cached_parse(msa, library, op)):
+        cached += 1
+        continue
+    parsed_msas.append(msa)
+  if (op.cache_dir):
+    logger.info("Found the parsing results of " + str(cached) + " MSAs in the cache " + op.cache_dir)
+  if (op.msa_scanner == "native"):
+    for msa in parsed_msas:
+      set_parsing_model(msa, op)
+    parsed_msas = scanner.scan_msas(parsed_msas, parse_run_results, op)
+  for msa in parsed_msas:
+    commands.append(get_parse_command(msa, parse_run_results, scheduler_mode, op))
+  scheduler.run_commands(library, scheduler_mode, "--threads", commands, parse_commands_file, parse_run_output_dir, cores, op)
+  if (op.cache_dir):
+    for msa in parsed_msas:
+      cache.store_parse(msa, library, op)
  
+def get_parse_prefix(msa, parse_run_results):
+  """ Prefix of the parsing results of msa (in the cache or in parse_run_results) """
+  prefix = msa.parse_prefix
+  if (prefix == ""):
+    prefix = os.path.join(layout.get_family_dir(parse_run_results, msa.name), msa.name)
+  return prefix
+
+def has_input_error(msa, parse_run_results):
+  """ True if the parsing step rejected msa because of its content (error
+  of the scanner, or ERROR line in the raxml-ng logs), and not because its
+  job failed (killed job, full disk...) """
+  prefix = get_parse_prefix(msa, parse_run_results)
+  if (os.path.isfile(scanner.get_scan_file(prefix))):
+    return "error" in scanner.read_scan_values(prefix)
+  try:
+    lines = open(prefix + ".raxml.log").readlines()
+  except OSError:
+    return False
+  for line in lines:
+    if (line.startswith(RAXML_ERROR_PREFIX)):
+      return True
+  return False
+
+def analyse_parsed_msa(msa, parse_run_results, core_assignment):
+  """ Analyse the result of the parse command of one MSA and store it into msa """
+  prefix = get_parse_prefix(msa, parse_run_results)
+  if (os.path.isfile(scanner.get_scan_file(prefix))):
+    scanner.read_scan(msa, prefix, core_assignment)
+    return
+  parse_run_log = prefix + ".raxml.log"
+  msa.binary_path = prefix + ".raxml.rba"
+  msa.parse_model = msa.get_model()
+  parse_msa_info(parse_run_log, msa, core_assignment)
+
 def analyse_parsed_msas(msas, op):
   """ Analyse results from run_parsing_step and store them into msas """
   output_dir = op.output_dir
   core_assignment = op.core_assignment
   parse_run_output_dir = os.path.join(output_dir, "parse_run")
   parse_run_results = os.path.join(parse_run_output_dir, "results")
-  invalid_msas = []
-  count = 0
   for name, msa in msas.items():
-    count += 1
-    parse_fasta_output_dir = os.path.join(parse_run_results, name)
-    parse_run_log = os.path.join(os.path.join(parse_fasta_output_dir, name + ".raxml.log"))
-    msa.binary_path = os.path.join(os.path.join(parse_fasta_output_dir, name + ".raxml.rba"))
-    parse_result = parse_msa_info(parse_run_log, msa, core_assignment)
-    if (not msa.valid):
-      invalid_msas.append(msa)      
+    analyse_parsed_msa(msa, parse_run_results, core_assignment)
   improve_cores_assignment(msas, op)
   predict_number_cores(msas, op)
+  write_invalid_msas(msas, output_dir)
+  catalog.save_msas(msas, op)
+
+def write_invalid_msas(msas, output_dir):
+  invalid_msas = [msa for msa in msas.values() if not msa.valid]
   if (len(invalid_msas) > 0):
     invalid_msas_file = os.path.join(output_dir, "invalid_msas.txt")
     logger.warning("Found " + str(len(invalid_msas)) + " invalid MSAs (see " + invalid_msas_file + ")") 
     with open(invalid_msas_file, "w") as f:
       for msa in invalid_msas:
         f.write(msa.name + "\n")
-  save_msas(msas, op)
 
-def save_msas(msas, op):
-  with open(os.path.join(op.output_dir, "parse_run", "msas_checkpoint.bin"), "ab") as f:
-    pickle.dump(msas, f, pickle.HIGHEST_PROTOCOL)      
+def get_rate_categories(model):
+  """ Return the number of rate categories of a raxml-ng model string
+  (e.g. 4 for GTR+I+G4), or 0 if it cannot be derived from the string
+  (e.g. partition files) """
+  if (model == "" or "," in model or os.path.isfile(model)):
+    return 0
+  categories = 1
+  for component in model.split("+")[1:]:
+    if (component[:1] == "G" or component[:1] == "R"):
+      digits = ""
+      for c in component[1:]:
+        if (not c.isdigit()):
+          break
+        digits += c
+      if (len(digits) > 0):
+        categories = int(digits)
+      else:
+        categories = 4
+  return categories
 
-def load_msas(op):
-  with open(os.path.join(op.output_dir, "parse_run", "msas_checkpoint.bin"), "rb") as f:
-    return pickle.load(f)
-  
+def derive_model_dimensions(msa):
+  """ Update the MSA dimensions after its model changed (e.g. after modeltest)
+  without parsing it again. The per-taxon CLV size is proportional
+  to the number of rate categories, and the number of states does not
+  change for a given datatype. Return False if the dimensions cannot
+  be derived from the models """
+  if (msa.get_model() == msa.parse_model):
+    return True
+  old_categories = get_rate_categories(msa.parse_model)
+  new_categories = get_rate_categories(msa.get_model())
+  if (old_categories == 0 or new_categories == 0):
+    return False
+  msa.per_taxon_clv_size = (msa.per_taxon_clv_size * new_categories) // old_categories
+  # the CLVs, proportional to the number of categories, dominate the memory
+  msa.memory = (msa.memory * new_categories) / old_categories
+  # the binary MSA stores the model of the parsing step, but the jobs
+  # pass the new model with --model, which overrides it
+  msa.parse_model = msa.get_model()
+  return True
+
+def reparse_changed_msas(msas, library, scheduler_mode, cores, op):
+  """ After modeltest, update the dimensions of the MSAs from their new
+  models, and only parse again the MSAs for which they cannot be derived """
+  to_parse = {}
+  for name, msa in msas.items():
+    if (msa.valid and not derive_model_dimensions(msa)):
+      to_parse[name] = msa
+  logger.info("Parsing again " + str(len(to_parse)) + " MSAs whose dimensions cannot be derived from their new model")
+  if (len(to_parse) > 0):
+    reparse_run_output_dir = os.path.join(op.output_dir, "reparse_run")
+    run_parsing_step(to_parse, library, scheduler_mode, reparse_run_output_dir, cores, op)
+    limit_taxa = get_cores_assignment_limit(msas, op)
+    for name, msa in to_parse.items():
+      analyse_parsed_msa(msa, os.path.join(reparse_run_output_dir, "results"), op.core_assignment)
+      apply_cores_assignment_limit(msa, limit_taxa)
+  write_invalid_msas(msas, op.output_dir)
+  catalog.save_msas(msas, op)
+
+def get_msa_input_path(msa):
+  """ Return the binary MSA if available, and the MSA file otherwise """
+  msa_path = msa.binary_path
+  if (msa_path == "" or msa_path == None):
+    msa_path = msa.path
+  return msa_path
+
+def get_msa_cost(msa):
+  msa_size = 1
+  if (not msa.flag_disable_sorting):
+    msa_size = msa.taxa * msa.per_taxon_clv_size
+  return msa_size
+
+def get_bootstrap_replicate_cost(msa, op):
+  """ Core time of one bootstrap tree of msa, predicted from the runtime
+  history, or its taxa * per_taxon_clv_size size without history """
+  cores = max(1, msa.cores // 2)
+  seconds = costmodel.predict_seconds(costmodel.get_features(msa, "bootstrap", cores, 1, op))
+  if (seconds != None):
+    return seconds * cores
+  return float(max(1, msa.taxa * msa.per_taxon_clv_size))
+
+def read_bootstrap_chunk_sizes(chunks_file):
+  chunk_sizes = {}
+  try:
+    lines = open(chunks_file).readlines()
+  except OSError:
+    return chunk_sizes
+  for line in lines:
+    split = line.split()
+    if (len(split) == 2 and line.endswith("\n")):
+      chunk_sizes[split[0]] = int(split[1])
+  return chunk_sizes
+
+def get_bootstrap_chunk_sizes(msas, bootstraps, cores, run_path, op):
+  """ Choose the number of bootstrap trees per job of each family so that
+  all the bootstrap jobs have about the same duration, with about
+  BOOTSTRAP_JOBS_PER_CORE jobs per core: cheap families get large chunks,
+  and expensive families small chunks. With parallel autoMRE, a chunk never
+  exceeds the bootstopping interval, so that the convergence is tested at
+  the intended granularity. The chunk sizes are saved in run_path
+  (if not None), so that a continued run schedules the same jobs """
+  chunk_sizes = {}
+  chunks_file = None
+  if (run_path != None):
+    chunks_file = os.path.join(run_path, "bootstrap_chunks.txt")
+    chunk_sizes = read_bootstrap_chunk_sizes(chunks_file)
+  valid_msas = [msa for msa in msas.values() if msa.valid and not msa.name in chunk_sizes]
+  if (bootstraps == 0 or len(valid_msas) == 0):
+    return chunk_sizes
+  replicate_costs = {}
+  for msa in valid_msas:
+    replicate_costs[msa.name] = get_bootstrap_replicate_cost(msa, op)
+  total_cost = sum(replicate_costs.values()) * bootstraps
+  target_cost = total_cost / float(max(1, cores) * BOOTSTRAP_JOBS_PER_CORE)
+  max_chunk_size = bootstraps
+  if (op.parallel_autoMRE):
+    max_chunk_size = min(bootstraps, bootstopping.BOOTSTOPPING_INTERVAL)
+  new_chunk_sizes = {}
+  for msa in valid_msas:
+    chunk_size = int(target_cost / replicate_costs[msa.name])
+    new_chunk_sizes[msa.name] = max(1, min(max_chunk_size, chunk_size))
+  chunk_sizes.update(new_chunk_sizes)
+  if (chunks_file != None):
+    commons.makedirs(run_path)
+    with open(chunks_file, "a") as writer:
+      for name, chunk_size in new_chunk_sizes.items():
+        writer.write(name + " " + str(chunk_size) + "\n")
+  logger.info("Bootstrap trees per job: between " + str(min(new_chunk_sizes.values())) + " and " + str(max(new_chunk_sizes.values())))
+  return chunk_sizes
+
+def get_starting_trees_order(random_trees, parsimony_trees):
+  """ Order in which the starting trees are searched in the adaptive mode:
+  alternate random and parsimony starting trees """
+  order = []
+  for i in range(0, max(random_trees, parsimony_trees)):
+    if (i < random_trees):
+      order.append(i)
+    if (i < parsimony_trees):
+      order.append(random_trees + i)
+  return order
+
+def get_starting_trees_wave(random_trees, parsimony_trees, wave):
+  """ Starting trees searched in a wave of the adaptive mode """
+  order = get_starting_trees_order(random_trees, parsimony_trees)
+  return order[wave * ADAPTIVE_WAVE_SIZE:(wave + 1) * ADAPTIVE_WAVE_SIZE]
+
+def get_mlsearch_results(msa, mlsearch_run_results, starting_trees):
+  """ Log-likelihood and tree of the finished searches of msa, sorted
+  by decreasing log-likelihood """
+  name = msa.name
+  results = []
+  for starting_tree in range(0, starting_trees):
+    prefix = os.path.join(layout.get_family_dir(mlsearch_run_results, name), "multiple_runs", str(starting_tree), name)
+    if (not os.path.isfile(prefix + ".raxml.bestTree")):
+      continue
+    try:
+      ll = extract_ll_from_raxml_logs(prefix + ".raxml.log")
+      tree = open(prefix + ".raxml.bestTree").read().strip()
+    except OSError:
+      continue
+    results.append((ll, tree))
+  return sorted(results, key = lambda x: x[0], reverse = True)
+
+def has_search_converged(msa, mlsearch_run_results, starting_trees):
+  """ The searches of msa converged if the ADAPTIVE_TOP_TREES best trees
+  have the same topology and log-likelihoods within ADAPTIVE_LL_EPSILON """
+  results = get_mlsearch_results(msa, mlsearch_run_results, starting_trees)
+  if (len(results) < ADAPTIVE_TOP_TREES):
+    return False
+  top = results[:ADAPTIVE_TOP_TREES]
+  if (top[0][0] - top[-1][0] > ADAPTIVE_LL_EPSILON):
+    return False
+  taxa = sorted(bootstopping.read_leaves(top[0][1]))
+  taxa_index = dict((taxon, i) for i, taxon in enumerate(taxa))
+  try:
+    reference = set(bootstopping.get_splits(top[0][1], taxa_index))
+    for ll, tree in top[1:]:
+      if (set(bootstopping.get_splits(tree, taxa_index)) != reference):
+        return False
+  except KeyError:
+    return False
+  return True
+
+def get_mlsearch_commands(msa, random_trees, parsimony_trees, mlsearch_run_results, scheduler_mode, op, starting_trees_list = None):
+  """ Build the raxml-ng tree search commands of one MSA (one per starting tree).
+  Only the starting trees of starting_trees_list are built if it is set """
+  name = msa.name
+  starting_trees = random_trees + parsimony_trees
+  msa_path = get_msa_input_path(msa)
+  msa_size = get_msa_cost(msa)
+  mlsearch_fasta_output_dir = layout.get_family_dir(mlsearch_run_results, name)
+  commons.makedirs(mlsearch_fasta_output_dir)
+  commands = []
+  if (starting_trees_list == None):
+    starting_trees_list = range(0, starting_trees)
+  for starting_tree in starting_trees_list:
+    if (starting_trees > 1):
+      prefix = os.path.join(mlsearch_fasta_output_dir, "multiple_runs", str(starting_tree))
+      commons.makedirs(prefix)
+      prefix = os.path.join(prefix, name)
+    else:
+      prefix = os.path.join(mlsearch_fasta_output_dir, name)
+    args = " --msa " + msa_path + " " + msa.get_raxml_arguments_str()
+    args += " --prefix " + os.path.abspath(prefix)
+    if (not scheduler.sets_threads(scheduler_mode)):
+      args += " --threads 1 "
+    if (starting_tree >= random_trees):
+      args += " --tree pars{1} "
+    else:
+      args += " --tree rand{1} "
+    if (op.constrain_search):
+      args += " --tree-constraint " + constraint.get_constraint(op, name)
+      args += " --force"
+    args += " --seed " + str(starting_tree + op.seed + 1) + " "
+    command_name = "mlsearch_" + name + "_" + str(starting_tree)
+    cost = costmodel.get_job_cost(msa, "mlsearch", command_name, msa.cores, 1, msa_size, op)
+    commands.append(scheduler.Command(command_name, msa.cores, cost, args, prefix + ".raxml.log", RAXML_DONE_MARKER, name, "mlsearch", admission.get_job_memory(msa, msa.cores)))
+  return commands
+
+def get_bootstrap_chunks_number(bootstraps, chunk_size, op):
+  """ Number of bootstrap jobs of one MSA """
+  if (op.autoMRE and not op.parallel_autoMRE):
+    return 1
+  return (bootstraps - 1) // chunk_size + 1
+
+def get_bootstrap_commands(msa, bootstraps, chunk_size, mlsearch_run_bootstraps, scheduler_mode, op, first_chunk = 0, chunks = None):
+  """ Build the raxml-ng bootstrap commands of one MSA, grouping the
+  bootstrap trees into chunks of chunk_size trees. Only the chunks
+  first_chunk to first_chunk + chunks - 1 are built if chunks is set """
+  if (bootstraps == 0):
+    return []
+  name = msa.name
+  msa_path = get_msa_input_path(msa)
+  msa_size = get_msa_cost(msa)
+  bs_output_dir = layout.get_family_dir(mlsearch_run_bootstraps, name)
+  commons.makedirs(bs_output_dir)
+  per_family_bootstrap_runs = get_bootstrap_chunks_number(bootstraps, chunk_size, op)
+  if (chunks != None):
+    per_family_bootstrap_runs = min(per_family_bootstrap_runs, first_chunk + chunks)
+  commands = []
+  for current_bs in range(first_chunk, per_family_bootstrap_runs):
+    bsbase = name + "_bs" + str(current_bs)
+    prefix = os.path.abspath(os.path.join(bs_output_dir, bsbase))
+    args = " --bootstrap"
+    args += " --msa " + msa_path + " " + msa.get_raxml_arguments_str()
+    args += " --prefix " + prefix
+    if (not scheduler.sets_threads(scheduler_mode)):
+      args += " --threads 1 "
+    args += " --seed " + str(current_bs + op.seed + 1)
+    bs_number = bootstraps
+    if (not op.autoMRE or op.parallel_autoMRE):
+      bs_number = min(chunk_size, bootstraps - current_bs * chunk_size)
+      args += " --bs-trees " + str(bs_number)
+    else:
+      args += " --bs-trees autoMRE{" + str(bootstraps) + "}"
+    cores = max(1, msa.cores // 2)
+    cost = costmodel.get_job_cost(msa, "bootstrap", bsbase, cores, bs_number, msa_size * chunk_size, op)
+    commands.append(scheduler.Command(bsbase, cores, cost, args, prefix + ".raxml.log", RAXML_DONE_MARKER, name, "bootstrap", admission.get_job_memory(msa, cores)))
+  return commands
 
 def run(msas, random_trees, parsimony_trees, bootstraps, library, scheduler_mode, run_path, cores, op):
   """ Use the MPI scheduler_mode to run raxml-ng on all the dataset. 
@@ -157,126 +520,163 @@ def run(msas, random_trees, parsimony_trees, bootstraps, library, scheduler_mode
   mlsearch_run_results = os.path.join(run_path, "results")
   mlsearch_run_bootstraps = os.path.join(run_path, "bootstraps")
   commons.makedirs(mlsearch_run_results)
-  starting_trees = random_trees + parsimony_trees
-  chunk_size = 2
-  msa_number = len(msas)
-  if (msa_number < 50):
-    chunk_size = 1
-
+  chunk_sizes = get_bootstrap_chunk_sizes(msas, bootstraps, cores, run_path, op)
   if (bootstraps != 0):
     commons.makedirs(mlsearch_run_bootstraps)
-  with open(commands_file, "w") as writer:
-    for name, msa in msas.items():
-      if (not msa.valid):
+  commands = []
+  for name, msa in msas.items():
+    if (not msa.valid):
+      continue
+    # generate all the mlsearch commands
+    if (op.adaptive_starting_trees):
+      starting_trees_list = get_starting_trees_wave(random_trees, parsimony_trees, 0)
+      commands.extend(get_mlsearch_commands(msa, random_trees, parsimony_trees, mlsearch_run_results, scheduler_mode, op, starting_trees_list))
+    else:
+      commands.extend(get_mlsearch_commands(msa, random_trees, parsimony_trees, mlsearch_run_results, scheduler_mode, op))
+    # generate all the boostrap commands
+    if (bootstraps != 0 and op.parallel_autoMRE):
+      # first wave of the bootstrap jobs
+      chunks = bootstopping.get_wave_chunks(chunk_sizes[name])
+      commands.extend(get_bootstrap_commands(msa, bootstraps, chunk_sizes[name], mlsearch_run_bootstraps, scheduler_mode, op, 0, chunks))
+    elif (bootstraps != 0):
+      commands.extend(get_bootstrap_commands(msa, bootstraps, chunk_sizes[name], mlsearch_run_bootstraps, scheduler_mode, op))
+  scheduler.run_commands(library, scheduler_mode, "--threads", commands, commands_file, run_path, cores, op)
+  if (bootstraps != 0 and op.parallel_autoMRE):
+    run_bootstopping_waves(msas, bootstraps, chunk_sizes, library, scheduler_mode, run_path, cores, op)
+  if (op.adaptive_starting_trees):
+    run_adaptive_mlsearch_waves(msas, random_trees, parsimony_trees, library, scheduler_mode, run_path, cores, op)
+
+def run_adaptive_mlsearch_waves(msas, random_trees, parsimony_trees, library, scheduler_mode, run_path, cores, op):
+  """ Adaptive number of starting trees: after each wave of searches, run
+  the next wave only for the families whose best trees did not converge """
+  mlsearch_run_results = os.path.join(run_path, "results")
+  starting_trees = random_trees + parsimony_trees
+  active = [name for name, msa in msas.items() if msa.valid]
+  wave = 1
+  while (True):
+    starting_trees_list = get_starting_trees_wave(random_trees, parsimony_trees, wave)
+    if (len(starting_trees_list) == 0):
+      break
+    still_active = []
+    for name in active:
+      if (not has_search_converged(msas[name], mlsearch_run_results, starting_trees)):
+        still_active.append(name)
+    logger.info("Adaptive starting trees, wave " + str(wave) + ": " + str(len(active) - len(still_active)) + " families converged, " + str(len(still_active)) + " families continue")
+    active = still_active
+    if (len(active) == 0):
+      break
+    commands = []
+    for name in active:
+      commands.extend(get_mlsearch_commands(msas[name], random_trees, parsimony_trees, mlsearch_run_results, scheduler_mode, op, starting_trees_list))
+    commands_file = os.path.join(run_path, "adaptive_mlsearch_command_" + str(wave) + ".txt")
+    scheduler.run_commands(library, scheduler_mode, "--threads", commands, commands_file, run_path, cores, op)
+    wave += 1
+
+def run_bootstopping_waves(msas, bootstraps, chunk_sizes, library, scheduler_mode, run_path, cores, op):
+  """ Parallel autoMRE: after each wave of bootstrap jobs, test the
+  convergence of the families and run the next wave for the families
+  that did not converge yet, until they reach the maximum number of trees """
+  mlsearch_run_bootstraps = os.path.join(run_path, "bootstraps")
+  next_chunks = {}
+  for name, msa in msas.items():
+    if (msa.valid):
+      next_chunks[name] = bootstopping.get_wave_chunks(chunk_sizes[name])
+  converged_families = set()
+  wave = 1
+  while (True):
+    commands = []
+    converged = 0
+    for name, first_chunk in next_chunks.items():
+      msa = msas[name]
+      if (name in converged_families):
         continue
-      msa_path = msa.binary_path
-      if (msa_path == "" or msa_path == None):
-        msa_path = msa.path
-      msa_size = 1
-      if (not msa.flag_disable_sorting):
-        msa_size = msa.taxa * msa.per_taxon_clv_size
-      mlsearch_fasta_output_dir = os.path.join(mlsearch_run_results, name)
-      commons.makedirs(mlsearch_fasta_output_dir)
-      # generate all the mlsearch commands
-      for starting_tree in range(0, starting_trees):
-        if (starting_trees > 1):
-          prefix = os.path.join(mlsearch_fasta_output_dir, "multiple_runs", str(starting_tree))
-          commons.makedirs(prefix)
-          prefix = os.path.join(prefix, name)
-        else:
-          prefix = os.path.join(mlsearch_fasta_output_dir, name)
-        writer.write("mlsearch_" + name + "_" + str(starting_tree) + " ")
-        writer.write(str(msa.cores) + " " + str(msa_size))
-        writer.write(" --msa " + msa_path + " " + msa.get_raxml_arguments_str())
-        writer.write(" --prefix " + os.path.abspath(prefix))
-        if (scheduler_mode != "fork"):
-          writer.write(" --threads 1 ")
-        if (starting_tree >= random_trees):
-          writer.write(" --tree pars{1} ")
-        else:
-          writer.write(" --tree rand{1} ")
-        if (op.constrain_search):
-          writer.write(" --tree-constraint " + constraint.get_constraint(op, name))
-          writer.write(" --force")
-        writer.write(" --seed " + str(starting_tree + op.seed + 1) + " ")
-        writer.write("\n")
-      bs_output_dir = os.path.join(mlsearch_run_bootstraps, name)
-      commons.makedirs(bs_output_dir)
-      # generate all the boostrap commands
-      per_family_bootstrap_runs = (bootstraps - 1) // chunk_size + 1
-      if (op.autoMRE):
-        per_family_bootstrap_runs = 1
-      for current_bs in range(0, per_family_bootstrap_runs):
-        bsbase = name + "_bs" + str(current_bs)
-        writer.write(bsbase + " ")
-        writer.write(str(max(1, msa.cores // 2)) + " " + str(msa_size * chunk_size))
-        writer.write(" --bootstrap")
-        writer.write(" --msa " + msa_path + " " + msa.get_raxml_arguments_str())
-        writer.write(" --prefix " + os.path.abspath(os.path.join(bs_output_dir, bsbase)))
-        if (scheduler_mode != "fork"):
-          writer.write(" --threads 1 ")
-        writer.write(" --seed " + str(current_bs + op.seed + 1))
-        if (not op.autoMRE):
-          bs_number = min(chunk_size, bootstraps - current_bs * chunk_size)
-          writer.write(" --bs-trees " + str(bs_number))
-        else:
-          writer.write(" --bs-trees autoMRE{" + str(bootstraps) + "}")
-        writer.write("\n")
-  scheduler.run_scheduler(library, scheduler_mode, "--threads", commands_file, run_path, cores, op)  
+      if (first_chunk >= get_bootstrap_chunks_number(bootstraps, chunk_sizes[name], op)):
+        continue
+      if (bootstopping.check_family(mlsearch_run_bootstraps, name, run_path, op)):
+        converged += 1
+        converged_families.add(name)
+        continue
+      chunks = bootstopping.get_wave_chunks(chunk_sizes[name])
+      commands.extend(get_bootstrap_commands(msa, bootstraps, chunk_sizes[name], mlsearch_run_bootstraps, scheduler_mode, op, first_chunk, chunks))
+      next_chunks[name] = first_chunk + chunks
+    logger.info("Bootstopping wave " + str(wave) + ": " + str(converged) + " families converged, " + str(len(commands)) + " new bootstrap jobs")
+    if (len(commands) == 0):
+      break
+    commands_file = os.path.join(run_path, "bootstopping_command_" + str(wave) + ".txt")
+    scheduler.run_commands(library, scheduler_mode, "--threads", commands, commands_file, run_path, cores, op)
+    wave += 1
 
 
 def extract_ll_from_raxml_logs(raxml_log_file):
   """ Return the final likelihood from a raxml log file """
   res = -float('inf')
-  with open(raxml_log_file) as reader:
+  with layout.open_file(raxml_log_file) as reader:
     for line in reader.readlines():
       if (line.startswith("Final LogLikelihood:")):
         res = float(line.split(" ")[2][:-1])
   return res
 
-def select_best_ml_tree_msa(msa, results_path, op):
+def select_best_ml_tree_msa(msa, results_path, op, lls = None):
   """ Find the raxml run that got the best likelihood, 
-  and copy its output files in the results directory """
+  and copy its output files in the results directory.
+  lls gives the log-likelihoods of the runs found in the results index """
   name = msa.name
-  msa_results_path = os.path.join(results_path, name)
+  msa_results_path = layout.get_family_dir(results_path, name)
   msa_multiple_results_path = os.path.join(msa_results_path, "multiple_runs")
   all_ml_trees = os.path.join(msa_results_path, "sorted_ml_trees.newick")
   all_ml_trees_ll = os.path.join(msa_results_path, "sorted_ml_trees_ll.newick")
+  if (op.retention == "lean" and not layout.exists(msa_multiple_results_path) and os.path.isfile(all_ml_trees_ll)):
+    # already selected (and deleted) by an interrupted run
+    return
   best_ll = -float('inf')
   best_starting_tree = 0
   ll_and_trees = []
   for starting_tree in range(0, op.random_starting_trees + op.parsimony_starting_trees):
-    raxml_logs = os.path.join(msa_multiple_results_path, str(starting_tree), name + ".raxml.log")
-    ll = extract_ll_from_raxml_logs(raxml_logs)
+    ll = None
+    if (lls != None):
+      ll = lls.get("mlsearch_" + name + "_" + str(starting_tree))
+    if (ll == None):
+      raxml_logs = os.path.join(msa_multiple_results_path, str(starting_tree), name + ".raxml.log")
+      if (op.adaptive_starting_trees and not layout.exists(raxml_logs)):
+        # not searched: the family converged before
+        continue
+      ll = extract_ll_from_raxml_logs(raxml_logs)
     ll_and_trees.append((ll, starting_tree))
     if (ll > best_ll):
       best_ll = ll
       best_starting_tree = starting_tree
   #logger.info(ll_and_tree)
   directory_to_copy = os.path.join(msa_multiple_results_path, str(best_starting_tree))
-  files_to_copy = os.listdir(directory_to_copy)
+  files_to_copy = layout.listdir(directory_to_copy)
   for f in files_to_copy:
-    shutil.copy(os.path.join(directory_to_copy, f), msa_results_path)
+    with layout.open_file(os.path.join(directory_to_copy, f), "rb") as reader:
+      with open(os.path.join(msa_results_path, f), "wb") as writer:
+        shutil.copyfileobj(reader, writer)
   
   with open(all_ml_trees, "w") as writer:
     for tree in sorted(ll_and_trees, key=lambda x: x[0], reverse=True):
       tree_file = os.path.join(msa_multiple_results_path, str(tree[1]), name + ".raxml.bestTree")
-      writer.write(open(tree_file).read())
+      with layout.open_file(tree_file) as reader:
+        writer.write(reader.read())
   with open(all_ml_trees_ll, "w") as writer:
     for tree in sorted(ll_and_trees, key=lambda x: x[0], reverse=True):
       tree_file = os.path.join(msa_multiple_results_path, str(tree[1]), name + ".raxml.bestTree")
       writer.write(str(tree[0]) + " ")
-      writer.write(open(tree_file).read())
+      with layout.open_file(tree_file) as reader:
+        writer.write(reader.read())
+  if (op.retention == "lean"):
+    retention.remove(op.output_dir, "multiple_runs", name, msa_multiple_results_path)
 
 
 
 def select_best_ml_tree(msas, op):
   """ Run select_best_ml_tree_msa in parallel (one one single node) on all the MSAs """
   results_path = os.path.join(op.output_dir, "mlsearch_run", "results")
+  lls = resultsdb.get_log_likelihoods(op.output_dir)
   pool = multiprocessing.Pool(processes=min(multiprocessing.cpu_count(), int(op.cores)))
   for name, msa in msas.items():
     if (not msa.valid):
       continue
-    pool.apply_async(select_best_ml_tree_msa, (msa, results_path, op,))
+    pool.apply_async(select_best_ml_tree_msa, (msa, results_path, op, lls.get(name),))
   pool.close()
   pool.join()
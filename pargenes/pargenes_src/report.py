@@ -2,6 +2,8 @@ import sys
 import os
 import logger
 import subprocess
+import resultsdb
+import jobstats
 
 def write_header(writer, title):
     title = "** " + "[REPORT] " + title + " **"
@@ -81,6 +83,14 @@ def extract_arch(writer):
   except:
     writer.write("Could not get architecture information")
 
+def extract_jobs_summary(pargenes_dir, writer):
+  write_header(writer, "jobs summary")
+  try:
+    for step, status, count in resultsdb.get_jobs_summary(pargenes_dir):
+      writer.write(step + " " + status + ": " + str(count) + "\n")
+  except Exception as e:
+    writer.write("Could not read the results index: " + str(e) + "\n")
+
 def report(pargenes_dir, output):
   writer = open(output, "w")
   writer.write("ParGenes report file for run " + pargenes_dir)
@@ -90,7 +100,7 @@ def report(pargenes_dir, output):
   oldparse_logs = os.path.join(oldparse_dir, "logs.txt")
   
   extract_file(main_logs, "MainLogs",  writer)
-  steps = ["parse", "old_parse", "modeltest", "mlsearch", "supports"]
+  steps = ["parse", "old_parse", "reparse", "modeltest", "mlsearch", "supports"]
   for step in steps:
     step_dir = os.path.join(pargenes_dir, step + "_run")
     logs = os.path.join(step_dir, "logs.txt")
@@ -101,7 +111,7 @@ def report(pargenes_dir, output):
     step_dir = os.path.join(pargenes_dir, step + "_run")
     command_logs = os.path.join(step_dir, step + "_command.txt")
     failures_logs = os.path.join(step_dir, "failed_commands.txt")
-    if (step == "old_parse"):
+    if (step == "old_parse" or step == "reparse"):
       command_logs = os.path.join(step_dir, "parse" + "_command.txt")
     extract_file(command_logs, step + " commands", writer)
     extract_file(failures_logs, step + " failed commands", writer)
@@ -117,6 +127,14 @@ def report(pargenes_dir, output):
     logs_dir = os.path.join(step_dir, "per_job_logs")
     extract_running_logs(running_dir, logs_dir, writer)
   
+  extract_jobs_summary(pargenes_dir, writer)
+  try:
+    resources_summary = jobstats.write_summary(pargenes_dir)
+  except Exception as e:
+    resources_summary = None
+    writer.write("Could not summarize the job resources: " + str(e) + "\n")
+  if (resources_summary != None):
+    extract_file(resources_summary, "job resources", writer)
   extract_git(writer)
   extract_mpi(writer)
   extract_arch(writer)
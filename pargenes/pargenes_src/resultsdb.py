@@ -0,0 +1,208 @@
+import os
+import logger
+import layout
+import archive
+try:
+  import sqlite3
+except ImportError:
+  sqlite3 = None
+
+"""
+Run-wide index of the results (results.db in the output directory),
+filled as the steps and the jobs complete: one record per family
+(dimensions, model, status), per job (step, status, log-likelihood,
+runtime) and per output file. The steps that need the results (best
+ML tree selection, bootstrap concatenation, species tree, export)
+query it instead of listing the result directories and reading all the
+logs. The index is only written by the main ParGenes process. If sqlite3
+is not available, nothing is recorded and the result directories are
+scanned as before.
+"""
+
+# connections per output directory
+connections = {}
+
+SCHEMA = [
+  "CREATE TABLE IF NOT EXISTS families (name TEXT PRIMARY KEY, path TEXT, valid INTEGER, taxa INTEGER, patterns INTEGER, per_taxon_clv_size INTEGER, cores INTEGER, model TEXT)",
+  "CREATE TABLE IF NOT EXISTS jobs (name TEXT PRIMARY KEY, family TEXT, step TEXT, status TEXT, log_likelihood REAL, runtime REAL, cores INTEGER, log_file TEXT)",
+  "CREATE TABLE IF NOT EXISTS files (family TEXT, kind TEXT, path TEXT, PRIMARY KEY (family, kind))",
+  "CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)",
+  "CREATE INDEX IF NOT EXISTS jobs_family ON jobs (family, step)",
+]
+
+def get_db_file(output_dir):
+  return os.path.join(output_dir, "results.db")
+
+def get_connection(output_dir, create = True):
+  """ Connection to the index of output_dir, or None if there is no index """
+  if (sqlite3 == None):
+    return None
+  if (output_dir in connections):
+    return connections[output_dir]
+  db_file = get_db_file(output_dir)
+  if (not create and not os.path.isfile(db_file)):
+    return None
+  try:
+    connection = sqlite3.connect(db_file, timeout = 60)
+    for statement in SCHEMA:
+      connection.execute(statement)
+    connection.commit()
+  except sqlite3.Error as e:
+    logger.warning("Cannot open the results index " + db_file + ": " + str(e))
+    return None
+  connections[output_dir] = connection
+  return connection
+
+def close(output_dir):
+  if (output_dir in connections):
+    connections.pop(output_dir).close()
+
+def read_job_logs(log_file):
+  """ Read the final log-likelihood and the runtime of a job from the end
+  of its raxml-ng logs """
+  ll = None
+  seconds = None
+  try:
+    with open(log_file, "rb") as reader:
+      reader.seek(0, os.SEEK_END)
+      reader.seek(max(0, reader.tell() - 8192))
+      lines = reader.read().decode(errors = "replace").split("\n")
+  except OSError:
+    return ll, seconds
+  for line in lines:
+    if (line.startswith("Final LogLikelihood:")):
+      try:
+        ll = float(line.split(" ")[2])
+      except (IndexError, ValueError):
+        pass
+    elif (line.startswith("Elapsed time:")):
+      try:
+        seconds = float(line.split()[2])
+      except (IndexError, ValueError):
+        pass
+  return ll, seconds
+
+def record_msas(msas, op):
+  """ Record the dimensions, model and validity of the families """
+  connection = get_connection(op.output_dir)
+  if (connection == None):
+    return
+  rows = []
+  for name, msa in msas.items():
+    rows.append((name, archive.get_source_path(msa, op), int(msa.valid), msa.taxa, msa.patterns, msa.per_taxon_clv_size, msa.cores, msa.get_model()))
+  connection.executemany("INSERT OR REPLACE INTO families VALUES (?, ?, ?, ?, ?, ?, ?, ?)", rows)
+  connection.commit()
+
+def record_jobs(commands, statuses, op, runtimes = None):
+  """ Record finished jobs. statuses[i] tells whether commands[i] succeeded,
+  runtimes[i] is its measured runtime (read from its logs if None) """
+  connection = get_connection(op.output_dir)
+  if (connection == None):
+    return
+  rows = []
+  for i, command in enumerate(commands):
+    ll = None
+    seconds = None
+    if (statuses[i] and command.done_file.endswith(".raxml.log")):
+      ll, seconds = read_job_logs(command.done_file)
+    if (runtimes != None):
+      seconds = runtimes[i]
+    status = "done"
+    if (not statuses[i]):
+      status = "failed"
+    rows.append((command.name, command.family, command.step, status, ll, seconds, int(command.cores), command.done_file))
+  connection.executemany("INSERT OR REPLACE INTO jobs VALUES (?, ?, ?, ?, ?, ?, ?, ?)", rows)
+  connection.commit()
+
+def get_output_files(output_dir, name):
+  """ Standard paths of the output files of a family """
+  mlsearch_results = layout.get_family_dir(os.path.join(output_dir, "mlsearch_run", "results"), name)
+  supports_results = os.path.join(output_dir, "supports_run", "results")
+  return [
+    ("best_tree", os.path.join(mlsearch_results, name + ".raxml.bestTree")),
+    ("best_model", os.path.join(mlsearch_results, name + ".raxml.bestModel")),
+    ("bootstraps", os.path.join(output_dir, "concatenated_bootstraps", name + ".bs")),
+    ("support", os.path.join(supports_results, name + ".support.raxml.support")),
+    ("support_tbe", os.path.join(supports_results, name + ".support.tbe.raxml.support")),
+  ]
+
+def record_family_outputs(names, op):
+  """ Record the output files of the families names """
+  connection = get_connection(op.output_dir)
+  if (connection == None):
+    return
+  rows = []
+  for name in names:
+    for kind, path in get_output_files(op.output_dir, name):
+      if (os.path.isfile(path)):
+        rows.append((name, kind, path))
+  connection.executemany("INSERT OR REPLACE INTO files VALUES (?, ?, ?)", rows)
+  connection.commit()
+
+def record_outputs(msas, op):
+  """ Record the output files of all the valid families, and flag the
+  index as complete: it can then replace the scans of the output directory """
+  connection = get_connection(op.output_dir)
+  if (connection == None):
+    return
+  record_family_outputs([name for name, msa in msas.items() if msa.valid], op)
+  connection.execute("INSERT OR REPLACE INTO meta VALUES ('outputs_recorded', '1')")
+  connection.commit()
+
+def has_outputs(output_dir):
+  """ True if the index of output_dir lists all the output files """
+  connection = get_connection(output_dir, False)
+  if (connection == None):
+    return False
+  row = connection.execute("SELECT value FROM meta WHERE key = 'outputs_recorded'").fetchone()
+  return row != None and row[0] == "1"
+
+def get_files(output_dir, kind):
+  """ (family, path) of all the output files of kind, sorted by family """
+  connection = get_connection(output_dir, False)
+  if (connection == None):
+    return []
+  return connection.execute("SELECT family, path FROM files WHERE kind = ? ORDER BY family", (kind,)).fetchall()
+
+def get_families(output_dir):
+  """ Names of the families with results """
+  connection = get_connection(output_dir, False)
+  if (connection == None):
+    return []
+  return [row[0] for row in connection.execute("SELECT DISTINCT family FROM files ORDER BY family").fetchall()]
+
+def get_step_families(output_dir, step):
+  """ Names of the families with finished jobs in step """
+  connection = get_connection(output_dir, False)
+  if (connection == None):
+    return []
+  return [row[0] for row in connection.execute("SELECT DISTINCT family FROM jobs WHERE step = ? AND status = 'done' ORDER BY family", (step,)).fetchall()]
+
+def get_family_log_likelihoods(output_dir, family, step = "mlsearch"):
+  """ Final log-likelihoods of the finished jobs of one family, per job name """
+  connection = get_connection(output_dir, False)
+  if (connection == None):
+    return {}
+  rows = connection.execute("SELECT name, log_likelihood FROM jobs WHERE family = ? AND step = ? AND status = 'done' AND log_likelihood IS NOT NULL", (family, step))
+  return dict(rows.fetchall())
+
+def get_jobs_summary(output_dir):
+  """ Number of jobs per step and status """
+  connection = get_connection(output_dir, False)
+  if (connection == None):
+    return []
+  return connection.execute("SELECT step, status, COUNT(*) FROM jobs GROUP BY step, status ORDER BY step, status").fetchall()
+
+def get_log_likelihoods(output_dir, step = "mlsearch"):
+  """ Final log-likelihoods of the finished jobs of step, per family
+  and per job name """
+  connection = get_connection(output_dir, False)
+  if (connection == None):
+    return {}
+  lls = {}
+  rows = connection.execute("SELECT family, name, log_likelihood FROM jobs WHERE step = ? AND status = 'done' AND log_likelihood IS NOT NULL", (step,))
+  for family, name, ll in rows:
+    if (not family in lls):
+      lls[family] = {}
+    lls[family][name] = ll
+  return lls
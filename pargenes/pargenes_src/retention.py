@@ -0,0 +1,80 @@
+import os
+import glob
+import shutil
+import logger
+import layout
+
+"""
+Retention of the intermediate files (--retention). With the lean policy,
+each intermediate file is deleted as soon as the last step reading it is
+done:
+- the searches from each starting tree, once the best ML tree is selected
+- the bootstrap chunks of a family, once they are concatenated
+- the binary MSAs, once the searches and bootstraps of the family are done
+- old_parse_run, once the second parsing step is done
+Each deletion is recorded in retention_manifest.txt (kind, family, path
+and size in bytes), which replaces the deleted files in the output
+directory. Files outside of the output directory (e.g. in the cache)
+are never deleted.
+"""
+
+def get_manifest(output_dir):
+  return os.path.join(output_dir, "retention_manifest.txt")
+
+def get_size(path):
+  if (os.path.isfile(path)):
+    return os.path.getsize(path)
+  size = 0
+  for root, dirs, files in os.walk(path):
+    for f in files:
+      try:
+        size += os.path.getsize(os.path.join(root, f))
+      except OSError:
+        pass
+  return size
+
+def remove(output_dir, kind, family, path):
+  """ Delete the file or directory path and record it in the manifest """
+  if (not os.path.exists(path)):
+    return
+  if (not os.path.abspath(path).startswith(os.path.abspath(output_dir) + os.sep)):
+    return
+  size = get_size(path)
+  if (os.path.isdir(path)):
+    shutil.rmtree(path, ignore_errors = True)
+  else:
+    os.remove(path)
+  line = kind + "\t" + family + "\t" + path + "\t" + str(size) + "\n"
+  # one write per record: the concatenation workers record concurrently
+  fd = os.open(get_manifest(output_dir), os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+  try:
+    os.write(fd, line.encode())
+  finally:
+    os.close(fd)
+
+def remove_binary_msa(msa, op):
+  """ Delete the binary MSA files of msa: its searches and bootstraps are done """
+  for run_dir in ["parse_run", "reparse_run"]:
+    family_dir = layout.get_family_dir(os.path.join(op.output_dir, run_dir, "results"), msa.name)
+    for rba in glob.glob(os.path.join(glob.escape(family_dir), "*.rba")):
+      remove(op.output_dir, "binary_msa", msa.name, rba)
+
+def remove_binary_msas(msas, op):
+  for msa in msas.values():
+    remove_binary_msa(msa, op)
+
+def remove_old_parse_run(op):
+  remove(op.output_dir, "old_parse_run", "", os.path.join(op.output_dir, "old_parse_run"))
+
+def log_summary(output_dir):
+  manifest = get_manifest(output_dir)
+  if (not os.path.isfile(manifest)):
+    return
+  sizes = {}
+  for line in open(manifest).readlines():
+    split = line.rstrip("\n").split("\t")
+    if (len(split) == 4):
+      sizes[split[0]] = sizes.get(split[0], 0) + int(split[3])
+  for kind in sorted(sizes):
+    logger.info("Deleted intermediate files (" + kind + "): " + str(round(sizes[kind] / (1024.0 * 1024.0), 1)) + " MB")
+  logger.info("The list of the deleted files is in " + manifest)
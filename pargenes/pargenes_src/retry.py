@@ -0,0 +1,144 @@
+import os
+import logger
+
+"""
+Job-level retries (--retry-failed-jobs). After a scheduler batch, the
+failed jobs (failed_commands.txt) are classified from their per-job logs:
+- oom: out of memory (allocation failures, killed by SIGKILL)
+- timeout: time limit reached (SIGXCPU, timeout exit codes)
+- segfault: segmentation fault
+- bad_input: input error reported by the program itself (e.g. an invalid
+  MSA), on a line starting with "ERROR:" (raxml-ng) or "Error:" (modeltest-ng)
+- unknown: any other failure
+Only the failed jobs are resubmitted, in a new commands file. The oom and
+timeout jobs are resubmitted with twice their number of cores (up to the
+number of cores of the batch): with MPI ranks, the memory of a job is split
+across more processes, and with threads, less jobs share the memory of
+the node. The bad_input jobs are not retried. Each retry is logged in
+job_failures.txt in the step directory, and the logs of the failed attempts
+are kept in per_job_logs as <job>_out_attempt<attempt>.txt.
+"""
+
+FAILURE_TYPES = ["oom", "timeout", "segfault", "bad_input", "unknown"]
+# the failure types resubmitted with more cores
+ESCALATED_FAILURES = ["oom", "timeout"]
+# line written by the python scheduler at the end of the logs of a failed job
+EXIT_CODE_PREFIX = "ParGenes: the job exited with code "
+OOM_PATTERNS = ["bad_alloc", "out of memory", "cannot allocate memory", "memoryerror", "oom-kill", "oom_kill"]
+TIMEOUT_PATTERNS = ["time limit", "timed out", "timeout"]
+SEGFAULT_PATTERNS = ["segmentation fault", "sigsegv"]
+# prefixes of the lines reporting an input error: raxml-ng, modeltest-ng
+BAD_INPUT_PREFIXES = ("ERROR:", "Error:")
+# exit codes of the process (negative: killed by a signal), or of a shell running it
+OOM_CODES = [-9, 137]
+TIMEOUT_CODES = [-24, 124, 152]
+SEGFAULT_CODES = [-11, 139]
+
+def get_job_log(run_path, name):
+  return os.path.join(run_path, "per_job_logs", name + "_out.txt")
+
+def read_exit_code(content):
+  """ Exit code written by the python scheduler in the logs of a job, or None """
+  for line in reversed(content.splitlines()):
+    if (line.startswith(EXIT_CODE_PREFIX)):
+      try:
+        return int(line[len(EXIT_CODE_PREFIX):])
+      except ValueError:
+        return None
+  return None
+
+def has_bad_input_line(content):
+  for line in content.splitlines():
+    if (line.lstrip().startswith(BAD_INPUT_PREFIXES)):
+      return True
+  return False
+
+def classify_failure(log_file):
+  """ Failure type (see FAILURE_TYPES) of a failed job, from its logs """
+  try:
+    with open(log_file, errors = "replace") as reader:
+      content = reader.read()
+  except OSError:
+    return "unknown"
+  code = read_exit_code(content)
+  lower = content.lower()
+  if (code in OOM_CODES or any(p in lower for p in OOM_PATTERNS)):
+    return "oom"
+  if (code in TIMEOUT_CODES or any(p in lower for p in TIMEOUT_PATTERNS)):
+    return "timeout"
+  if (code in SEGFAULT_CODES or any(p in lower for p in SEGFAULT_PATTERNS)):
+    return "segfault"
+  if (has_bad_input_line(content)):
+    return "bad_input"
+  return "unknown"
+
+def get_retry_cores(cores, failure, max_cores):
+  if (failure in ESCALATED_FAILURES):
+    return max(1, min(max_cores, cores * 2))
+  return cores
+
+def keep_attempt_log(run_path, name, attempt):
+  """ Keep the logs of a failed attempt, before the job runs again """
+  log_file = get_job_log(run_path, name)
+  if (os.path.isfile(log_file)):
+    os.replace(log_file, os.path.join(run_path, "per_job_logs", name + "_out_attempt" + str(attempt) + ".txt"))
+
+def log_failure(run_path, name, attempt, failure, cores):
+  with open(os.path.join(run_path, "job_failures.txt"), "a") as writer:
+    writer.write(name + " " + str(attempt) + " " + failure + " " + str(cores) + "\n")
+
+def read_failed_names(run_path):
+  failed_commands = os.path.join(run_path, "failed_commands.txt")
+  if (not os.path.isfile(failed_commands)):
+    return []
+  with open(failed_commands) as reader:
+    return [line.strip() for line in reader.readlines() if len(line.strip()) > 0]
+
+def write_failed_names(run_path, names):
+  failed_commands = os.path.join(run_path, "failed_commands.txt")
+  if (len(names) == 0):
+    if (os.path.isfile(failed_commands)):
+      os.remove(failed_commands)
+    return
+  with open(failed_commands, "w") as writer:
+    for name in names:
+      writer.write(name + "\n")
+
+def retry_failed_commands(run_batch, commands_filename, output_dir, ranks, op):
+  """ Rerun the failed jobs of the batch of commands_filename, at most
+  op.retry_failed_jobs times. run_batch(commands_filename) runs a batch.
+  failed_commands.txt is left with the jobs that still failed """
+  lines = {}
+  with open(commands_filename) as reader:
+    for line in reader.readlines():
+      split = line.split(None, 3)
+      if (len(split) >= 3):
+        lines[split[0]] = split
+  not_retried = []
+  for attempt in range(1, op.retry_failed_jobs + 1):
+    failed = [name for name in read_failed_names(output_dir) if not name in not_retried]
+    retry_lines = []
+    counts = {}
+    for name in failed:
+      failure = classify_failure(get_job_log(output_dir, name))
+      counts[failure] = counts.get(failure, 0) + 1
+      if (failure == "bad_input" or not name in lines):
+        log_failure(output_dir, name, attempt, failure, 0)
+        not_retried.append(name)
+        continue
+      split = lines[name]
+      cores = get_retry_cores(int(split[1]), failure, ranks)
+      split[1] = str(cores)
+      log_failure(output_dir, name, attempt, failure, cores)
+      keep_attempt_log(output_dir, name, attempt)
+      retry_lines.append(" ".join(split).rstrip() + "\n")
+    if (len(retry_lines) == 0):
+      return
+    summary = ", ".join(f + ": " + str(counts[f]) for f in FAILURE_TYPES if f in counts)
+    logger.warning("Retrying " + str(len(retry_lines)) + "/" + str(len(failed)) + " failed jobs of " + output_dir + " (" + summary + "), attempt " + str(attempt) + "/" + str(op.retry_failed_jobs))
+    retry_filename = os.path.join(output_dir, "retry_" + str(attempt) + "_commands.txt")
+    with open(retry_filename, "w") as writer:
+      writer.writelines(retry_lines)
+    write_failed_names(output_dir, [])
+    run_batch(retry_filename)
+    write_failed_names(output_dir, not_retried + read_failed_names(output_dir))
@@ -0,0 +1,318 @@
+import os
+import multiprocessing
+import logger
+import layout
+import raxml
+import archive
+try:
+  import numpy
+except ImportError:
+  numpy = None
+
+"""
+In-process MSA scanner (--msa-scanner native), replacing the raxml-ng
+parsing jobs to validate the MSAs and compute their dimensions.
+FASTA and PHYLIP (sequential or interleaved) files are read in a process
+pool, the site patterns are compressed (with numpy when it is available)
+and the per-taxon CLV size is computed from the number of patterns, states
+and rate categories. The numbers of threads and the memory are estimated
+with rules close to the raxml-ng ones. The binary MSA is only written
+for the scanned MSAs that need it: those read by several jobs, or large
+enough for the parsing of the MSA file to matter. They still get a
+raxml-ng parsing job, and the jobs of the other scanned MSAs read the MSA
+file. The MSAs that cannot be scanned (other file formats, partitioned
+models) are parsed by raxml-ng as before.
+The results of a scan are written in <prefix>.scan.txt, next to where
+raxml-ng would write its parsing logs.
+"""
+
+STATES = {"nt": 4, "aa": 20}
+# characters of each datatype, and characters standing for any state
+ALPHABETS = {
+  "nt": "ACGTURYSWKMBDHVN",
+  "aa": "ARNDCQEGHILKMFPSTWYVBZJXUO*",
+}
+UNDETERMINED = {
+  "nt": "N-?.OX",
+  "aa": "X-?.*",
+}
+# patterns per thread of the recommended and of the maximum number of threads
+PATTERNS_PER_THREAD = {"nt": 1000, "aa": 250}
+MIN_PATTERNS_PER_THREAD = {"nt": 100, "aa": 25}
+# raxml-ng refuses alignments with less taxa
+MIN_TAXA = 4
+# a scanned MSA gets a binary MSA if at least BINARY_MSA_MIN_JOBS jobs read
+# it, or if it has at least BINARY_MSA_MIN_CELLS taxa x sites
+BINARY_MSA_MIN_JOBS = 2
+BINARY_MSA_MIN_CELLS = 10000000
+
+class ScanError(Exception):
+  pass
+
+def read_fasta(lines):
+  names = []
+  sequences = []
+  for line in lines:
+    line = line.strip()
+    if (line.startswith(">")):
+      names.append(line[1:].strip())
+      sequences.append([])
+    elif (len(line) > 0):
+      if (len(names) == 0):
+        raise ScanError("sequence data before the first FASTA header")
+      sequences[-1].append(line.replace(" ", ""))
+  return names, ["".join(s) for s in sequences]
+
+def read_phylip_sequential(lines, taxa, sites):
+  names = []
+  sequences = []
+  for line in lines:
+    if (len(sequences) > 0 and len(sequences[-1]) < sites):
+      sequences[-1] += line.replace(" ", "")
+      continue
+    split = line.split(None, 1)
+    names.append(split[0])
+    sequences.append(split[1].replace(" ", "") if len(split) > 1 else "")
+  if (len(names) != taxa or any(len(s) != sites for s in sequences)):
+    return None
+  return names, sequences
+
+def read_phylip_interleaved(lines, taxa, sites):
+  if (len(lines) % taxa != 0):
+    return None
+  names = []
+  sequences = []
+  for i, line in enumerate(lines):
+    if (i < taxa):
+      split = line.split(None, 1)
+      names.append(split[0])
+      sequences.append(split[1].replace(" ", "") if len(split) > 1 else "")
+    else:
+      sequences[i % taxa] += line.replace(" ", "")
+  return names, sequences
+
+def read_phylip(lines):
+  header = lines[0].split()
+  try:
+    taxa = int(header[0])
+    sites = int(header[1])
+  except (IndexError, ValueError):
+    return None
+  lines = [line.strip() for line in lines[1:] if len(line.strip()) > 0]
+  result = read_phylip_sequential(lines, taxa, sites)
+  if (result == None):
+    result = read_phylip_interleaved(lines, taxa, sites)
+  if (result == None):
+    raise ScanError("cannot read the PHYLIP alignment: expected " + str(taxa) + " sequences of " + str(sites) + " sites")
+  return result
+
+def read_msa(path):
+  """ Names and sequences of an MSA file, or None if its format is not supported """
+  with open(path) as reader:
+    lines = reader.readlines()
+  first = ""
+  for line in lines:
+    if (len(line.strip()) > 0):
+      first = line.strip()
+      break
+  if (first.startswith(">")):
+    return read_fasta(lines)
+  lines = [line for line in lines if len(line.strip()) > 0]
+  if (len(lines) > 0 and len(first.split()) == 2 and first.split()[0].isdigit()):
+    return read_phylip(lines)
+  return None
+
+def count_patterns(sequences, datatype):
+  """ Number of distinct site columns, ignoring the columns with only
+  undetermined characters """
+  undetermined = UNDETERMINED[datatype]
+  table = str.maketrans(undetermined, undetermined[0] * len(undetermined))
+  sequences = [s.upper().translate(table) for s in sequences]
+  gap_column = undetermined[0] * len(sequences)
+  if (numpy != None):
+    matrix = numpy.frombuffer("".join(sequences).encode(), dtype = numpy.uint8).reshape(len(sequences), -1)
+    columns = numpy.ascontiguousarray(matrix.T)
+    rows = columns.view(numpy.dtype((numpy.void, columns.shape[1]))).ravel()
+    unique = numpy.unique(rows)
+    patterns = len(unique)
+    if (numpy.any(numpy.all(columns == ord(undetermined[0]), axis = 1))):
+      patterns -= 1
+    return patterns
+  columns = set(zip(*sequences))
+  patterns = len(columns)
+  if (tuple(gap_column) in columns):
+    patterns -= 1
+  return patterns
+
+def validate(names, sequences, datatype):
+  if (len(names) < MIN_TAXA):
+    raise ScanError("the alignment has " + str(len(names)) + " taxa, at least " + str(MIN_TAXA) + " are required")
+  if (len(set(names)) != len(names)):
+    raise ScanError("duplicated taxon names")
+  length = len(sequences[0])
+  if (length == 0):
+    raise ScanError("empty sequences")
+  for name, sequence in zip(names, sequences):
+    if (len(sequence) != length):
+      raise ScanError("the sequence of " + name + " has " + str(len(sequence)) + " sites instead of " + str(length))
+  allowed = set(ALPHABETS[datatype] + UNDETERMINED[datatype])
+  invalid = set("".join(sequences).upper()) - allowed
+  if (len(invalid) > 0):
+    raise ScanError("invalid characters " + "".join(sorted(invalid)) + " for datatype " + datatype)
+
+def get_threads(patterns, datatype):
+  """ Minimum, recommended and maximum numbers of threads """
+  recommended = max(1, patterns // PATTERNS_PER_THREAD[datatype])
+  maximum = max(recommended, patterns // MIN_PATTERNS_PER_THREAD[datatype])
+  return 1, recommended, maximum
+
+def scan_msa(path, datatype, categories):
+  """ Dimensions of an MSA, as a dict of the values found in the raxml-ng
+  parsing logs. Raise ScanError if the MSA is invalid, and return None if it
+  cannot be scanned """
+  msa = read_msa(path)
+  if (msa == None):
+    return None
+  names, sequences = msa
+  validate(names, sequences, datatype)
+  patterns = count_patterns(sequences, datatype)
+  per_taxon_clv_size = patterns * STATES[datatype] * categories
+  min_threads, recommended_threads, max_threads = get_threads(patterns, datatype)
+  # two CLVs per taxon (inner nodes and their directions), 8 bytes per element
+  memory = 2.0 * len(names) * per_taxon_clv_size * 8.0 / (1024.0 * 1024.0)
+  return {
+    "taxa": len(names),
+    "sites": len(sequences[0]),
+    "patterns": patterns,
+    "per_taxon_clv_size": per_taxon_clv_size,
+    "memory": memory,
+    "min_threads": min_threads,
+    "recommended_threads": recommended_threads,
+    "max_threads": max_threads,
+  }
+
+def get_jobs_per_family(op):
+  """ Number of raxml-ng jobs reading the MSA of a family (at least) """
+  jobs = op.random_starting_trees + op.parsimony_starting_trees
+  if (op.bootstraps > 0):
+    jobs += 1
+  if (op.constrain_search):
+    jobs += 1
+  return jobs
+
+def needs_binary_msa(result, op):
+  """ True if the scanned MSA of result (see scan_msa) should get a binary MSA """
+  if (result == None or "error" in result):
+    return False
+  return get_jobs_per_family(op) >= BINARY_MSA_MIN_JOBS or result["taxa"] * result["sites"] >= BINARY_MSA_MIN_CELLS
+
+def get_scan_file(prefix):
+  return prefix + ".scan.txt"
+
+def scan_worker(args):
+  """ Scan one MSA and write its scan file. Return its name and the
+  scan result, or None if it cannot be scanned """
+  name, path, datatype, categories, prefix = args
+  try:
+    result = scan_msa(path, datatype, categories)
+  except ScanError as e:
+    result = {"error": str(e)}
+  except UnicodeDecodeError as e:
+    result = {"error": "cannot read " + path + ": " + str(e)}
+  except OSError:
+    # not an error of the MSA itself: let raxml-ng parse it
+    result = None
+  if (result == None):
+    return name, None
+  os.makedirs(os.path.dirname(prefix), exist_ok = True)
+  with open(get_scan_file(prefix) + ".tmp", "w") as writer:
+    for key, value in result.items():
+      writer.write(key + " " + str(value) + "\n")
+  os.replace(get_scan_file(prefix) + ".tmp", get_scan_file(prefix))
+  return name, result
+
+def get_scan_task(msa, parse_run_results, op):
+  """ Arguments of scan_worker for msa, or None if the scanner cannot
+  handle its model (e.g. partitioned models) """
+  categories = raxml.get_rate_categories(msa.get_model())
+  if (categories == 0):
+    return None
+  prefix = os.path.join(layout.get_family_dir(parse_run_results, msa.name), msa.name)
+  return (msa.name, msa.path, op.datatype, categories, prefix)
+
+def scan_family(msa, parse_run_results, op):
+  """ Scan one MSA in the current process. Return False if it must be
+  parsed by raxml-ng (because it cannot be scanned, or for its binary MSA) """
+  archive.stage_msas([msa], op)
+  task = get_scan_task(msa, parse_run_results, op)
+  if (task == None):
+    return False
+  result = scan_worker(task)[1]
+  if (result == None or needs_binary_msa(result, op)):
+    return False
+  msa.parse_prefix = task[4]
+  return True
+
+def scan_msas(msas, parse_run_results, op):
+  """ Scan the MSAs in a process pool. Return the MSAs that must be parsed
+  by raxml-ng: the MSAs that could not be scanned, and the scanned MSAs
+  that need a binary MSA """
+  archive.stage_msas(msas, op)
+  tasks = []
+  not_scanned = []
+  for msa in msas:
+    task = get_scan_task(msa, parse_run_results, op)
+    if (task == None):
+      not_scanned.append(msa)
+      continue
+    msa.parse_prefix = task[4]
+    tasks.append(task)
+  by_name = dict((msa.name, msa) for msa in msas)
+  binary_msas = []
+  if (len(tasks) > 0):
+    pool = multiprocessing.Pool(processes = max(1, min(multiprocessing.cpu_count(), int(op.cores))))
+    for name, result in pool.imap_unordered(scan_worker, tasks, chunksize = 16):
+      if (result == None):
+        by_name[name].parse_prefix = ""
+        not_scanned.append(by_name[name])
+      elif (needs_binary_msa(result, op)):
+        binary_msas.append(by_name[name])
+    pool.close()
+    pool.join()
+  logger.info("Scanned " + str(len(msas) - len(not_scanned)) + " MSAs, " + str(len(not_scanned)) + " MSAs will be parsed by raxml-ng, and " + str(len(binary_msas)) + " scanned MSAs will get a binary MSA")
+  return not_scanned + binary_msas
+
+def read_scan_values(prefix):
+  values = {}
+  with open(get_scan_file(prefix)) as reader:
+    for line in reader.readlines():
+      key, value = line.rstrip("\n").split(" ", 1)
+      values[key] = value
+  return values
+
+def read_scan(msa, prefix, core_assignment):
+  """ Store the results of the scan of msa (see scan_msa) into msa.
+  Return False if the scan did not succeed """
+  values = read_scan_values(prefix)
+  if ("error" in values):
+    logger.warning("Invalid MSA " + msa.name + ": " + values["error"])
+    msa.valid = False
+    return False
+  msa.taxa = int(values["taxa"])
+  msa.patterns = int(values["patterns"])
+  msa.per_taxon_clv_size = int(values["per_taxon_clv_size"])
+  msa.memory = float(values["memory"])
+  msa.min_cores = int(values["min_threads"])
+  msa.max_cores = int(values["max_threads"])
+  if (core_assignment == "high"):
+    msa.cores = msa.max_cores
+  elif (core_assignment == "low"):
+    msa.cores = msa.min_cores
+  else:
+    msa.cores = int(values["recommended_threads"])
+  # written by a raxml-ng parsing job if the MSA needs it (see needs_binary_msa)
+  msa.binary_path = ""
+  if (os.path.isfile(prefix + ".raxml.rba")):
+    msa.binary_path = prefix + ".raxml.rba"
+  msa.parse_model = msa.get_model()
+  return True
@@ -5,6 +5,76 @@ import commons
 import logger
 import errorcodes
 import report
+import checkpoint
+import costmodel
+import resultsdb
+import dispatcher
+import retry
+import jobstats
+import admission
+import archive
+
+class Command:
+  """ One job of a scheduler commands file: its name, its number of cores,
+  its cost (used to sort the jobs) and the arguments of the program to run.
+  The job is considered as done when done_file ends with done_marker.
+  family and step tell which family and step the job belongs to, and
+  memory is its estimated memory in MB (0 if unknown, see admission.py) """
+  def __init__(self, name, cores, cost, args, done_file = "", done_marker = "", family = "", step = "", memory = 0.0):
+    self.name = name
+    self.cores = cores
+    self.cost = cost
+    self.args = args
+    self.done_file = done_file
+    self.done_marker = done_marker
+    self.family = family
+    self.step = step
+    self.memory = memory
+
+  def get_line(self):
+    return self.name + " " + str(self.cores) + " " + str(self.cost) + " " + self.args
+
+def sets_threads(scheduler_mode):
+  """ True if the scheduler runs executables and appends the number of
+  threads of each job to its arguments (fork and python schedulers) """
+  return scheduler_mode == "fork" or scheduler_mode == "python"
+
+def write_commands(commands, commands_filename, mode = "w"):
+  """ Write the commands in the format expected by the mpi scheduler """
+  with open(commands_filename, mode) as writer:
+    for command in commands:
+      writer.write(command.get_line() + "\n")
+
+def run_commands(library, scheduler, threads_arg, commands, commands_filename, output_dir, ranks, op):
+  """ Write the commands that still have to be run and run them with the scheduler """
+  to_run = checkpoint.get_commands_to_run(commands, output_dir, op)
+  if (len(to_run) < len(commands)):
+    # the jobs that completed before an interruption might not be in results.db yet
+    names = set(command.name for command in to_run)
+    skipped = [command for command in commands if not command.name in names]
+    resultsdb.record_jobs(skipped, [True] * len(skipped), op)
+  commands = to_run
+  archive.stage_commands(commands, op)
+  scheduled_commands = commands
+  scheduled_library = library
+  if (admission.is_enabled(op) and len(commands) > 0):
+    if (scheduler == "python"):
+      admission.write_jobs_memory(commands, output_dir)
+    else:
+      admission.reserve_memory_cores(commands, op)
+  if (jobstats.is_enabled(scheduler, op) and len(commands) > 0):
+    check_library(library, op)
+    jobstats.init_table(output_dir)
+    scheduled_commands = [jobstats.wrap_command(command, library, threads_arg, output_dir) for command in commands]
+    scheduled_library = jobstats.get_wrapper_library()
+  write_commands(scheduled_commands, commands_filename)
+  if (len(commands) == 0):
+    logger.info("No job to run in " + output_dir)
+    return
+  run_scheduler(scheduled_library, scheduler, threads_arg, commands_filename, output_dir, ranks, op)
+  statuses = checkpoint.record_completed_commands(commands, output_dir)
+  costmodel.record_runtimes(commands)
+  resultsdb.record_jobs(commands, statuses, op)
 
 def print_help_in_error(output_dir):
       logger.error("Please check the logs in " + os.path.join(output_dir, "logs.txt"))
@@ -35,21 +105,15 @@ def check_mpi_exec_command(op):
     report.report_and_exit(op.output_dir, 167) 
 
 
-def run_scheduler(library, scheduler, threads_arg, commands_filename, output_dir, ranks, op):
-  """ Run the mpi scheduler program """
-  sys.stdout.flush()
-  command = []
-  my_env = os.environ.copy()
+def check_library(library, op):
   if (not os.path.isfile(library)):
     print("Error in run_scheduler: the binary " + library + " does not exist. Please check your installation")
     report.report_and_exit(op.output_dir, 238) 
-  if (not os.path.isfile(commands_filename)):
-    print("Internal error when running scheduler: " + commands_filename + " is not a valid file. Please report this issue to ParGenes team. Aborting")
-    report.report_and_exit(op.output_dir, 238)
-  if (scheduler == "openmp"):
-    my_env["OMP_NUM_THREADS"] = str(ranks) + "," + str(ranks) + "," + str(ranks)
-    my_env["OMP_DYNAMIC"] = "false"
-    #command.append("OMP_NUM_TRHEADS=" + str(ranks))
+
+def get_mpi_scheduler_command(scheduler, ranks, op):
+  """ Command prefix (mpiexec, valgrind, mpi-scheduler and its mode)
+  used to run a batch on ranks cores """
+  command = []
   if (scheduler != "openmp" and scheduler != "fork"):
     check_mpi_exec_command(op)
     command.append("mpiexec")
@@ -71,16 +135,30 @@ def run_scheduler(library, scheduler, threads_arg, commands_filename, output_dir
   else:
     command.append("--openmp-scheduler")
   command.append(str(ranks))
-  command.append(library)
-  command.append(commands_filename)
-  command.append(output_dir)
-  if (op.job_failure_fatal):
-    command.append("--jobs-failure-fatal")
-  if (scheduler == "fork"):
-    if (len(threads_arg) != 0):
-      command.append("--threads-arg")
-      command.append(threads_arg)
-  errorcode = run(command, output_dir, my_env)
+  return command
+
+def run_batch(library, scheduler, threads_arg, commands_filename, output_dir, ranks, op):
+  """ Run the scheduler once on a commands file, restarting it after
+  an error (--retry) """
+  if (scheduler == "python"):
+    run_once = lambda: dispatcher.run_commands_file(library, threads_arg, commands_filename, output_dir, ranks, op.job_failure_fatal, op.node_memory)
+  else:
+    my_env = os.environ.copy()
+    if (scheduler == "openmp"):
+      my_env["OMP_NUM_THREADS"] = str(ranks) + "," + str(ranks) + "," + str(ranks)
+      my_env["OMP_DYNAMIC"] = "false"
+    command = get_mpi_scheduler_command(scheduler, ranks, op)
+    command.append(library)
+    command.append(commands_filename)
+    command.append(output_dir)
+    if (op.job_failure_fatal):
+      command.append("--jobs-failure-fatal")
+    if (scheduler == "fork"):
+      if (len(threads_arg) != 0):
+        command.append("--threads-arg")
+        command.append(threads_arg)
+    run_once = lambda: run(command, output_dir, my_env)
+  errorcode = run_once()
   if (errorcode == 242):
     if (op.job_failure_fatal):
       logger.error("At least one job failed")
@@ -94,12 +172,24 @@ def run_scheduler(library, scheduler, threads_arg, commands_filename, output_dir
       logger.error("mpi-scheduler execution failed with error code " + str(errorcode))
       curr_retry += 1
       logger.error("Retry " + str(curr_retry) + "/" + str(op.retry) + "...")
-      errorcode = run(command, output_dir, my_env)
+      errorcode = run_once()
 
   if (errorcode != 0):
     logger.error("mpi-scheduler execution failed with error code " + str(errorcode))
     logger.error("Will now exit...")
     raise RuntimeError("mpi-scheduler  execution failed with error code " + str(errorcode))
+
+def run_scheduler(library, scheduler, threads_arg, commands_filename, output_dir, ranks, op):
+  """ Run the mpi scheduler program (or the python scheduler) on a commands
+  file, and then only the failed jobs (--retry-failed-jobs) """
+  sys.stdout.flush()
+  check_library(library, op)
+  if (not os.path.isfile(commands_filename)):
+    print("Internal error when running scheduler: " + commands_filename + " is not a valid file. Please report this issue to ParGenes team. Aborting")
+    report.report_and_exit(op.output_dir, 238)
+  run_batch(library, scheduler, threads_arg, commands_filename, output_dir, ranks, op)
+  if (op.retry_failed_jobs > 0):
+    retry.retry_failed_commands(lambda filename: run_batch(library, scheduler, threads_arg, filename, output_dir, ranks, op), commands_filename, output_dir, ranks, op)
   failed_commands = os.path.join(output_dir, "failed_commands.txt")
   if (os.path.isfile(failed_commands)):
     accumulated_failed_commands = os.path.join(op.output_dir, "failed_commands.txt")
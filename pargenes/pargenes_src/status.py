@@ -0,0 +1,205 @@
+import os
+import sys
+import glob
+import time
+import argparse
+import threading
+import checkpoint
+import layout
+
+"""
+Progress of a ParGenes run, computed from its output directory only, so
+that it can be read while the run is going on (pargenes.py status
+<output_dir>, or python status.py <output_dir>). For each step directory,
+the jobs come from its commands files (with their costs), the completed
+jobs from completed_jobs.txt and from the per-job logs of the jobs that
+are not running anymore, the running jobs from running_jobs and the failed
+jobs from failed_commands.txt. The progress is weighted by the job costs.
+The throughput (cost per second since the commands files were written)
+gives the ETA of each running step. The steps that did not start yet have
+no commands file and are not included in the ETA.
+With --status-interval, the run itself rewrites this report into
+status.txt at the given interval, from a background thread: the report
+does not change the state of the layout module (it reads layout.txt itself).
+"""
+
+# step directories, in the order of the run
+STEPS = ["parse_run", "modeltest_run", "old_parse_run", "reparse_run",
+  os.path.join("constrain_run", "parsimony"), os.path.join("constrain_run", "consensus"),
+  "mlsearch_run", "supports_run"]
+CHECKPOINTS = ["started", "MSAs parsed", "models selected", "ML searches done",
+  "best ML trees selected", "bootstraps concatenated", "support values done",
+  "species tree done"]
+
+class StepStatus:
+  """ Job counts and costs of one step directory """
+  def __init__(self, name):
+    self.name = name
+    self.jobs = 0
+    self.done = 0
+    self.running = 0
+    self.failed = 0
+    self.total_cost = 0.0
+    self.finished_cost = 0.0
+    self.start = None
+    self.end = None
+
+  def is_finished(self):
+    return self.running == 0 and self.done + self.failed >= self.jobs
+
+  def get_progress(self):
+    if (self.total_cost <= 0.0):
+      return 1.0
+    return self.finished_cost / self.total_cost
+
+  def get_throughput(self, now):
+    """ Finished cost per second """
+    if (self.is_finished() and self.end != None):
+      now = self.end
+    if (self.start == None or now <= self.start):
+      return 0.0
+    return self.finished_cost / (now - self.start)
+
+  def get_eta(self, now):
+    """ Remaining seconds, or None if unknown """
+    if (self.is_finished()):
+      return 0.0
+    throughput = self.get_throughput(now)
+    if (throughput <= 0.0):
+      return None
+    return (self.total_cost - self.finished_cost) / throughput
+
+def read_names(path):
+  if (not os.path.isfile(path)):
+    return set()
+  return set(line.strip() for line in open(path).readlines() if len(line.strip()) > 0)
+
+def read_step(output_dir, step):
+  """ StepStatus of a step directory, or None if it has no job """
+  run_path = os.path.join(output_dir, step)
+  costs = {}
+  start = None
+  commands_files = [f for f in glob.glob(os.path.join(glob.escape(run_path), "*command*.txt")) if os.path.basename(f) != "failed_commands.txt"]
+  for commands_file in sorted(commands_files, key = os.path.getmtime):
+    if (start == None or os.path.getmtime(commands_file) < start):
+      start = os.path.getmtime(commands_file)
+    for line in open(commands_file).readlines():
+      split = line.split(None, 3)
+      if (len(split) >= 3 and not split[0] in costs):
+        try:
+          costs[split[0]] = float(split[2])
+        except ValueError:
+          costs[split[0]] = 1.0
+  if (len(costs) == 0):
+    return None
+  running = set(layout.listdir(os.path.join(run_path, "running_jobs")))
+  failed = read_names(os.path.join(run_path, "failed_commands.txt"))
+  done = checkpoint.read_completed_jobs(run_path)
+  for log in layout.listdir(os.path.join(run_path, "per_job_logs")):
+    if (log.endswith("_out.txt")):
+      name = log[:-len("_out.txt")]
+      if (not name in running and not name in failed):
+        done.add(name)
+  status = StepStatus(step)
+  status.start = start
+  for path in [checkpoint.get_ledger_file(run_path), os.path.join(run_path, "failed_commands.txt"), os.path.join(run_path, "per_job_logs")]:
+    if (os.path.exists(path)):
+      status.end = max(status.end or 0.0, os.path.getmtime(path))
+  for name, cost in costs.items():
+    status.jobs += 1
+    status.total_cost += cost
+    if (name in running):
+      status.running += 1
+    elif (name in failed):
+      status.failed += 1
+      status.finished_cost += cost
+    elif (name in done):
+      status.done += 1
+      status.finished_cost += cost
+  return status
+
+def read_status(output_dir):
+  return [s for s in [read_step(output_dir, step) for step in STEPS] if s != None]
+
+def format_rate(rate):
+  """ Cost per second, with a k/M/G/T suffix above 1000 """
+  for suffix in ["", "k", "M", "G"]:
+    if (rate < 1000.0):
+      return str(round(rate, 2 if suffix == "" else 1)) + suffix
+    rate /= 1000.0
+  return str(round(rate, 1)) + "T"
+
+def read_layout(output_dir):
+  try:
+    return open(layout.get_layout_file(output_dir)).read().strip() or "flat"
+  except OSError:
+    return "flat"
+
+def format_duration(seconds):
+  if (seconds == None):
+    return "unknown"
+  seconds = int(seconds)
+  return str(seconds // 3600) + "h" + str((seconds // 60) % 60).zfill(2) + "m" + str(seconds % 60).zfill(2) + "s"
+
+def get_report(output_dir):
+  """ Text report of the progress of the run in output_dir """
+  now = time.time()
+  index = checkpoint.read_checkpoint(output_dir)
+  lines = []
+  lines.append("ParGenes run " + os.path.abspath(output_dir) + " (" + read_layout(output_dir) + " layout)")
+  lines.append("Checkpoint " + str(index) + ": " + CHECKPOINTS[min(index, len(CHECKPOINTS) - 1)])
+  lines.append("")
+  lines.append("step".ljust(28) + "jobs".rjust(8) + "done".rjust(8) + "running".rjust(9) + "failed".rjust(8) + "progress".rjust(10) + "cost/s".rjust(12) + "ETA".rjust(12))
+  eta = 0.0
+  for step in read_status(output_dir):
+    step_eta = step.get_eta(now)
+    if (step_eta == None or eta == None):
+      eta = None
+    else:
+      eta = max(eta, step_eta)
+    lines.append(step.name.ljust(28) + str(step.jobs).rjust(8) + str(step.done).rjust(8) + str(step.running).rjust(9) + str(step.failed).rjust(8)
+        + (str(round(100.0 * step.get_progress(), 1)) + "%").rjust(10) + format_rate(step.get_throughput(now)).rjust(12) + format_duration(step_eta).rjust(12))
+  lines.append("")
+  lines.append("Remaining time of the running steps: " + format_duration(eta) + " (the steps that did not start yet are not included)")
+  return "\n".join(lines) + "\n"
+
+def write_status_file(output_dir):
+  """ Rewrite status.txt in output_dir """
+  path = os.path.join(output_dir, "status.txt")
+  with open(path + ".tmp", "w") as writer:
+    writer.write(get_report(output_dir))
+  os.replace(path + ".tmp", path)
+
+def start_status_file(output_dir, interval):
+  """ Rewrite status.txt every interval seconds, in a background thread """
+  def write_periodically():
+    while (True):
+      try:
+        write_status_file(output_dir)
+      except OSError:
+        pass
+      time.sleep(interval)
+  thread = threading.Thread(target = write_periodically, daemon = True)
+  thread.start()
+
+def main(args):
+  parser = argparse.ArgumentParser(prog = "pargenes.py status")
+  parser.add_argument("output_dir",
+    help = "Output directory of the ParGenes run")
+  parser.add_argument("--watch",
+    dest = "watch",
+    type = int,
+    default = 0,
+    help = "Print the status again every WATCH seconds")
+  p = parser.parse_args(args)
+  if (not os.path.isdir(p.output_dir)):
+    print("[Error] " + p.output_dir + " is not a directory")
+    sys.exit(1)
+  while (True):
+    print(get_report(p.output_dir))
+    if (p.watch <= 0):
+      break
+    time.sleep(p.watch)
+
+if __name__ == "__main__":
+  main(sys.argv[1:])
@@ -0,0 +1,47 @@
+import os
+import sys
+import json
+import time
+import atexit
+import runpy
+import resource
+
+"""
+Run a python script (python fscount.py counts.json script.py args...) and
+write into counts.json the filesystem operations of its process, counted
+with an audit hook, with its CPU time and its peak RSS. The processes
+started by the script (and its forked workers) are not counted: with the
+stub executables, this is the own cost of ParGenes.
+"""
+
+EVENTS = ["open", "os.listdir", "os.scandir", "os.mkdir", "os.rmdir", "os.remove",
+  "os.rename", "os.link", "os.symlink", "os.truncate", "os.chmod", "glob.glob",
+  "shutil.copyfile", "shutil.copytree", "shutil.rmtree", "subprocess.Popen"]
+
+counts = dict((event, 0) for event in EVENTS)
+
+def count_event(event, args):
+  if (event in counts):
+    counts[event] += 1
+
+def write_counts(output, pid, start):
+  if (os.getpid() != pid):
+    return
+  usage = resource.getrusage(resource.RUSAGE_SELF)
+  result = {
+    "events": counts,
+    "cpu_s": usage.ru_utime + usage.ru_stime,
+    "max_rss_kb": usage.ru_maxrss,
+    "wall_s": time.time() - start
+  }
+  with open(output, "w") as writer:
+    json.dump(result, writer, indent = 2)
+
+if __name__ == "__main__":
+  output = sys.argv[1]
+  script = sys.argv[2]
+  sys.argv = sys.argv[2:]
+  sys.path.insert(0, os.path.dirname(os.path.realpath(script)))
+  atexit.register(write_counts, output, os.getpid(), time.time())
+  sys.addaudithook(count_event)
+  runpy.run_path(script, run_name = "__main__")
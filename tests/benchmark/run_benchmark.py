@@ -0,0 +1,318 @@
+import os
+import sys
+import json
+import time
+import shlex
+import random
+import shutil
+import argparse
+import subprocess
+
+"""
+Scalability benchmark of the ParGenes orchestration, without real compute.
+For each number of families (--families 100,1000,...), a synthetic
+collection of DNA alignments is generated (numbers of taxa and of sites
+drawn from log-normal distributions, to get a few big families and many
+small ones), and the whole pipeline (parsing, modeltest, ML searches,
+bootstraps and supports) runs on it with the stub raxml-ng and modeltest-ng
+executables of the stubs directory. The stubs write realistic outputs and
+sleep in proportion to the cost of their job (--time-scale), and trace
+the start and end of each job.
+The report gives, for each run:
+- the makespan of the run and the time during which no job was running,
+  which is the Python overhead of ParGenes on the critical path, before
+  and after each stage
+- per stage: the number of jobs, their span, the dispatch throughput (jobs
+  per second) and the utilization of the cores
+- the CPU time and peak memory of the ParGenes process, and its
+  filesystem operations (see fscount.py)
+- the number of files and directories of the output directory
+The generated datasets are kept and reused. --save writes the results in
+a json file, and --compare compares them with a previous json file, and
+fails if one of the overhead metrics got worse by more than --tolerance.
+"""
+
+benchmark_path = os.path.dirname(os.path.realpath(__file__))
+tests_path = os.path.dirname(benchmark_path)
+root = os.path.dirname(tests_path)
+stubs_path = os.path.join(benchmark_path, "stubs")
+pargenes_script = os.path.join(root, "pargenes", "pargenes.py")
+fscount_script = os.path.join(benchmark_path, "fscount.py")
+
+STAGES = ["parse", "modeltest", "reparse", "parsimony", "consensus", "mlsearch", "bootstrap", "support"]
+NUCLEOTIDES = "ACGT"
+# metrics compared with --compare: the lower, the better
+COMPARED_METRICS = ["makespan_s", "overhead_s", "pargenes_cpu_s", "fs_operations"]
+
+def parse_arguments():
+  parser = argparse.ArgumentParser(description = "Benchmark of the ParGenes orchestration with synthetic MSAs and stub executables")
+  parser.add_argument("--families",
+    dest="families",
+    default="100,1000",
+    help="Comma-separated list of numbers of families (one run per number)")
+  parser.add_argument("-c", "--cores",
+    dest="cores",
+    type=int,
+    default=8,
+    help="Number of cores given to ParGenes")
+  parser.add_argument("--scheduler",
+    dest="scheduler",
+    choices=["python", "fork"],
+    default="python",
+    help="ParGenes scheduler (fork requires the mpi-scheduler binary)")
+  parser.add_argument("--time-scale",
+    dest="time_scale",
+    type=float,
+    default=1.0,
+    help="Seconds slept by the stubs per million (taxon x pattern) cells and per tree. 0 to measure the orchestration only")
+  parser.add_argument("--taxa",
+    dest="taxa",
+    type=int,
+    default=20,
+    help="Median number of taxa per family")
+  parser.add_argument("--sites",
+    dest="sites",
+    type=int,
+    default=500,
+    help="Median number of sites per family")
+  parser.add_argument("--skew",
+    dest="skew",
+    type=float,
+    default=1.0,
+    help="Standard deviation of the logarithm of the family sizes (0 for families of the same size)")
+  parser.add_argument("--taxa-pool",
+    dest="taxa_pool",
+    type=int,
+    default=200,
+    help="Total number of taxa, from which the taxa of each family are drawn")
+  parser.add_argument("--bs-trees",
+    dest="bootstraps",
+    type=int,
+    default=2,
+    help="Number of bootstrap trees per family")
+  parser.add_argument("--starting-trees",
+    dest="starting_trees",
+    type=int,
+    default=1,
+    help="Number of random starting trees per family")
+  parser.add_argument("--pargenes-args",
+    dest="pargenes_args",
+    default="",
+    help="Additional arguments passed to ParGenes, e.g. --pargenes-args=\"--pipeline\"")
+  parser.add_argument("--seed",
+    dest="seed",
+    type=int,
+    default=42,
+    help="Seed of the generated datasets")
+  parser.add_argument("-o", "--output",
+    dest="output",
+    default=os.path.join(tests_path, "tests_outputs", "benchmark"),
+    help="Directory of the datasets, of the runs and of the report")
+  parser.add_argument("--save",
+    dest="save",
+    help="Write the results in this json file")
+  parser.add_argument("--compare",
+    dest="compare",
+    help="Compare the results with this json file (written by --save)")
+  parser.add_argument("--tolerance",
+    dest="tolerance",
+    type=float,
+    default=0.25,
+    help="Relative increase of an overhead metric reported as a regression by --compare")
+  return parser.parse_args()
+
+def get_size(rng, median, skew, minimum, maximum):
+  return max(minimum, min(maximum, int(rng.lognormvariate(0.0, skew) * median)))
+
+def mutate(rng, sequence, rate):
+  sequence = list(sequence)
+  for i in rng.sample(range(len(sequence)), int(len(sequence) * rate)):
+    sequence[i] = rng.choice(NUCLEOTIDES)
+  return "".join(sequence)
+
+def generate_dataset(path, families, op):
+  """ Write families FASTA files into path/fasta_files, unless a dataset
+  with the same parameters is already there """
+  spec = {"families": families, "taxa": op.taxa, "sites": op.sites, "skew": op.skew,
+      "taxa_pool": op.taxa_pool, "seed": op.seed}
+  spec_file = os.path.join(path, "dataset.json")
+  msas_dir = os.path.join(path, "fasta_files")
+  if (os.path.isfile(spec_file) and json.load(open(spec_file)) == spec):
+    return msas_dir
+  print("Generating " + str(families) + " families in " + msas_dir)
+  shutil.rmtree(path, True)
+  os.makedirs(msas_dir)
+  rng = random.Random(op.seed)
+  pool = ["taxon_" + str(i) for i in range(op.taxa_pool)]
+  for family in range(families):
+    taxa = get_size(rng, op.taxa, op.skew, 4, op.taxa_pool)
+    sites = get_size(rng, op.sites, op.skew, 20, 100000)
+    ancestor = "".join(rng.choices(NUCLEOTIDES, k = sites))
+    with open(os.path.join(msas_dir, "family_" + str(family) + ".fasta"), "w") as writer:
+      for taxon in rng.sample(pool, taxa):
+        writer.write(">" + taxon + "\n" + mutate(rng, ancestor, 0.1) + "\n")
+  with open(spec_file, "w") as writer:
+    json.dump(spec, writer)
+  return msas_dir
+
+def run_pargenes(msas_dir, run_dir, op):
+  """ Run ParGenes with the stubs. Return its exit code """
+  shutil.rmtree(run_dir, True)
+  os.makedirs(run_dir)
+  command = [sys.executable, fscount_script, os.path.join(run_dir, "fscount.json"), pargenes_script]
+  command.extend(["-a", msas_dir, "-o", os.path.join(run_dir, "pargenes"), "-c", str(op.cores)])
+  command.extend(["-m", "--modeltest-perjob-cores", "4", "-s", str(op.starting_trees), "-b", str(op.bootstraps)])
+  command.extend(["--raxml-binary", os.path.join(stubs_path, "raxml-ng")])
+  command.extend(["--modeltest-binary", os.path.join(stubs_path, "modeltest-ng")])
+  command.extend(["--scheduler", op.scheduler])
+  command.extend(shlex.split(op.pargenes_args))
+  env = os.environ.copy()
+  env["PARGENES_BENCHMARK_TIME_SCALE"] = str(op.time_scale)
+  env["PARGENES_BENCHMARK_TRACE"] = os.path.join(run_dir, "trace.txt")
+  with open(os.path.join(run_dir, "pargenes_output.txt"), "w") as out:
+    return subprocess.call(command, stdout = out, stderr = out, env = env)
+
+def read_trace(trace_file):
+  """ Jobs of the trace, as (stage, start, end, threads) tuples. The
+  parsing jobs started after modeltest belong to the second parsing step """
+  jobs = []
+  if (os.path.isfile(trace_file)):
+    for line in open(trace_file).readlines():
+      split = line.split()
+      if (len(split) == 4):
+        jobs.append((split[0], float(split[1]), float(split[2]), int(split[3])))
+  modeltest_starts = [job[1] for job in jobs if job[0] == "modeltest"]
+  if (len(modeltest_starts) > 0):
+    first_modeltest = min(modeltest_starts)
+    jobs = [("reparse",) + job[1:] if job[0] == "parse" and job[1] > first_modeltest else job for job in jobs]
+  return jobs
+
+def get_idle_time(jobs, start, end):
+  """ Time between start and end during which no job was running """
+  idle = 0.0
+  current = start
+  for job in sorted(jobs, key = lambda j: j[1]):
+    if (job[1] > current):
+      idle += job[1] - current
+    current = max(current, job[2])
+  return idle + max(0.0, end - current)
+
+def count_files(path):
+  files = 0
+  directories = 0
+  size = 0
+  for dirpath, dirnames, filenames in os.walk(path):
+    directories += len(dirnames)
+    files += len(filenames)
+    for filename in filenames:
+      try:
+        size += os.path.getsize(os.path.join(dirpath, filename))
+      except OSError:
+        pass
+  return files, directories, size
+
+def get_results(families, run_dir, start, end, exit_code, op):
+  jobs = read_trace(os.path.join(run_dir, "trace.txt"))
+  fscount = {}
+  fscount_file = os.path.join(run_dir, "fscount.json")
+  if (os.path.isfile(fscount_file)):
+    fscount = json.load(open(fscount_file))
+  files, directories, size = count_files(os.path.join(run_dir, "pargenes"))
+  results = {
+    "families": families,
+    "exit_code": exit_code,
+    "jobs": len(jobs),
+    "makespan_s": end - start,
+    "overhead_s": get_idle_time(jobs, start, end),
+    "pargenes_cpu_s": fscount.get("cpu_s", 0.0),
+    "pargenes_max_rss_mb": fscount.get("max_rss_kb", 0) / 1024.0,
+    "fs_events": fscount.get("events", {}),
+    "fs_operations": sum(fscount.get("events", {}).values()),
+    "output_files": files,
+    "output_directories": directories,
+    "output_mb": size / 1048576.0,
+    "stages": {}
+  }
+  previous_end = start
+  for stage in sorted(set(job[0] for job in jobs), key = lambda s: min(j[1] for j in jobs if j[0] == s)):
+    stage_jobs = [job for job in jobs if job[0] == stage]
+    first = min(job[1] for job in stage_jobs)
+    last = max(job[2] for job in stage_jobs)
+    span = max(last - first, 1e-6)
+    busy = sum((job[2] - job[1]) * job[3] for job in stage_jobs)
+    results["stages"][stage] = {
+      "jobs": len(stage_jobs),
+      "gap_before_s": max(0.0, first - previous_end),
+      "span_s": span,
+      "jobs_per_s": len(stage_jobs) / span,
+      "utilization": min(1.0, busy / (span * op.cores))
+    }
+    previous_end = max(previous_end, last)
+  return results
+
+def format_results(results):
+  lines = []
+  lines.append("Families: " + str(results["families"]) + " (exit code " + str(results["exit_code"]) + ")")
+  lines.append("  makespan " + str(round(results["makespan_s"], 2)) + "s, " + str(results["jobs"]) + " jobs, no job running during "
+      + str(round(results["overhead_s"], 2)) + "s (" + str(round(100.0 * results["overhead_s"] / max(results["makespan_s"], 1e-6), 1)) + "%)")
+  lines.append("  ParGenes process: " + str(round(results["pargenes_cpu_s"], 2)) + "s CPU, " + str(round(results["pargenes_max_rss_mb"], 1)) + "MB peak RSS, "
+      + str(results["fs_operations"]) + " filesystem operations")
+  events = sorted([e for e in results["fs_events"].items() if e[1] > 0], key = lambda e: -e[1])
+  lines.append("    " + ", ".join(event + ": " + str(count) for event, count in events))
+  lines.append("  output directory: " + str(results["output_files"]) + " files, " + str(results["output_directories"]) + " directories, "
+      + str(round(results["output_mb"], 1)) + "MB")
+  lines.append("  " + "stage".ljust(12) + "jobs".rjust(8) + "gap_before_s".rjust(14) + "span_s".rjust(10) + "jobs/s".rjust(10) + "utilization".rjust(13))
+  for stage in sorted(results["stages"], key = lambda s: STAGES.index(s) if s in STAGES else len(STAGES)):
+    s = results["stages"][stage]
+    lines.append("  " + stage.ljust(12) + str(s["jobs"]).rjust(8) + str(round(s["gap_before_s"], 2)).rjust(14) + str(round(s["span_s"], 2)).rjust(10)
+        + str(round(s["jobs_per_s"], 1)).rjust(10) + (str(round(100.0 * s["utilization"], 1)) + "%").rjust(13))
+  return "\n".join(lines)
+
+def compare(all_results, baseline_file, tolerance):
+  """ Print the metrics that got worse than in baseline_file. Return their number """
+  baseline = dict((str(r["families"]), r) for r in json.load(open(baseline_file)))
+  regressions = 0
+  for results in all_results:
+    reference = baseline.get(str(results["families"]))
+    if (reference == None):
+      print("No baseline for " + str(results["families"]) + " families")
+      continue
+    for metric in COMPARED_METRICS:
+      if (results[metric] > reference[metric] * (1.0 + tolerance) and results[metric] - reference[metric] > 0.5):
+        print("Regression with " + str(results["families"]) + " families: " + metric + " " + str(round(reference[metric], 2)) + " -> " + str(round(results[metric], 2)))
+        regressions += 1
+    for stage, s in results["stages"].items():
+      if (stage in reference["stages"] and s["jobs_per_s"] * (1.0 + tolerance) < reference["stages"][stage]["jobs_per_s"]):
+        print("Regression with " + str(results["families"]) + " families: " + stage + " jobs/s " + str(round(reference["stages"][stage]["jobs_per_s"], 1)) + " -> " + str(round(s["jobs_per_s"], 1)))
+        regressions += 1
+  return regressions
+
+def main():
+  op = parse_arguments()
+  all_results = []
+  for families in [int(f) for f in op.families.split(",")]:
+    msas_dir = generate_dataset(os.path.join(op.output, "dataset_" + str(families)), families, op)
+    run_dir = os.path.join(op.output, "run_" + str(families))
+    print("Running ParGenes on " + str(families) + " families...")
+    sys.stdout.flush()
+    start = time.time()
+    exit_code = run_pargenes(msas_dir, run_dir, op)
+    end = time.time()
+    results = get_results(families, run_dir, start, end, exit_code, op)
+    all_results.append(results)
+    print(format_results(results))
+    if (exit_code != 0):
+      print("ParGenes failed, please check " + os.path.join(run_dir, "pargenes_output.txt"))
+  with open(os.path.join(op.output, "benchmark_report.txt"), "w") as writer:
+    writer.write("\n\n".join(format_results(r) for r in all_results) + "\n")
+  if (op.save):
+    with open(op.save, "w") as writer:
+      json.dump(all_results, writer, indent = 2)
+  failed = len([r for r in all_results if r["exit_code"] != 0])
+  if (op.compare):
+    failed += compare(all_results, op.compare, op.tolerance)
+  if (failed > 0):
+    sys.exit(1)
+
+if __name__ == "__main__":
+  main()
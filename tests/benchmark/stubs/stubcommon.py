@@ -0,0 +1,70 @@
+import os
+import sys
+import time
+
+"""
+Code shared by the stub executables of the benchmark (raxml-ng and
+modeltest-ng). A stub sleeps in proportion to the cost of its job:
+PARGENES_BENCHMARK_TIME_SCALE seconds per million (taxon x pattern) cells
+and per tree, divided by its number of threads. If PARGENES_BENCHMARK_TRACE
+is set, each job appends "step start end threads" to this file, with
+one single write, as the jobs run concurrently. The start time is the
+start of the process, to include the startup of the interpreter.
+"""
+
+def get_start_time():
+  """ Start time of the current process (from /proc on Linux) """
+  try:
+    with open("/proc/self/stat") as reader:
+      ticks = float(reader.read().rsplit(")", 1)[1].split()[19])
+    uptime = time.clock_gettime(time.CLOCK_BOOTTIME)
+    return time.time() - (uptime - ticks / os.sysconf("SC_CLK_TCK"))
+  except (OSError, IndexError, ValueError, AttributeError):
+    return time.time()
+
+def get_option(args, key, default = None):
+  if (key in args and args.index(key) + 1 < len(args)):
+    return args[args.index(key) + 1]
+  return default
+
+def read_msa(path):
+  """ Sequences of a FASTA file (or of a binary MSA written by the stub) """
+  sequences = {}
+  name = None
+  content = open(path).read()
+  if (content.startswith("#RBA\n")):
+    content = content.split("\n", 2)[2]
+  for line in content.splitlines():
+    if (line.startswith(">")):
+      name = line[1:].strip()
+      sequences[name] = []
+    elif (name != None):
+      sequences[name].append(line.strip())
+  return dict((name, "".join(chunks)) for name, chunks in sequences.items())
+
+def get_patterns(sequences):
+  if (len(sequences) == 0):
+    return 0
+  return len(set(zip(*sequences.values())))
+
+def run_job(step, cells, trees, threads):
+  """ Sleep as long as a job of cells cells and trees trees would run, and trace it """
+  start = get_start_time()
+  scale = float(os.environ.get("PARGENES_BENCHMARK_TIME_SCALE", "0"))
+  if (scale > 0.0):
+    time.sleep(scale * cells * trees / 1000000.0 / max(1, threads))
+  trace = os.environ.get("PARGENES_BENCHMARK_TRACE")
+  if (trace):
+    line = step + " " + repr(start) + " " + repr(time.time()) + " " + str(threads) + "\n"
+    fd = os.open(trace, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+    try:
+      os.write(fd, line.encode())
+    finally:
+      os.close(fd)
+
+def fail(message, log_file = None):
+  if (log_file != None):
+    with open(log_file, "w") as writer:
+      writer.write("ERROR: " + message + "\n")
+  print("ERROR: " + message)
+  sys.exit(1)
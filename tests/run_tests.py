@@ -5,6 +5,8 @@ import shutil
 import time
 import shlex
 import platform
+import tarfile
+import sqlite3
 
 run_as_binary = "--run-as-binary" in sys.argv
 
@@ -169,6 +171,31 @@ def test_model_test(pargenes_script):
   run_command(command, "modeltest_" + basename, output)
   return check_all(output, True, True, True, False, False)
 
+def test_model_change(pargenes_script):
+  basename = get_basename(pargenes_script)
+  output = os.path.join(tests_output_dir, "test_model_change", basename)
+  shutil.rmtree(output, ignore_errors = True)
+  # the MSAs are parsed with GTR+G (4 rate categories), and modeltest
+  # selects models without rate heterogeneity
+  command = pargenes_script + " "
+  command += "-a " + example_msas + " "
+  command += "-o " + output + " "
+  command += "-r " + example_raxml_options + " "
+  command += "-c 4 "
+  command += " -m"
+  command += " --modeltest-global-parameters " + example_modeltest_parameters
+  run_command(command, "model_change_" + basename, output)
+  try:
+    for msa, best_model in list(zip(valid_msas, best_models)):
+      # the ML search reads the binary MSA, but uses the modeltest model
+      log = os.path.join(output, "mlsearch_run", "results", msa, msa + ".raxml.log")
+      models = [line.split()[1] for line in open(log).readlines() if line.startswith("Model:")]
+      assert models == [best_model]
+  except:
+    print("FAILURE!!!!")
+    return 1
+  return check_all(output, True, True, True, False, False)
+
 def test_bootstraps(pargenes_script):
   basename = get_basename(pargenes_script)
   output = os.path.join(tests_output_dir, "test_bootstraps", basename)
@@ -261,6 +288,145 @@ def test_all_aster(pargenes_script):
   run_command(command, "all_aster_" + basename, output)
   return  check_all(output, True, True, True, False, True)
 
+def test_pipeline(pargenes_script):
+  basename = get_basename(pargenes_script)
+  output = os.path.join(tests_output_dir, "test_pipeline", basename)
+  try:
+    shutil.rmtree(output)
+  except:
+    pass
+  command = pargenes_script + " "
+  command += "-a " + example_msas + " "
+  command += "-o " + output + " "
+  command += "-c 4 "
+  command += "-m "
+  command += "-b 3 "
+  command += "-s 3 -p 3 "
+  command += "--pipeline "
+  command += " --modeltest-global-parameters " + example_modeltest_parameters
+  run_command(command, "pipeline_" + basename, output)
+  return  check_all(output, True, True, True, False, False)
+
+def test_python_scheduler(pargenes_script):
+  basename = get_basename(pargenes_script)
+  output = os.path.join(tests_output_dir, "test_python_scheduler", basename)
+  try:
+    shutil.rmtree(output)
+  except:
+    pass
+  command = pargenes_script + " "
+  command += "-a " + example_msas + " "
+  command += "-o " + output + " "
+  command += "-c 4 "
+  command += "-m "
+  command += "-b 3 "
+  command += "-s 3 -p 3 "
+  command += "--scheduler python "
+  command += " --modeltest-global-parameters " + example_modeltest_parameters
+  run_command(command, "python_scheduler_" + basename, output)
+  return  check_all(output, True, True, True, False, False)
+
+def test_cache(pargenes_script):
+  basename = get_basename(pargenes_script)
+  output = os.path.join(tests_output_dir, "test_cache", basename)
+  cache = os.path.join(tests_output_dir, "test_cache", basename + "_cache")
+  for directory in [output, output + "_first", cache]:
+    shutil.rmtree(directory, ignore_errors = True)
+  command = pargenes_script + " "
+  command += "-a " + example_msas + " "
+  command += "-r " + example_raxml_options + " "
+  command += "-c 4 "
+  command += "-s 3 -p 3 "
+  command += "--cache-dir " + cache + " "
+  run_command(command + "-o " + output + "_first", "cache_first_" + basename, output + "_first")
+  # the second run gets all its results from the cache
+  run_command(command + "-o " + output, "cache_" + basename, output)
+  try:
+    for msa in valid_msas:
+      results = os.path.join(output, "mlsearch_run", "results", msa)
+      assert os.path.isfile(os.path.join(results, msa + ".raxml.bestTree"))
+      assert os.path.isfile(os.path.join(results, msa + ".raxml.bestModel"))
+    assert len(open(os.path.join(output, "cached_msas.txt")).readlines()) == len(valid_msas)
+  except:
+    print("FAILURE!!!!")
+    return 1
+  print("Success!")
+  return 0
+
+def test_archive(pargenes_script):
+  basename = get_basename(pargenes_script)
+  output = os.path.join(tests_output_dir, "test_archive", basename)
+  shutil.rmtree(output, ignore_errors = True)
+  os.makedirs(output)
+  archive = os.path.join(output, "msas.tar.gz")
+  with tarfile.open(archive, "w:gz") as tar:
+    for f in os.listdir(example_msas):
+      tar.add(os.path.join(example_msas, f), arcname = f)
+  output = os.path.join(output, "run")
+  command = pargenes_script + " "
+  command += "-a " + archive + " "
+  command += "-o " + output + " "
+  command += "-r " + example_raxml_options + " "
+  command += "-c 4 "
+  command += "-s 3 -p 3 "
+  run_command(command, "archive_" + basename, output)
+  return check_all(output, True, False, True, False, False)
+
+def test_msa_scanner(pargenes_script):
+  basename = get_basename(pargenes_script)
+  output = os.path.join(tests_output_dir, "test_msa_scanner", basename)
+  shutil.rmtree(output, ignore_errors = True)
+  command = pargenes_script + " "
+  command += "-a " + example_msas + " "
+  command += "-o " + output + " "
+  command += "-c 4 "
+  command += "-m "
+  command += "-b 3 "
+  command += "--msa-scanner native "
+  command += " --modeltest-global-parameters " + example_modeltest_parameters
+  run_command(command, "msa_scanner_" + basename, output)
+  try:
+    for msa in valid_msas:
+      # the families are read by several jobs, so they also get a binary MSA
+      prefix = os.path.join(output, "parse_run", "results", msa, msa)
+      assert os.path.isfile(prefix + ".scan.txt")
+      assert os.path.isfile(prefix + ".raxml.rba")
+  except:
+    print("FAILURE!!!!")
+    return 1
+  return check_all(output, True, True, True, False, False)
+
+def test_continue(pargenes_script):
+  basename = get_basename(pargenes_script)
+  output = os.path.join(tests_output_dir, "test_continue", basename)
+  shutil.rmtree(output, ignore_errors = True)
+  command = pargenes_script + " "
+  command += "-a " + example_msas + " "
+  command += "-o " + output + " "
+  command += "-r " + example_raxml_options + " "
+  command += "-c 4 "
+  command += "-b 3 "
+  run_command(command, "continue_first_" + basename, output)
+  # simulate a run interrupted during the mlsearch batch: the jobs of some
+  # families completed, but were not recorded in results.db yet
+  connection = sqlite3.connect(os.path.join(output, "results.db"))
+  connection.execute("DELETE FROM jobs WHERE family IN (?, ?)", (valid_msas[0], valid_msas[1]))
+  connection.commit()
+  connection.close()
+  for directory in ["concatenated_bootstraps", "supports_run"]:
+    shutil.rmtree(os.path.join(output, directory))
+  with open(os.path.join(output, "checkpoint"), "w") as writer:
+    writer.write("1")
+  run_command(command + "--continue", "continue_" + basename, output)
+  try:
+    for msa in valid_msas:
+      assert os.path.isfile(os.path.join(output, "concatenated_bootstraps", msa + ".bs"))
+      assert os.path.isfile(os.path.join(output, "supports_run", "results", msa + ".support.raxml.support"))
+  except:
+    print("FAILURE!!!!")
+    return 1
+  return check_all(output, True, False, True, False, False)
+
 try:
   os.makedirs(tests_output_dir)
 except:
@@ -276,6 +442,14 @@ for pargenes_script in pargenes_scripts:
   failures += test_aster(pargenes_script)
   failures += test_all(pargenes_script)
   failures += test_all_aster(pargenes_script)
+# the pipelined mode only runs with the fork scheduler (pargenes.py)
+failures += test_pipeline(pargenes_scripts[0])
+failures += test_python_scheduler(pargenes_scripts[0])
+failures += test_cache(pargenes_scripts[0])
+failures += test_archive(pargenes_scripts[0])
+failures += test_msa_scanner(pargenes_scripts[0])
+failures += test_continue(pargenes_scripts[0])
+failures += test_model_change(pargenes_scripts[0])
 
 print("")
 if (failures > 0):
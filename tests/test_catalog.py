@@ -0,0 +1,97 @@
+import os
+import sys
+import pickle
+import shutil
+import tempfile
+import unittest
+
+tests_path = os.path.dirname(os.path.realpath(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(tests_path), "pargenes", "pargenes_src"))
+import commons
+import catalog
+import admission
+import raxml
+
+"""
+Unit tests of the MSA catalog (catalog.py): catalogs written by save_msas,
+and MSAs pickled by the ParGenes versions without catalog.
+Run with: python -m unittest discover tests
+"""
+
+class LegacyMSA:
+  """ MSA class of the ParGenes versions without __slots__ """
+  pass
+
+def write_legacy_pickle(path, states):
+  """ Pickle the MSAs of states as these versions did: LegacyMSA stands
+  for commons.MSA while the MSAs are pickled """
+  msas = {}
+  for name, state in states.items():
+    msa = LegacyMSA()
+    msa.__dict__.update(state)
+    msas[name] = msa
+  current = commons.MSA
+  LegacyMSA.__module__ = "commons"
+  LegacyMSA.__qualname__ = "MSA"
+  commons.MSA = LegacyMSA
+  try:
+    with open(path, "wb") as writer:
+      pickle.dump(msas, writer)
+  finally:
+    commons.MSA = current
+
+class Options:
+  def __init__(self, output_dir):
+    self.output_dir = output_dir
+
+class TestCatalog(unittest.TestCase):
+  def setUp(self):
+    self.tmp_dir = tempfile.mkdtemp()
+    os.makedirs(os.path.join(self.tmp_dir, "parse_run"))
+    self.op = Options(self.tmp_dir)
+
+  def tearDown(self):
+    shutil.rmtree(self.tmp_dir)
+
+  def test_save_and_load(self):
+    msa = commons.MSA("msa1_fasta", "/data/msa1.fasta", "--model GTR+G --blopt nr_safe", "")
+    msa.taxa = 12
+    msa.memory = 3.5
+    msa.allocated_cores = 4
+    catalog.save_msas({msa.name: msa}, self.op)
+    loaded = catalog.load_msas(self.op)["msa1_fasta"]
+    for field in commons.MSA.__slots__:
+      self.assertEqual(getattr(loaded, field), getattr(msa, field), field)
+
+  def test_load_legacy_pickle(self):
+    state = {
+      "name": "msa1_fasta",
+      "path": "/data/msa1.fasta",
+      "valid": True,
+      "binary_path": "/out/parse_run/results/msa1_fasta/msa1_fasta.raxml.rba",
+      "taxa": 12,
+      "per_taxon_clv_size": 160,
+      "patterns": 40,
+      "cores": 2,
+      "model": "GTR+G",
+      "raxml_args": ["--blopt", "nr_safe"],
+      "modeltest_arguments": "",
+      "flag_disable_sorting": False,
+    }
+    write_legacy_pickle(os.path.join(self.tmp_dir, "parse_run", "msas_checkpoint.bin"), {"msa1_fasta": state})
+    msa = catalog.load_msas(self.op)["msa1_fasta"]
+    self.assertIsInstance(msa, commons.MSA)
+    self.assertEqual(msa.taxa, 12)
+    self.assertEqual(msa.get_model(), "GTR+G")
+    self.assertEqual(msa.raxml_args, ("--blopt", "nr_safe"))
+    # the fields added after this version have their default value
+    for field, value in commons.get_default_fields():
+      if (not field in state):
+        self.assertEqual(getattr(msa, field), value, field)
+    # and the code using them works on the restored MSA
+    self.assertEqual(admission.get_job_memory(msa, 2), 0.0)
+    raxml.apply_cores_assignment_limit(msa, None)
+    self.assertEqual(msa.cores, 2)
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,105 @@
+import os
+import sys
+import argparse
+import unittest
+
+tests_path = os.path.dirname(os.path.realpath(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(tests_path), "pargenes", "pargenes_src"))
+import commons
+import raxml
+import bootstopping
+import plan
+
+"""
+Unit tests of the planning mode (plan.py): the jobs of each step are
+generated again for each simulated number of cores.
+Run with: python -m unittest discover tests
+"""
+
+def get_options(**kwargs):
+  options = {
+    "cores": 4,
+    "use_modeltest": False,
+    "modeltest_cores": 4,
+    "constrain_search": False,
+    "random_starting_trees": 1,
+    "parsimony_starting_trees": 0,
+    "adaptive_starting_trees": False,
+    "bootstraps": 0,
+    "autoMRE": False,
+    "parallel_autoMRE": False,
+    "core_assignment": "medium",
+    "datatype": "nt",
+  }
+  options.update(kwargs)
+  return argparse.Namespace(**options)
+
+def get_msas(number):
+  msas = {}
+  for i in range(0, number):
+    msa = commons.MSA("msa" + str(i), "msa" + str(i) + ".fasta", "--model GTR+G", "")
+    msa.taxa = 20 + 10 * i
+    msa.patterns = 500
+    msa.per_taxon_clv_size = 8000
+    msa.memory = 10.0
+    msa.cores = 2
+    msa.min_cores = 1
+    msa.max_cores = 8
+    msa.parse_model = msa.get_model()
+    msas[msa.name] = msa
+  return msas
+
+def count_jobs(steps, name):
+  return [len(jobs) for step, batches in steps if step == name for jobs in batches]
+
+class TestPlanSteps(unittest.TestCase):
+  def test_bootstrap_chunks_per_cores(self):
+    msas = get_msas(4)
+    op = get_options(bootstraps = 1000)
+    jobs = {}
+    for cores in [2, 64]:
+      jobs[cores] = sum(count_jobs(plan.get_steps(msas, cores, op), "mlsearch"))
+      chunk_sizes = raxml.get_bootstrap_chunk_sizes(msas, op.bootstraps, cores, None, op)
+      expected = sum(raxml.get_bootstrap_chunks_number(op.bootstraps, chunk_sizes[name], op) for name in msas)
+      self.assertEqual(jobs[cores], len(msas) + expected)
+    self.assertLess(jobs[2], jobs[64])
+
+  def test_makespan_assignment_per_cores(self):
+    msas = get_msas(4)
+    op = get_options(core_assignment = "makespan")
+    for cores in [4, 64]:
+      steps = plan.get_steps(msas, cores, op)
+      mlsearch = [jobs for step, batches in steps if step == "mlsearch" for jobs in batches][0]
+      self.assertLessEqual(sum(job.cores for job in mlsearch), max(cores, len(msas) * 8))
+    # the MSAs of the run are not changed
+    self.assertEqual([msa.cores for msa in msas.values()], [2] * len(msas))
+    self.assertEqual([msa.allocated_cores for msa in msas.values()], [0] * len(msas))
+
+  def test_constraint_steps(self):
+    msas = get_msas(3)
+    steps = plan.get_steps(msas, 4, get_options(constrain_search = True))
+    self.assertEqual(count_jobs(steps, "constraint"), [3, 3])
+
+  def test_adaptive_waves(self):
+    msas = get_msas(2)
+    op = get_options(random_starting_trees = 5, parsimony_starting_trees = 5, adaptive_starting_trees = True)
+    waves = []
+    wave = 0
+    while (len(raxml.get_starting_trees_wave(5, 5, wave)) > 0):
+      waves.append(len(raxml.get_starting_trees_wave(5, 5, wave)) * len(msas))
+      wave += 1
+    self.assertEqual(count_jobs(plan.get_steps(msas, 4, op), "mlsearch"), waves)
+
+  def test_bootstopping_waves(self):
+    msas = get_msas(2)
+    op = get_options(bootstraps = 200, autoMRE = True, parallel_autoMRE = True)
+    batches = count_jobs(plan.get_steps(msas, 4, op), "mlsearch")
+    chunk_sizes = raxml.get_bootstrap_chunk_sizes(msas, op.bootstraps, 4, None, op)
+    total = sum(raxml.get_bootstrap_chunks_number(op.bootstraps, chunk_sizes[name], op) for name in msas)
+    self.assertGreater(len(batches), 1)
+    self.assertEqual(sum(batches), len(msas) + total)
+    for name in msas:
+      self.assertLessEqual(chunk_sizes[name], bootstopping.BOOTSTOPPING_INTERVAL)
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,79 @@
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+
+tests_path = os.path.dirname(os.path.realpath(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(tests_path), "pargenes", "pargenes_src"))
+import retry
+
+"""
+Unit tests of the classification of the failed jobs (retry.py).
+Run with: python -m unittest discover tests
+"""
+
+class TestClassifyFailure(unittest.TestCase):
+  def setUp(self):
+    self.tmp_dir = tempfile.mkdtemp()
+
+  def tearDown(self):
+    shutil.rmtree(self.tmp_dir)
+
+  def classify(self, content):
+    log_file = os.path.join(self.tmp_dir, "job_out.txt")
+    with open(log_file, "w") as writer:
+      writer.write(content)
+    return retry.classify_failure(log_file)
+
+  def test_missing_log(self):
+    self.assertEqual(retry.classify_failure(os.path.join(self.tmp_dir, "missing.txt")), "unknown")
+
+  def test_oom(self):
+    self.assertEqual(self.classify("terminate called after throwing an instance of 'std::bad_alloc'\n"), "oom")
+    self.assertEqual(self.classify("RAxML-NG\n" + retry.EXIT_CODE_PREFIX + "-9\n"), "oom")
+    self.assertEqual(self.classify("Killed\n" + retry.EXIT_CODE_PREFIX + "137\n"), "oom")
+
+  def test_timeout(self):
+    self.assertEqual(self.classify("slurmstepd: error: *** JOB 42 CANCELLED DUE TO TIME LIMIT ***\n"), "timeout")
+    self.assertEqual(self.classify(retry.EXIT_CODE_PREFIX + "124\n"), "timeout")
+
+  def test_segfault(self):
+    self.assertEqual(self.classify("Segmentation fault (core dumped)\n"), "segfault")
+    self.assertEqual(self.classify(retry.EXIT_CODE_PREFIX + "-11\n"), "segfault")
+
+  def test_raxml_bad_input(self):
+    content = "RAxML-NG v. 1.2.0\n\nERROR: Your alignment contains less than 4 sequences! \n"
+    self.assertEqual(self.classify(content + retry.EXIT_CODE_PREFIX + "1\n"), "bad_input")
+
+  def test_modeltest_bad_input(self):
+    content = "ModelTest-NG v0.1.7\n\nError: Cannot parse the MSA file\n"
+    self.assertEqual(self.classify(content + retry.EXIT_CODE_PREFIX + "1\n"), "bad_input")
+
+  def test_error_word_is_not_bad_input(self):
+    # the word error alone does not make an input error
+    self.assertEqual(self.classify("[00:00:01] Error rate of the search: 0.01\n" + retry.EXIT_CODE_PREFIX + "1\n"), "unknown")
+    self.assertEqual(self.classify("mpi-scheduler: job error\n"), "unknown")
+
+  def test_oom_before_bad_input(self):
+    content = "ERROR: cannot allocate memory for the CLVs\n"
+    self.assertEqual(self.classify(content), "oom")
+
+class TestRetryCores(unittest.TestCase):
+  def test_escalated(self):
+    self.assertEqual(retry.get_retry_cores(2, "oom", 16), 4)
+    self.assertEqual(retry.get_retry_cores(4, "timeout", 16), 8)
+
+  def test_capped(self):
+    self.assertEqual(retry.get_retry_cores(8, "oom", 12), 12)
+    self.assertEqual(retry.get_retry_cores(16, "timeout", 16), 16)
+
+  def test_not_escalated(self):
+    for failure in ["segfault", "bad_input", "unknown"]:
+      self.assertEqual(retry.get_retry_cores(3, failure, 16), 3)
+
+  def test_at_least_one_core(self):
+    self.assertEqual(retry.get_retry_cores(0, "oom", 0), 1)
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,88 @@
+import os
+import sys
+import unittest
+
+tests_path = os.path.dirname(os.path.realpath(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(tests_path), "pargenes", "pargenes_src"))
+import scanner
+
+"""
+Unit tests of the native MSA scanner (scanner.py), on the example MSAs.
+The site patterns are counted with and without numpy (when it is installed).
+Run with: python -m unittest discover tests
+"""
+
+example_msas = os.path.join(tests_path, "smalldata", "fasta_files")
+# taxa, sites and patterns of the valid example MSAs
+example_dimensions = {
+  "msa1.fasta": (4, 50, 39),
+  "msa2.fasta": (10, 50, 50),
+  "msa3.fasta": (4, 50, 39),
+  "msa4.fasta": (4, 50, 38),
+}
+
+def read_example(name):
+  return scanner.read_msa(os.path.join(example_msas, name))
+
+class CountPatternsMixin:
+  """ Tests of count_patterns, run with use_numpy set by the subclasses """
+  def setUp(self):
+    self.numpy = scanner.numpy
+    if (not self.use_numpy):
+      scanner.numpy = None
+
+  def tearDown(self):
+    scanner.numpy = self.numpy
+
+  def test_examples(self):
+    for name, dimensions in example_dimensions.items():
+      names, sequences = read_example(name)
+      self.assertEqual(scanner.count_patterns(sequences, "nt"), dimensions[2], name)
+
+  def test_duplicated_columns(self):
+    self.assertEqual(scanner.count_patterns(["AAC", "CCA", "GGT", "TTG"], "nt"), 2)
+
+  def test_undetermined_column(self):
+    # the columns with only undetermined characters are not patterns
+    self.assertEqual(scanner.count_patterns(["A-N", "C?-", "G.N", "TN-"], "nt"), 1)
+
+  def test_undetermined_characters(self):
+    # all the undetermined characters are the same state, in any case
+    self.assertEqual(scanner.count_patterns(["A-", "CN", "g?", "tn"], "nt"), 1)
+
+  def test_amino_acids(self):
+    self.assertEqual(scanner.count_patterns(["ARX", "RAX", "ARX", "NDX"], "aa"), 2)
+
+class TestCountPatternsPython(CountPatternsMixin, unittest.TestCase):
+  use_numpy = False
+
+@unittest.skipIf(scanner.numpy == None, "numpy is not installed")
+class TestCountPatternsNumpy(CountPatternsMixin, unittest.TestCase):
+  use_numpy = True
+
+class TestValidate(unittest.TestCase):
+  def test_examples(self):
+    for name, dimensions in example_dimensions.items():
+      names, sequences = read_example(name)
+      scanner.validate(names, sequences, "nt")
+      self.assertEqual((len(names), len(sequences[0])), dimensions[:2], name)
+
+  def test_too_few_taxa(self):
+    names, sequences = read_example("msa5.fasta")
+    self.assertRaises(scanner.ScanError, scanner.validate, names, sequences, "nt")
+
+  def test_duplicated_names(self):
+    self.assertRaises(scanner.ScanError, scanner.validate, ["a", "b", "c", "a"], ["AC", "AC", "AC", "AC"], "nt")
+
+  def test_different_lengths(self):
+    self.assertRaises(scanner.ScanError, scanner.validate, ["a", "b", "c", "d"], ["AC", "AC", "ACG", "AC"], "nt")
+
+  def test_empty_sequences(self):
+    self.assertRaises(scanner.ScanError, scanner.validate, ["a", "b", "c", "d"], ["", "", "", ""], "nt")
+
+  def test_invalid_characters(self):
+    self.assertRaises(scanner.ScanError, scanner.validate, ["a", "b", "c", "d"], ["AC", "AC", "AE", "AC"], "nt")
+    scanner.validate(["a", "b", "c", "d"], ["AE", "AC", "AE", "AC"], "aa")
+
+if __name__ == "__main__":
+  unittest.main()